@@ -0,0 +1,156 @@
+"""
+Benchmarks of each stage of converting a photo to a map.
+
+The photos are synthetic eclipses of 6, 24 and 50 megapixels made by
+`eclipse.synthetic`, so that the accuracy of the detection can be tracked
+against the known position of the Moon as well as the time and memory of
+each stage. Run them with ``asv run`` or ``asv dev`` from the root of the
+repository.
+"""
+import os
+import tempfile
+
+import matplotlib.image
+import numpy as np
+import scipy.ndimage as ndimage
+
+import eclipse.meta as m
+from eclipse.process import (_find_disk_roi, _sobel_magnitude,
+                             eclipse_image_to_map, find_sun_center_and_radius,
+                             find_sun_in_photo, rgb_to_gray)
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+# The shapes of photos of about 6, 24 and 50 megapixels
+SHAPES = {6: (2000, 3000), 24: (4000, 6000), 50: (5792, 8688)}
+
+
+def _make_photos():
+    directory = tempfile.mkdtemp(prefix='eclipse-benchmarks-')
+    photos = {}
+    for megapixels, shape in SHAPES.items():
+        im_rgb, truth = make_eclipse_image(shape, seed=megapixels)
+        filename = os.path.join(directory, f'eclipse_{megapixels}mp.jpg')
+        write_eclipse_photo(filename, im_rgb)
+        photos[megapixels] = filename, truth
+    return photos
+
+
+class Stages:
+    """
+    The time and peak memory of each stage of `eclipse_image_to_map`.
+    """
+    params = list(SHAPES)
+    param_names = ['megapixels']
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_photos()
+
+    def setup(self, photos, megapixels):
+        self.filename, self.truth = photos[megapixels]
+        self.im_rgb = np.flipud(matplotlib.image.imread(self.filename))
+        self.im = rgb_to_gray(self.im_rgb, dtype=np.float32)
+        self.blur_im = ndimage.gaussian_filter(self.im, 8)
+        slice_x, slice_y = _find_disk_roi(self.blur_im)
+        self.roi = self.blur_im[slice_x, slice_y]
+        self.tags = m.read_exif(self.filename)
+        self.disk = find_sun_center_and_radius(self.im, pyramid_levels=2)
+
+    def time_decode(self, photos, megapixels):
+        matplotlib.image.imread(self.filename)
+
+    def time_grayscale(self, photos, megapixels):
+        rgb_to_gray(self.im_rgb, dtype=np.float32)
+
+    def time_blur_label(self, photos, megapixels):
+        _find_disk_roi(ndimage.gaussian_filter(self.im, 8))
+
+    def time_sobel(self, photos, megapixels):
+        _sobel_magnitude(self.roi)
+
+    def time_hough_pyramid(self, photos, megapixels):
+        find_sun_center_and_radius(self.im, pyramid_levels=2)
+
+    def time_limb_fit(self, photos, megapixels):
+        find_sun_center_and_radius(self.im, method='fit')
+
+    def time_reduced_decode_fit(self, photos, megapixels):
+        find_sun_in_photo(self.filename, method='fit')
+
+    def time_exif(self, photos, megapixels):
+        m.read_exif(self.filename)
+
+    def time_meta(self, photos, megapixels):
+        # clear the cache of the ephemeris so that it is timed too
+        m.ephemeris.clear()
+        im_cx, im_cy, im_radius = self.disk
+        time = m.get_image_time(self.tags)
+        plate_scale = m.get_plate_scale(time, im_radius)
+        m.build_meta(m.build_wcs(im_cx, im_cy, plate_scale), self.tags)
+
+
+class PeakMemory:
+    """
+    The peak memory of decoding a photo and of the whole conversion.
+
+    These have no setup, so that only the arrays of the stage itself count.
+    """
+    params = list(SHAPES)
+    param_names = ['megapixels']
+    timeout = 600
+
+    def setup_cache(self):
+        return _make_photos()
+
+    def peakmem_decode(self, photos, megapixels):
+        matplotlib.image.imread(photos[megapixels][0])
+
+    def peakmem_decode_grayscale(self, photos, megapixels):
+        im_rgb = np.flipud(matplotlib.image.imread(photos[megapixels][0]))
+        rgb_to_gray(im_rgb, dtype=np.float32)
+
+    def peakmem_photo_to_map(self, photos, megapixels):
+        eclipse_image_to_map(photos[megapixels][0], pyramid_levels=2)
+
+    def peakmem_photo_to_map_float32(self, photos, megapixels):
+        eclipse_image_to_map(photos[megapixels][0], pyramid_levels=2,
+                             dtype=np.float32)
+
+    def peakmem_reduced_decode_fit(self, photos, megapixels):
+        find_sun_in_photo(photos[megapixels][0], method='fit')
+
+
+class Accuracy:
+    """
+    The error in pixels of the centre and radius found by each detection
+    method, compared to the synthetic truth.
+    """
+    params = (list(SHAPES), ['pyramid', 'fit', 'reduced fit'])
+    param_names = ['megapixels', 'method']
+    timeout = 600
+    unit = 'pixels'
+
+    def setup_cache(self):
+        return _make_photos()
+
+    def setup(self, photos, megapixels, method):
+        filename, truth = photos[megapixels]
+        if method == 'reduced fit':
+            result = find_sun_in_photo(filename, method='fit')
+        else:
+            im_rgb = np.flipud(matplotlib.image.imread(filename))
+            im = rgb_to_gray(im_rgb, dtype=np.float32)
+            if method == 'pyramid':
+                result = find_sun_center_and_radius(im, pyramid_levels=2)
+            else:
+                result = find_sun_center_and_radius(im, method='fit')
+        im_cx, im_cy, im_radius = (value[0].value for value in result)
+        self.center_error = np.hypot(im_cx - truth['im_cx'],
+                                     im_cy - truth['im_cy'])
+        self.radius_error = abs(im_radius - truth['im_radius'])
+
+    def track_center_error(self, photos, megapixels, method):
+        return self.center_error
+
+    def track_radius_error(self, photos, megapixels, method):
+        return self.radius_error
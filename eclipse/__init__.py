@@ -1,7 +1,30 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
-from pkg_resources import resource_filename
+import importlib
+import os
 
 from .version import __version__
 
-SAMPLE_PHOTO = resource_filename('eclipse.sample_photos', 'total_solar_eclipse2017.jpg')
+try:
+    from importlib.resources import files
+except ImportError:  # Python < 3.9
+    SAMPLE_PHOTO = os.path.join(os.path.dirname(__file__), 'sample_photos',
+                                'total_solar_eclipse2017.jpg')
+else:
+    SAMPLE_PHOTO = os.fspath(files('eclipse.sample_photos') /
+                             'total_solar_eclipse2017.jpg')
 
+# The submodules are imported when first used, as most import sunpy, which is
+# slow to import, and many uses need only a few of them.
+_SUBMODULES = {'batch', 'cache', 'cli', 'coalign', 'ephemeris', 'exif', 'index',
+               'meta', 'platesolve', 'process', 'profiling', 'scan',
+               'sequence', 'service', 'stack', 'synthetic', 'tiled'}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
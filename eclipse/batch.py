@@ -0,0 +1,239 @@
+"""Procedures to convert many photographs to maps in parallel."""
+import glob
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from eclipse import profiling
+from eclipse.cache import ResultCache, _normalize_params
+
+__all__ = ['BatchResult', 'find_photos', 'process_batch']
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg')
+
+BatchResult = namedtuple('BatchResult', ['filename', 'output', 'error',
+                                         'profile', 'header'],
+                         defaults=[None, None])
+BatchResult.__doc__ = """
+The result of converting one photo in a batch.
+
+``output`` is the filename of the FITS file written, or `None` if the photo
+could not be converted, in which case ``error`` describes why. ``profile`` is
+the time and memory of each stage, see `eclipse.profiling.Profile.to_dict`,
+if the batch was profiled. ``header`` is the header of the map as a `dict`.
+"""
+
+
+def find_photos(path):
+    """
+    Find the photos to process.
+
+    Parameters
+    ----------
+    path : `str`
+        A directory, in which case all the JPEG files in it are returned, or a
+        glob pattern.
+
+    Returns
+    -------
+    filenames : `list` of `str`
+        The sorted filenames of the photos.
+    """
+    if os.path.isdir(path):
+        filenames = [os.path.join(path, f) for f in os.listdir(path)
+                     if f.lower().endswith(PHOTO_EXTENSIONS)]
+    else:
+        filenames = glob.glob(path)
+    return sorted(filenames)
+
+
+def _output_filename(filename, output_dir, taken=None):
+    """
+    The filename of the FITS file of a photo, named after the photo.
+
+    ``taken`` maps the lower case names already given out to the paths of
+    their photos, and is updated. A photo whose name has been given to
+    another photo, such as one of the same name in another directory, has a
+    short hash of its path added to its name.
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if taken is not None:
+        path = os.path.abspath(filename)
+        if taken.setdefault(name.lower(), path) != path:
+            digest = hashlib.sha1(path.encode()).hexdigest()[:8]
+            name = f'{name}-{digest}'
+            taken[name.lower()] = path
+    return os.path.join(output_dir, name + '.fits')
+
+
+def _disk_from_header(header):
+    """
+    The centre and radius in pixels of the Sun from the header of a map.
+    """
+    return {'im_cx': header['crpix2'], 'im_cy': header['crpix1'],
+            'im_radius': header['rsun_obs'] / header['cdelt1']}
+
+
+def _process_photo(filename, output, overwrite, kwargs, cache,
+                   profile=False):
+    """
+    Convert one photo to a map and save it to ``output``, measuring the time
+    and memory of each stage if ``profile`` is true.
+    """
+    if not profile:
+        return _convert_photo(filename, output, overwrite, kwargs, cache)
+    with profiling.profile() as p:
+        with profiling._stage('total'):
+            result = _convert_photo(filename, output, overwrite, kwargs,
+                                    cache)
+    return result._replace(profile=p.to_dict())
+
+
+def _convert_photo(filename, output, overwrite, kwargs, cache):
+    """
+    Convert one photo to a map and save it, recording rather than raising any
+    error so that one bad photo does not stop the batch.
+
+    If the photo is in the cache the Sun is not searched for again, and if its
+    FITS file has also been written already it is skipped.
+    """
+    # imported here so that finding photos does not import sunpy
+    from eclipse.process import eclipse_image_to_map
+
+    try:
+        key = cached = None
+        if cache is not None:
+            key = cache.key(filename, kwargs)
+            cached = cache.get(key)
+        if cached is not None and os.path.exists(output) and not overwrite:
+            return BatchResult(filename, output, None,
+                               header=cached['header'])
+
+        header = cached['header'] if cached is not None else None
+        sunpymap = eclipse_image_to_map(filename, header=header, **kwargs)
+        header = dict(sunpymap.meta)
+        if cache is not None and cached is None:
+            cache.put(key, dict(_disk_from_header(header), header=header))
+        with profiling._stage('save'):
+            sunpymap.save(output, overwrite=overwrite)
+    except Exception as e:
+        return BatchResult(filename, None, f'{type(e).__name__}: {e}')
+    return BatchResult(filename, output, None, header=header)
+
+
+def _future_result(future, filename):
+    """
+    The result of a photo, or an error if its process died.
+    """
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        return BatchResult(filename, None, f'{type(e).__name__}: {e}')
+
+
+def process_batch(filenames, output_dir, max_workers=None, overwrite=False,
+                  cache=None, profile=False, index=None, **kwargs):
+    """
+    Convert photos to maps with a pool of processes and save each as a FITS
+    file.
+
+    The results are yielded as each photo finishes, not in the order of
+    ``filenames``. Only a few photos per process are queued at a time, so
+    that very large batches can be streamed. If a process dies, for example
+    when it runs out of memory, the photos it and the other processes were
+    converting are recorded as failed and the batch goes on with a new pool.
+
+    Parameters
+    ----------
+    filenames : iterable of `str`
+        The filenames of the photos.
+
+    output_dir : `str`
+        The directory to write the FITS files to. Each file is named after its
+        photo, with a short hash of the path of the photo added if another
+        photo of the batch has the same name.
+
+    max_workers : `int`, optional
+        The number of processes. Defaults to the number of CPUs.
+
+    overwrite : `bool`, optional
+        Whether to overwrite existing FITS files. Defaults to `False`.
+
+    cache : `eclipse.cache.ResultCache` or `str`, optional
+        A cache, or the directory of one, of the detected disk and the header
+        of each photo. Photos found in the cache are not searched again, and
+        are skipped completely if their FITS file exists, so that an
+        interrupted batch can be resumed. Defaults to `None`, no cache.
+
+    profile : `bool`, optional
+        Whether to measure the time and memory of each stage of each photo,
+        see `eclipse.profiling`. The measurements are returned in the
+        ``profile`` of each result, and can be summarized with
+        `eclipse.profiling.summarize_profiles`. Defaults to `False`.
+
+    index : `eclipse.index.PhotoIndex` or `str`, optional
+        An index, or the filename of one, to add the time, location, camera
+        and disk of each photo converted to. Defaults to `None`, no index.
+
+    kwargs
+        Passed to `eclipse.process.eclipse_image_to_map`.
+
+    Yields
+    ------
+    result : `BatchResult`
+        The result for each photo.
+
+    Raises
+    ------
+    TypeError
+        If there is a cache and ``kwargs`` cannot be part of its keys, see
+        `eclipse.cache.ResultCache.key`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if isinstance(cache, str):
+        cache = ResultCache(cache)
+    if cache is not None:
+        # fail before the batch starts if the parameters cannot be keyed
+        _normalize_params(kwargs)
+    if isinstance(index, str):
+        from eclipse.index import PhotoIndex
+        index = PhotoIndex(index)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = 2 * max_workers
+    filenames = iter(filenames)
+    taken = {}
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        pending = {}
+        while True:
+            for filename in filenames:
+                output = _output_filename(filename, output_dir, taken)
+                future = executor.submit(_process_photo, filename, output,
+                                         overwrite, kwargs, cache, profile)
+                pending[future] = filename
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            results = [_future_result(future, pending.pop(future))
+                       for future in done]
+            if any(isinstance(future.exception(), BrokenProcessPool)
+                   for future in done):
+                # a process died, for example running out of memory, and
+                # took the photos still in the pool with it
+                wait(pending)
+                results += [_future_result(future, filename)
+                            for future, filename in pending.items()]
+                pending = {}
+                executor.shutdown()
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            for result in results:
+                if index is not None and result.error is None:
+                    index.add_header(result.filename, result.header,
+                                     result.output)
+                yield result
+    finally:
+        executor.shutdown()
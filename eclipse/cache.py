@@ -0,0 +1,197 @@
+"""An on-disk cache of the results of processing photographs."""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+__all__ = ['ResultCache']
+
+# Increase this when the way results are computed or stored changes, so that
+# old entries are no longer found.
+CACHE_VERSION = 1
+
+
+def _normalize(name, value):
+    """
+    A JSON serializable form of the parameter ``name``, which is the same for
+    equal values of different types, such as a `numpy.dtype` and the type it
+    was made from.
+    """
+    if isinstance(value, (str, bool, int, float)) or value is None:
+        return value
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    if isinstance(value, (np.dtype, type)):
+        try:
+            return np.dtype(value).str
+        except TypeError:
+            pass
+    elif isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    elif isinstance(value, (list, tuple)):
+        return [_normalize(name, v) for v in value]
+    elif isinstance(value, dict):
+        return {str(k): _normalize(name, v) for k, v in value.items()}
+    raise TypeError(f'The parameter {name!r} of type {type(value).__name__} '
+                    'cannot be part of a cache key. Pass a value that can be '
+                    'written to JSON, such as the filename of a grid rather '
+                    'than the grid.')
+
+
+def _normalize_params(params):
+    """
+    The parameters of a cache key in a JSON serializable form.
+    """
+    return {str(k): _normalize(k, v) for k, v in (params or {}).items()}
+
+
+class ResultCache:
+    """
+    A directory of results keyed by the content of a photo and the parameters
+    it was processed with.
+
+    Each result is a JSON serializable `dict` stored in its own file. When
+    the total size of the cache grows beyond ``max_bytes`` the least recently
+    used results are removed. Several processes can share one cache.
+
+    Parameters
+    ----------
+    directory : `str`
+        The directory to keep the cache in. It is created if needed.
+
+    max_bytes : `int`, optional
+        The largest total size of the cache. Defaults to `None`, no limit.
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({self.directory!r}, '
+                f'max_bytes={self.max_bytes})')
+
+    @staticmethod
+    def key(filename, params=None):
+        """
+        The key of a photo, the hash of its bytes and of the parameters used
+        to process it.
+
+        Parameters
+        ----------
+        filename : `str`
+            The filename of the photo.
+
+        params : `dict`, optional
+            The parameters the photo is processed with. Strings, numbers,
+            paths, numpy types and sequences and dictionaries of them are
+            allowed.
+
+        Raises
+        ------
+        TypeError
+            If a parameter, such as a grid rather than the filename of one,
+            has no stable JSON form.
+        """
+        params = _normalize_params(params)
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps([CACHE_VERSION, params],
+                                 sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                yield entry
+
+    def get(self, key):
+        """
+        Return the result stored for ``key``, or `None` if there is none.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        # mark the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Store the ``result`` for ``key`` and evict old results if the cache is
+        too large.
+        """
+        # write to a temporary file first so that readers never see a
+        # partial result
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes):
+        """
+        Remove the least recently used results until the cache is no larger
+        than ``max_bytes``.
+        """
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        """
+        Remove the result for ``key``, or every result if ``key`` is `None`.
+        """
+        if key is not None:
+            paths = [self._path(key)]
+        else:
+            paths = [entry.path for entry in self._entries()]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @property
+    def size(self):
+        """
+        The total size of the results in the cache in bytes.
+        """
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def __len__(self):
+        return sum(1 for _ in self._entries())
@@ -0,0 +1,49 @@
+"""The ``eclipse`` command line tool."""
+import argparse
+import sys
+
+__all__ = ['main']
+
+
+def scan(args):
+    """
+    Write an index of the EXIF meta data of a directory of photos.
+    """
+    from eclipse.batch import find_photos
+    from eclipse.scan import scan_photos, write_index
+
+    filenames = find_photos(args.path)
+    rows = scan_photos(filenames, max_workers=args.workers)
+    if args.output == '-':
+        write_index(rows, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as f:
+            n_rows = write_index(rows, f)
+        print(f'{n_rows} photos indexed in {args.output}')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='eclipse', description='Process photos of solar eclipses.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    scan_parser = subparsers.add_parser(
+        'scan', help='index the EXIF meta data of a directory of photos')
+    scan_parser.add_argument('path', help='a directory or a glob pattern')
+    scan_parser.add_argument('-o', '--output', default='-',
+                             help='the CSV file to write, defaults to the '
+                                  'standard output')
+    scan_parser.add_argument('-j', '--workers', type=int, default=None,
+                             help='the number of processes, defaults to one')
+    scan_parser.set_defaults(function=scan)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Procedures to co-register the maps of many observers onto one grid."""
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import astropy.io.fits as fits
+import astropy.units as u
+import astropy.wcs
+import numpy as np
+import scipy.ndimage as ndimage
+from sunpy.map import GenericMap
+
+__all__ = ['build_target_wcs', 'pixel_mapping', 'coalign_map',
+           'coalign_maps']
+
+# The header keys which describe the geometry of a map
+_GEOMETRY_KEYS = ('naxis1', 'naxis2', 'crpix1', 'crpix2', 'cdelt1', 'cdelt2',
+                  'crota2', 'crval1', 'crval2', 'ctype1', 'ctype2', 'cunit1',
+                  'cunit2')
+
+
+def _header_wcs(header):
+    """
+    The WCS of a header, built without any of the coordinate frame
+    information which sunpy adds, which is not needed to map pixels.
+    """
+    cards = {key: value for key, value in header.items()
+             if isinstance(value, (str, int, float)) and len(key) <= 8}
+    return astropy.wcs.WCS(fits.Header(cards))
+
+
+def build_target_wcs(headers, scale=None, shape=None, extent=3):
+    """
+    Build the WCS of a grid which all maps can be reprojected onto.
+
+    The grid is a helioprojective gnomonic projection centred on the Sun with
+    solar north up.
+
+    Parameters
+    ----------
+    headers : iterable of `dict`
+        The headers of the maps, for example as built by
+        `eclipse.meta.build_meta`.
+
+    scale : `astropy.units.Quantity`, optional
+        The plate scale of the grid. Defaults to the median plate scale of
+        the maps.
+
+    shape : `tuple` of `int`, optional
+        The number of rows and columns of the grid. Defaults to a square
+        which reaches ``extent`` solar radii from the centre.
+
+    extent : `float`, optional
+        The number of solar radii the grid reaches from the centre if
+        ``shape`` is not given. Defaults to 3.
+
+    Returns
+    -------
+    wcs : `astropy.wcs.WCS`
+        The WCS of the grid, whose ``array_shape`` is its shape.
+    """
+    headers = list(headers)
+    if scale is None:
+        scale = np.median([header['cdelt1'] for header in headers])
+    else:
+        scale = scale.to_value(u.arcsec / u.pix)
+    if shape is None:
+        rsun_obs = np.median([header['rsun_obs'] for header in headers])
+        side = int(np.ceil(2 * extent * rsun_obs / scale))
+        shape = (side, side)
+
+    wcs = astropy.wcs.WCS(naxis=2)
+    # the centre of the grid, counted from one as in FITS
+    wcs.wcs.crpix = [(shape[1] + 1) / 2, (shape[0] + 1) / 2]
+    wcs.wcs.cdelt = [scale, scale]
+    wcs.wcs.crval = [0, 0]
+    wcs.wcs.ctype = ['HPLN-TAN', 'HPLT-TAN']
+    wcs.wcs.cunit = ['arcsec', 'arcsec']
+    wcs.array_shape = shape
+    return wcs
+
+
+def _pixel_to_pixel(source_wcs, target_wcs, rows, columns):
+    """
+    The rows and columns of the source map of pixels of the target grid.
+    """
+    world = target_wcs.wcs_pix2world(np.column_stack([columns, rows]), 0)
+    pixels = source_wcs.wcs_world2pix(world, 0)
+    return pixels[:, 1], pixels[:, 0]
+
+
+def pixel_mapping(header, target_wcs):
+    """
+    The mapping from the pixels of the target grid to those of a map.
+
+    When the map and the grid are projected about the same point, which is
+    the case for the maps built by `eclipse.meta`, the mapping is affine and
+    is found from the headers alone, from a handful of pixels. Otherwise the
+    source pixel of every pixel of the grid is tabulated.
+
+    Parameters
+    ----------
+    header : `dict`
+        The header of the map.
+
+    target_wcs : `astropy.wcs.WCS`
+        The WCS of the grid, see `build_target_wcs`.
+
+    Returns
+    -------
+    mapping : `tuple`
+        Either the ``(matrix, offset)`` of an affine transform of (row,
+        column) grid pixels to map pixels, or the ``(rows, columns)`` map
+        pixels of every grid pixel.
+    """
+    source_wcs = _header_wcs(header)
+    # fit an affine transform through three pixels and check it at the
+    # corners of the grid
+    n_rows, n_columns = target_wcs.array_shape
+    rows = np.array([0., 1, 0, n_rows - 1, n_rows - 1, 0])
+    columns = np.array([0., 0, 1, n_columns - 1, 0, n_columns - 1])
+    source_rows, source_columns = _pixel_to_pixel(source_wcs, target_wcs,
+                                                  rows, columns)
+    offset = np.array([source_rows[0], source_columns[0]])
+    matrix = np.array([[source_rows[1], source_rows[2]],
+                       [source_columns[1], source_columns[2]]]) - offset[:, None]
+    predicted = matrix @ np.vstack([rows, columns]) + offset[:, None]
+    if np.allclose(predicted, [source_rows, source_columns], atol=1e-3):
+        return matrix, offset
+
+    rows, columns = np.indices(target_wcs.array_shape, dtype=float)
+    source_rows, source_columns = _pixel_to_pixel(
+        source_wcs, target_wcs, rows.ravel(), columns.ravel())
+    return (source_rows.reshape(rows.shape).astype(np.float32),
+            source_columns.reshape(rows.shape).astype(np.float32))
+
+
+def coalign_map(sunpymap, target_wcs, order=1):
+    """
+    Reproject a map onto a grid.
+
+    Parameters
+    ----------
+    sunpymap : `sunpy.map.GenericMap`
+        The map.
+
+    target_wcs : `astropy.wcs.WCS`
+        The WCS of the grid, see `build_target_wcs`.
+
+    order : `int`, optional
+        The order of the spline interpolation. Defaults to 1.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map on the grid, with the observer and EXIF meta data of the
+        original map. Pixels outside of the original map are NaN.
+    """
+    header = dict(sunpymap.meta)
+    header.setdefault('naxis1', sunpymap.data.shape[1])
+    header.setdefault('naxis2', sunpymap.data.shape[0])
+    first, second = pixel_mapping(header, target_wcs)
+    data = np.asarray(sunpymap.data)
+    dtype = np.promote_types(data.dtype.newbyteorder('='), np.float32)
+    if first.shape == (2, 2):
+        data = ndimage.affine_transform(data, first, offset=second,
+                                        output_shape=target_wcs.array_shape,
+                                        output=dtype, order=order,
+                                        mode='constant', cval=np.nan)
+    else:
+        data = ndimage.map_coordinates(data, [first, second], output=dtype,
+                                       order=order, mode='constant',
+                                       cval=np.nan)
+
+    for key in _GEOMETRY_KEYS:
+        header.pop(key, None)
+    unit = target_wcs.wcs.cunit[0]
+    scale = (target_wcs.wcs.cdelt * unit).to_value(u.arcsec)
+    crval = (target_wcs.wcs.crval * unit).to_value(u.arcsec)
+    header.update({'naxis1': target_wcs.array_shape[1],
+                   'naxis2': target_wcs.array_shape[0],
+                   'crpix1': target_wcs.wcs.crpix[0],
+                   'crpix2': target_wcs.wcs.crpix[1],
+                   'cdelt1': scale[0],
+                   'cdelt2': scale[1],
+                   'crota2': 0.0,
+                   'crval1': crval[0],
+                   'crval2': crval[1],
+                   'ctype1': 'HPLN-TAN',
+                   'ctype2': 'HPLT-TAN',
+                   'cunit1': 'arcsec',
+                   'cunit2': 'arcsec'})
+    return GenericMap(data=data, header=header)
+
+
+def _coalign_chunk(maps, target_wcs, order):
+    return [coalign_map(sunpymap, target_wcs, order=order)
+            for sunpymap in maps]
+
+
+def coalign_maps(maps, target_wcs=None, max_workers=None, chunksize=8,
+                 order=1):
+    """
+    Reproject many maps onto one helioprojective grid in parallel.
+
+    Every map is treated as seen from the centre of the Earth, the parallax
+    of the Sun between sites on the Earth being a few arcseconds at most.
+    The maps are sent to the processes in chunks, and only a few chunks per
+    process are in flight at a time, so that very many maps can be streamed
+    through without holding them all in memory. Maps which have not been
+    decoded yet, such as `eclipse.process.LazyMap`, are decoded in the
+    processes.
+
+    Parameters
+    ----------
+    maps : iterable of `sunpy.map.GenericMap`
+        The maps. They are only all read up front if ``target_wcs`` is not
+        given.
+
+    target_wcs : `astropy.wcs.WCS`, optional
+        The WCS of the grid. Defaults to the grid built by
+        `build_target_wcs` from the headers of the maps.
+
+    max_workers : `int`, optional
+        The number of processes. Defaults to the number of CPUs. With one
+        process the maps are reprojected in this process.
+
+    chunksize : `int`, optional
+        The number of maps sent to a process at a time. Defaults to 8.
+
+    order : `int`, optional
+        The order of the spline interpolation. Defaults to 1.
+
+    Yields
+    ------
+    sunpymap : `sunpy.map.GenericMap`
+        Each map on the grid, in the order they were given, as soon as its
+        chunk is done.
+    """
+    if target_wcs is None:
+        maps = list(maps)
+        target_wcs = build_target_wcs(sunpymap.meta for sunpymap in maps)
+    maps = iter(maps)
+    chunks = iter(lambda: list(itertools.islice(maps, chunksize)), [])
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for chunk in chunks:
+            yield from _coalign_chunk(chunk, target_wcs, order)
+        return
+
+    max_pending = 2 * max_workers
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_coalign_chunk, chunk, target_wcs,
+                                           order))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
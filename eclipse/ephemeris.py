@@ -0,0 +1,662 @@
+"""Precomputed geometry of the Moon and the Sun over the path of an eclipse."""
+import functools
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import astropy.units as u
+import numpy as np
+import sunpy.coordinates
+import sunpy.sun.constants
+from astropy.coordinates import (GCRS, ITRS, CartesianRepresentation,
+                                 EarthLocation, get_body)
+from astropy.time import Time
+
+import eclipse.meta as m
+
+__all__ = ['ObserverEstimate', 'EclipsePhase', 'EclipseGrid', 'ContactGrid',
+           'load_grid', 'load_contacts', 'locate_observer']
+
+# The mean radius of the Moon
+_MOON_RADIUS = 1737.4 * u.km
+
+ObserverEstimate = namedtuple('ObserverEstimate', ['time', 'lat', 'lon',
+                                                   'time_error', 'lat_error',
+                                                   'lon_error', 'residual'])
+ObserverEstimate.__doc__ = """
+The time and place a photo was taken, estimated from the Moon in it.
+
+``time`` is a `datetime.datetime` and ``lat`` and ``lon`` are in degrees.
+``time_error`` in seconds and ``lat_error`` and ``lon_error`` in degrees are
+half the range of the grid points which fit the photo about as well as the
+best, and are at least half the step of the grid, or `None` for values which
+were known. ``residual`` is the distance in arcseconds between the measured
+and the predicted Moon at the best point, or `None` if nothing was measured.
+"""
+
+EclipsePhase = namedtuple('EclipsePhase', ['phase', 'from_second_contact',
+                                           'from_third_contact'])
+EclipsePhase.__doc__ = """
+The phase of an eclipse seen from some places at some times.
+
+``phase`` is ``'none'`` before first or after fourth contact, ``'partial'``,
+or ``'total'`` (``'annular'`` for an annular eclipse) between second and
+third contact. ``from_second_contact`` and ``from_third_contact`` are the
+seconds since those contacts, negative before them, and NaN where the
+eclipse is not central. Each is an array with one value for each query.
+"""
+
+
+def _topocentric_geometry(times, lats, lons):
+    """
+    The centre of the Moon in helioprojective coordinates and the radii of
+    the Moon and the Sun, in arcseconds, seen from every location at every
+    time.
+
+    The geocentric positions of the Moon and the Sun are computed once for
+    each time, and moved to each location with the position of the location
+    in the GCRS, which is much faster than transforming every pair of time
+    and location.
+    """
+    times = Time(times)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
+    location = EarthLocation(lat=lat_grid.ravel() * u.deg,
+                             lon=lon_grid.ravel() * u.deg)
+
+    moon = get_body('moon', times).cartesian.xyz.to_value(u.km).T
+    sun = get_body('sun', times).cartesian.xyz.to_value(u.km).T
+    # the GCRS is rotated from the ITRS, so rather than transforming every
+    # location transform the axes once for each time
+    axes = ITRS(CartesianRepresentation(np.eye(3)[:, None, :] *
+                                        np.ones((len(times), 1)) * u.km),
+                obstime=times[:, None])
+    rotation = axes.transform_to(GCRS(obstime=times[:, None]))
+    rotation = rotation.cartesian.xyz.to_value(u.km)
+    observer = np.einsum('itj,lj->tli', rotation,
+                         np.stack([location.x, location.y, location.z],
+                                  axis=-1).to_value(u.km))
+    moon = moon[:, None] - observer
+    sun = sun[:, None] - observer
+    moon_distance = np.linalg.norm(moon, axis=-1)
+    sun_distance = np.linalg.norm(sun, axis=-1)
+    moon /= moon_distance[..., None]
+    sun /= sun_distance[..., None]
+
+    # the gnomonic offsets of the Moon from the Sun towards the east and the
+    # north, rotated by the position angle of the solar north pole
+    ra = np.arctan2(sun[..., 1], sun[..., 0])
+    dec = np.arcsin(sun[..., 2])
+    east = np.stack([-np.sin(ra), np.cos(ra), np.zeros_like(ra)], axis=-1)
+    north = np.stack([-np.sin(dec) * np.cos(ra), -np.sin(dec) * np.sin(ra),
+                      np.cos(dec)], axis=-1)
+    along = np.sum(moon * sun, axis=-1)
+    xi = np.sum(moon * east, axis=-1) / along
+    eta = np.sum(moon * north, axis=-1) / along
+    p_angle = sunpy.coordinates.sun.P(times).to_value(u.rad)[:, None]
+    # helioprojective longitude increases to the west
+    moon_x = -(xi * np.cos(p_angle) - eta * np.sin(p_angle))
+    moon_y = xi * np.sin(p_angle) + eta * np.cos(p_angle)
+
+    moon_radius = np.arcsin(_MOON_RADIUS.to_value(u.km) / moon_distance)
+    sun_radius = np.arcsin(sunpy.sun.constants.radius.to_value(u.km) /
+                           sun_distance)
+    shape = (len(times), len(lats), len(lons))
+    return tuple((value * u.rad).to_value(u.arcsec).reshape(shape)
+                 .astype(np.float32)
+                 for value in (moon_x, moon_y, moon_radius, sun_radius))
+
+
+class EclipseGrid:
+    """
+    The position and size of the Moon relative to the Sun seen from a grid
+    of times and locations around the path of an eclipse.
+
+    The grid is computed once with `compute`, which takes a few seconds for
+    a million points, and can be saved and loaded. Searching it for the time
+    and place that a photo was taken, with `infer`, is then a few array
+    operations rather than an ephemeris calculation for each candidate.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        The times of the grid, as Unix times in seconds.
+
+    lats, lons : `numpy.ndarray`
+        The latitudes and longitudes of the grid in degrees.
+
+    moon_x, moon_y : `numpy.ndarray`
+        The helioprojective longitude and latitude in arcseconds of the
+        centre of the Moon at each time, latitude and longitude.
+
+    moon_radius, sun_radius : `numpy.ndarray`
+        The radii in arcseconds of the Moon and the Sun at each time, latitude
+        and longitude.
+    """
+    def __init__(self, times, lats, lons, moon_x, moon_y, moon_radius,
+                 sun_radius):
+        self.times = np.asarray(times, dtype=float)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.moon_x = np.asarray(moon_x)
+        self.moon_y = np.asarray(moon_y)
+        self.moon_radius = np.asarray(moon_radius)
+        self.sun_radius = np.asarray(sun_radius)
+
+    def __repr__(self):
+        start, end = (_to_datetime(t).isoformat()
+                      for t in self.times[[0, -1]])
+        return (f'<{self.__class__.__name__} {start} to {end}, '
+                f'lat {self.lats[0]:g} to {self.lats[-1]:g}, '
+                f'lon {self.lons[0]:g} to {self.lons[-1]:g}, '
+                f'shape {self.shape}>')
+
+    @property
+    def shape(self):
+        """
+        The number of times, latitudes and longitudes of the grid.
+        """
+        return self.moon_x.shape
+
+    @classmethod
+    def compute(cls, start, end, lat_range, lon_range, time_step=60 * u.s,
+                location_step=0.5 * u.deg, block_times=32):
+        """
+        Compute the grid.
+
+        Parameters
+        ----------
+        start, end : `datetime.datetime`
+            The first and last times of the grid, in UTC.
+
+        lat_range, lon_range : `tuple` of `float`
+            The smallest and largest latitudes and longitudes in degrees.
+
+        time_step : `astropy.units.Quantity`, optional
+            The step between times. Defaults to 60 seconds.
+
+        location_step : `astropy.units.Quantity`, optional
+            The step between latitudes and longitudes. Defaults to 0.5
+            degrees.
+
+        block_times : `int`, optional
+            The number of times computed at once, which bounds the memory
+            used. Defaults to 32.
+
+        Returns
+        -------
+        grid : `EclipseGrid`
+        """
+        step = time_step.to_value(u.s)
+        start = Time(start).unix
+        times = np.arange(start, Time(end).unix + step / 2, step)
+        step = location_step.to_value(u.deg)
+        lats = np.arange(lat_range[0], lat_range[1] + step / 2, step)
+        lons = np.arange(lon_range[0], lon_range[1] + step / 2, step)
+        blocks = [_topocentric_geometry(
+                      Time(times[i:i + block_times], format='unix'), lats,
+                      lons)
+                  for i in range(0, len(times), block_times)]
+        return cls(times, lats, lons, *(np.concatenate(arrays)
+                                        for arrays in zip(*blocks)))
+
+    def save(self, filename):
+        """
+        Save the grid to a compressed ``.npz`` file.
+        """
+        np.savez_compressed(filename, **vars(self))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a grid saved with `save`.
+        """
+        with np.load(filename) as arrays:
+            return cls(**{key: arrays[key] for key in arrays.files})
+
+    def _index(self, values, value):
+        return int(np.abs(values - value).argmin())
+
+    def default_observer(self):
+        """
+        The time and place of the grid where the Moon is closest to the
+        centre of the Sun, the best guess for a photo of totality when
+        nothing else is known, with errors which cover the whole grid.
+
+        Returns
+        -------
+        estimate : `ObserverEstimate`
+        """
+        i, j, k = np.unravel_index(
+            np.argmin(np.hypot(self.moon_x, self.moon_y)), self.shape)
+        return ObserverEstimate(
+            _to_datetime(self.times[i]), float(self.lats[j]),
+            float(self.lons[k]), float(np.ptp(self.times)) / 2,
+            float(np.ptp(self.lats)) / 2, float(np.ptp(self.lons)) / 2, None)
+
+    def infer(self, moon_x, moon_y, moon_radius, sigma=5 * u.arcsec,
+              time=None, lat=None, lon=None):
+        """
+        Find the time and place from which the Moon is seen where it is in a
+        photo.
+
+        Any of the time, latitude and longitude which are known from the EXIF
+        data are held at the nearest point of the grid.
+
+        Parameters
+        ----------
+        moon_x, moon_y : `astropy.units.Quantity`
+            The helioprojective longitude and latitude of the centre of the
+            Moon in the photo.
+
+        moon_radius : `astropy.units.Quantity`
+            The radius of the Moon in the photo.
+
+        sigma : `astropy.units.Quantity`, optional
+            The uncertainty of the measurements. Defaults to 5 arcseconds.
+
+        time : `datetime.datetime`, optional
+            The time, if it is known.
+
+        lat, lon : `float`, optional
+            The latitude and longitude in degrees, if they are known.
+
+        Returns
+        -------
+        estimate : `ObserverEstimate`
+        """
+        selection = [slice(None)] * 3
+        if time is not None:
+            i = self._index(self.times, Time(time).unix)
+            selection[0] = slice(i, i + 1)
+        if lat is not None:
+            j = self._index(self.lats, lat)
+            selection[1] = slice(j, j + 1)
+        if lon is not None:
+            k = self._index(self.lons, lon)
+            selection[2] = slice(k, k + 1)
+        selection = tuple(selection)
+
+        measured = [value.to_value(u.arcsec)
+                    for value in (moon_x, moon_y, moon_radius)]
+        chi2 = ((self.moon_x[selection] - measured[0]) ** 2 +
+                (self.moon_y[selection] - measured[1]) ** 2 +
+                (self.moon_radius[selection] - measured[2]) ** 2)
+        chi2 /= sigma.to_value(u.arcsec) ** 2
+        best = np.unravel_index(np.argmin(chi2), chi2.shape)
+        # the points which fit about as well as the best
+        close = np.nonzero(chi2 <= chi2[best] + 1)
+
+        axes = [self.times[selection[0]], self.lats[selection[1]],
+                self.lons[selection[2]]]
+        values = []
+        errors = []
+        for axis, indices, index, full_axis, known in zip(
+                axes, close, best, (self.times, self.lats, self.lons),
+                (time, lat, lon)):
+            values.append(float(axis[index]))
+            if known is not None:
+                errors.append(None)
+                continue
+            step = 0
+            if len(full_axis) > 1:
+                step = float(full_axis[1] - full_axis[0])
+            errors.append(max(float(np.ptp(axis[indices])) / 2, step / 2))
+        return ObserverEstimate(_to_datetime(values[0]), values[1], values[2],
+                                errors[0], errors[1], errors[2],
+                                float(np.sqrt(chi2[best]) *
+                                      sigma.to_value(u.arcsec)))
+
+
+class ContactGrid:
+    """
+    The times of the four contacts of an eclipse over a grid of locations.
+
+    The contacts change smoothly with location, so they are interpolated
+    between the points of the grid, and the phase of the eclipse for many
+    photos is found with a few array operations, see `phase`.
+
+    Parameters
+    ----------
+    lats, lons : `numpy.ndarray`
+        The latitudes and longitudes of the grid in degrees.
+
+    contacts : `numpy.ndarray`
+        The Unix times in seconds of the first to fourth contacts at each
+        latitude and longitude, with shape ``(4, len(lats), len(lons))``. The
+        times are NaN for contacts which are not seen from a location, or not
+        within the times the grid was computed for.
+
+    annular : `bool`, optional
+        Whether the eclipse is annular rather than total. Defaults to `False`.
+    """
+    def __init__(self, lats, lons, contacts, annular=False):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.contacts = np.asarray(contacts, dtype=float)
+        self.annular = bool(annular)
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} '
+                f'lat {self.lats[0]:g} to {self.lats[-1]:g}, '
+                f'lon {self.lons[0]:g} to {self.lons[-1]:g}, '
+                f'shape {self.contacts.shape[1:]}>')
+
+    @classmethod
+    def from_eclipse_grid(cls, grid):
+        """
+        Find the contacts in an `EclipseGrid`, which must cover the whole
+        eclipse in time.
+
+        The contacts are where the distance between the centres of the Moon
+        and the Sun crosses the sum and the difference of their radii, and
+        are interpolated linearly between the times of the grid.
+        """
+        distance = np.hypot(grid.moon_x, grid.moon_y)
+        outer = distance - (grid.moon_radius + grid.sun_radius)
+        inner = distance - np.abs(grid.moon_radius - grid.sun_radius)
+        contacts = np.stack([_crossing(grid.times, outer, first=True),
+                             _crossing(grid.times, inner, first=True),
+                             _crossing(grid.times, inner, first=False),
+                             _crossing(grid.times, outer, first=False)])
+        annular = np.median(grid.moon_radius - grid.sun_radius) < 0
+        return cls(grid.lats, grid.lons, contacts, annular)
+
+    @classmethod
+    def compute(cls, start, end, lat_range, lon_range, time_step=30 * u.s,
+                location_step=0.1 * u.deg):
+        """
+        Compute the contacts of an eclipse.
+
+        Parameters
+        ----------
+        start, end : `datetime.datetime`
+            Times before the first and after the last contact anywhere on the
+            grid, in UTC.
+
+        lat_range, lon_range : `tuple` of `float`
+            The smallest and largest latitudes and longitudes in degrees.
+
+        time_step : `astropy.units.Quantity`, optional
+            The step between the times at which the Moon is computed. Defaults
+            to 30 seconds, which gives the contacts to a fraction of a second.
+
+        location_step : `astropy.units.Quantity`, optional
+            The step between latitudes and longitudes. Defaults to 0.1
+            degrees.
+
+        Returns
+        -------
+        grid : `ContactGrid`
+        """
+        return cls.from_eclipse_grid(EclipseGrid.compute(
+            start, end, lat_range, lon_range, time_step, location_step))
+
+    def save(self, filename):
+        """
+        Save the grid to a compressed ``.npz`` file.
+        """
+        np.savez_compressed(filename, **vars(self))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a grid saved with `save`.
+        """
+        with np.load(filename) as arrays:
+            return cls(**{key: arrays[key] for key in arrays.files})
+
+    def contact_times(self, lat, lon):
+        """
+        Interpolate the contacts at some locations.
+
+        Parameters
+        ----------
+        lat, lon : array_like
+            The latitudes and longitudes in degrees.
+
+        Returns
+        -------
+        contacts : `numpy.ndarray`
+            The Unix times of the four contacts at each location, with shape
+            ``(4,) + numpy.shape(lat)``. Locations outside the grid get
+            NaN. Near the edge of the path of totality, where only some of
+            the surrounding points of the grid see second and third contact,
+            those points are averaged, so the path is widened by up to a
+            step of the grid.
+        """
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=float),
+                                       np.asarray(lon, dtype=float))
+        i, di = _fractional_index(self.lats, lat)
+        j, dj = _fractional_index(self.lons, lon)
+        weights = np.stack([(1 - di) * (1 - dj), (1 - di) * dj,
+                            di * (1 - dj), di * dj])
+        values = np.stack([self.contacts[:, i, j], self.contacts[:, i, j + 1],
+                           self.contacts[:, i + 1, j],
+                           self.contacts[:, i + 1, j + 1]], axis=1)
+        finite = np.isfinite(values)
+        weights = np.where(finite, weights, 0)
+        total = weights.sum(axis=1)
+        total = np.where(total > 0, total, np.nan)
+        return (np.where(finite, values, 0) * weights).sum(axis=1) / total
+
+    def phase(self, lat, lon, time):
+        """
+        The phase of the eclipse seen from some places at some times.
+
+        Parameters
+        ----------
+        lat, lon : array_like
+            The latitudes and longitudes in degrees.
+
+        time : `datetime.datetime` or list of `datetime.datetime`
+            The times, in UTC.
+
+        Returns
+        -------
+        phase : `EclipsePhase`
+        """
+        first, second, third, fourth = self.contact_times(lat, lon)
+        time = Time(time).unix
+        central = 'annular' if self.annular else 'total'
+        with np.errstate(invalid='ignore'):
+            phase = np.where((first <= time) & (time <= fourth), 'partial',
+                             'none')
+            phase = np.where((second <= time) & (time <= third), central,
+                             phase)
+        return EclipsePhase(phase, time - second, time - third)
+
+
+def _crossing(times, values, first=True):
+    """
+    The times at which ``values`` first becomes negative, or last stops being
+    negative, along the first axis, interpolated linearly, or NaN if it does
+    not.
+    """
+    negative = values < 0
+    if first:
+        crossed = ~negative[:-1] & negative[1:]
+        index = np.argmax(crossed, axis=0)
+    else:
+        crossed = negative[:-1] & ~negative[1:]
+        index = len(times) - 2 - np.argmax(crossed[::-1], axis=0)
+    found = np.take_along_axis(crossed, index[None], axis=0)[0]
+    before = np.take_along_axis(values, index[None], axis=0)[0]
+    after = np.take_along_axis(values, index[None] + 1, axis=0)[0]
+    fraction = before / (before - after)
+    time = times[index] + fraction * (times[index + 1] - times[index])
+    return np.where(found, time, np.nan)
+
+
+def _fractional_index(values, value):
+    """
+    The index of the point of an evenly spaced grid below ``value``, and the
+    fraction of the way to the next point, with NaN outside the grid.
+    """
+    position = (value - values[0]) / (values[1] - values[0])
+    index = np.clip(np.floor(position), 0, len(values) - 2).astype(int)
+    fraction = position - index
+    outside = (position < 0) | (position > len(values) - 1)
+    return index, np.where(outside, np.nan, fraction)
+
+
+def _to_datetime(unix):
+    return datetime.fromtimestamp(unix, timezone.utc).replace(tzinfo=None)
+
+
+@functools.lru_cache(maxsize=4)
+def load_grid(filename):
+    """
+    Load a grid saved with `EclipseGrid.save`, once per process.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the grid.
+
+    Returns
+    -------
+    grid : `EclipseGrid`
+    """
+    return EclipseGrid.load(filename)
+
+
+@functools.lru_cache(maxsize=4)
+def load_contacts(filename):
+    """
+    Load a grid saved with `ContactGrid.save`, once per process.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the grid.
+
+    Returns
+    -------
+    grid : `ContactGrid`
+    """
+    return ContactGrid.load(filename)
+
+
+def _phase_meta(phase):
+    """
+    The keys of the headers of some photos which give their phase.
+    """
+    metas = []
+    for name, second, third in zip(*(np.ravel(value) for value in phase)):
+        meta = {'phase': str(name)}
+        if np.isfinite(second):
+            meta['fromc2'] = float(second)
+        if np.isfinite(third):
+            meta['fromc3'] = float(third)
+        metas.append(meta)
+    return metas
+
+
+def _uncertainty_meta(estimate, source):
+    """
+    The keys of the header which flag the time and place of a photo as
+    estimated, with their errors in seconds and degrees.
+    """
+    meta = {'obs_src': source}
+    for key, value in (('timeerr', estimate.time_error),
+                       ('laterr', estimate.lat_error),
+                       ('lonerr', estimate.lon_error)):
+        if value is not None:
+            meta[key] = value
+    return meta
+
+
+def _observer_meta(estimate, source):
+    """
+    The keys of the header which depend on the time and place of the photo.
+    """
+    time = estimate.time
+    dsun = m.ephemeris.earth_distance(time)
+    meta = {'date-obs': time.isoformat(),
+            'DATEOBS': time.isoformat(),
+            'LAT': estimate.lat,
+            'LON': estimate.lon,
+            'dsun_obs': dsun.to_value(u.m),
+            'hglt_obs': m.ephemeris.B0(time).to_value(u.deg),
+            'rsun': dsun.to_value(u.m),
+            'rsun_obs': np.arctan(sunpy.sun.constants.radius /
+                                  dsun).to_value(u.arcsec)}
+    meta.update(_uncertainty_meta(estimate, source))
+    return meta
+
+
+def locate_observer(sunpymap, grid, time=None, lat=None, lon=None,
+                    sigma=5 * u.arcsec, iterations=3, **kwargs):
+    """
+    Estimate the time and place a photo was taken from the position and size
+    of the Moon, and update its map.
+
+    The stars and planets in the photo give its plate scale and orientation,
+    see `eclipse.platesolve.refine_wcs`, and so where the Moon is relative
+    to the Sun in arcseconds. Seen from different places and times the Moon
+    is displaced by up to about a degree, its parallax, and its size changes
+    by a few percent, which `EclipseGrid.infer` looks up. The Sun moves
+    against the stars by a few arcseconds a minute, so the stars are matched
+    again at each estimated time.
+
+    Parameters
+    ----------
+    sunpymap : `sunpy.map.GenericMap`
+        The map, whose WCS puts the Sun at the centre of the disk of the
+        Moon, as built by `eclipse.meta`.
+
+    grid : `EclipseGrid`
+        The grid of the eclipse.
+
+    time : `datetime.datetime`, optional
+        The time, if it is known.
+
+    lat, lon : `float`, optional
+        The latitude and longitude in degrees, if they are known.
+
+    sigma : `astropy.units.Quantity`, optional
+        The uncertainty of the position and radius of the Moon. Defaults to 5
+        arcseconds.
+
+    iterations : `int`, optional
+        The number of times the stars are matched. Defaults to 3.
+
+    kwargs
+        Passed to `eclipse.platesolve.refine_wcs`.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map with the refined WCS and the estimated time and place, whose
+        errors in seconds and degrees are in the ``timeerr``, ``laterr`` and
+        ``lonerr`` keys of the header for the values which were not known.
+        The ``obs_src`` key of the header is ``'ephemeris'``.
+
+    estimate : `ObserverEstimate`
+        The estimate.
+
+    Raises
+    ------
+    ValueError
+        If too few stars are matched to solve the plate.
+    """
+    from eclipse.platesolve import refine_wcs
+    from sunpy.map import GenericMap
+
+    # the disk of the Moon, see eclipse.meta.build_wcs
+    moon_x = sunpymap.meta['crpix1'] * u.pix
+    moon_y = sunpymap.meta['crpix2'] * u.pix
+    moon_pixels = sunpymap.meta['rsun_obs'] / sunpymap.meta['cdelt1']
+    for _ in range(iterations):
+        refined = refine_wcs(sunpymap, **kwargs)
+        moon = refined.pixel_to_world(moon_x, moon_y)
+        moon_radius = moon_pixels * refined.meta['cdelt1'] * u.arcsec
+        estimate = grid.infer(moon.Tx, moon.Ty, moon_radius, sigma=sigma,
+                              time=time, lat=lat, lon=lon)
+        if time is not None:
+            estimate = estimate._replace(time=time)
+        if lat is not None:
+            estimate = estimate._replace(lat=lat, lon=lon)
+        header = refined.meta.copy()
+        header.update(_observer_meta(estimate, 'ephemeris'))
+        sunpymap = GenericMap(data=sunpymap.data, header=header)
+    return sunpymap, estimate
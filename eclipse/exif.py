@@ -0,0 +1,143 @@
+"""Procedures to read the meta data of a photograph from its EXIF tags.
+
+This module only needs ``exifread``, so that the meta data of many photos can
+be read without importing the rest of the package.
+"""
+from datetime import datetime
+
+import exifread  # to read information from the image
+
+__all__ = ['read_exif', 'get_exif_location', 'get_image_time',
+           'get_meta_from_exif']
+
+
+def read_exif(filename, details=False):
+    """
+    Read the EXIF data of a photo without decoding the image.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    details : `bool`, optional
+        Whether to also read the maker notes and the thumbnail, which are
+        large and not needed to process the photo. Defaults to `False`.
+
+    Returns
+    -------
+    exif_data : `dict`
+        The EXIF tags, as returned by `exifread.process_file`.
+    """
+    with open(filename, 'rb') as f:
+        return exifread.process_file(f, details=details,
+                                     extract_thumbnail=details)
+
+
+def _convert_to_degress(value):
+    """
+    Helper function to convert the GPS coordinates stored in the EXIF to
+    degress in float format
+    :param value:
+    :type value: exifread.utils.Ratio
+    :rtype: float
+    """
+    d = float(value.values[0].num) / float(value.values[0].den)
+    m = float(value.values[1].num) / float(value.values[1].den)
+    s = float(value.values[2].num) / float(value.values[2].den)
+
+    return d + (m / 60.0) + (s / 3600.0)
+
+
+def get_exif_location(exif_data):
+    """
+    Returns the latitude and longitude, if available, from the provided
+    exif_data (obtained through get_exif_data above)
+    """
+    lat = None
+    lon = None
+
+    gps_latitude = exif_data.get('GPS GPSLatitude', None)
+    gps_latitude_ref = exif_data.get('GPS GPSLatitudeRef', None)
+    gps_longitude = exif_data.get('GPS GPSLongitude', None)
+    gps_longitude_ref = exif_data.get('GPS GPSLongitudeRef', None)
+
+    if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
+        lat = _convert_to_degress(gps_latitude)
+        if gps_latitude_ref.values[0] != 'N':
+            lat = 0 - lat
+
+        lon = _convert_to_degress(gps_longitude)
+        if gps_longitude_ref.values[0] != 'E':
+            lon = 0 - lon
+
+    return lat, lon
+
+
+def get_image_time(exif_data, with_tag=False):
+    """
+    Get the time from the photograph.
+
+    The time the photo was taken is used if it is recorded, otherwise the time
+    it was digitized or the time the file was written, which may be long
+    after the photo was taken.
+
+    Parameters
+    ----------
+    exif_data : `dict`
+        The EXIF tags, see `read_exif`.
+
+    with_tag : `bool`, optional
+        Whether to also return the tag the time was read from. Defaults to
+        `False`.
+
+    Returns
+    -------
+    time : `datetime.datetime` or `None`
+        The time, or `None` if the EXIF data has no valid time.
+
+    tag : `str` or `None`
+        The tag the time was read from, such as ``'EXIF DateTimeOriginal'``
+        for the time the photo was taken. Only returned if ``with_tag`` is
+        true.
+    """
+    for tag in ('EXIF DateTimeOriginal', 'EXIF DateTimeDigitized',
+                'Image DateTime'):
+        if tag not in exif_data:
+            continue
+        try:
+            time = datetime.strptime(str(exif_data[tag].values).strip(),
+                                     '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            # cameras whose clock is not set write blanks or zeros
+            continue
+        return (time, tag) if with_tag else time
+    return (None, None) if with_tag else None
+
+
+def get_meta_from_exif(exif_data):
+    """
+    Gather meta header from the EXIF data.
+
+    Only the keys whose tags are in the EXIF data are returned, so for
+    example ``'LAT'`` and ``'LON'`` are missing if the camera had no GPS.
+    """
+    result = {}
+    if "Image Artist" in exif_data:
+        result['AUTHOR'] = exif_data['Image Artist'].values
+    if "EXIF ExposureTime" in exif_data:
+        # in seconds
+        exposure = exif_data['EXIF ExposureTime'].values[0]
+        result['EXPTIME'] = exposure.num / exposure.den
+    if "Image Model" in exif_data:
+        result['TELECOP'] = exif_data['Image Model'].values
+
+    lat, lon = get_exif_location(exif_data)
+    if lat is not None and lon is not None:
+        result['LAT'] = lat
+        result['LON'] = lon
+
+    time = get_image_time(exif_data)
+    if time is not None:
+        result['DATEOBS'] = time.isoformat()
+    return result
@@ -0,0 +1,291 @@
+"""A queryable database of the photos of an archive and the disks in them."""
+import math
+import sqlite3
+from datetime import datetime
+
+import astropy.units as u
+
+__all__ = ['INDEX_FIELDS', 'PhotoIndex']
+
+#: The columns of the index, in order.
+INDEX_FIELDS = ('filename', 'output', 'time', 'lat', 'lon', 'exposure_time',
+                'camera', 'author', 'im_cx', 'im_cy', 'im_radius',
+                'plate_scale', 'crota2', 'phase', 'fromc2', 'fromc3')
+
+_COLUMN_TYPES = {'filename': 'TEXT PRIMARY KEY', 'output': 'TEXT',
+                 'time': 'TEXT', 'camera': 'TEXT', 'author': 'TEXT',
+                 'phase': 'TEXT'}
+
+# INSERT ... ON CONFLICT DO UPDATE needs SQLite 3.24 or later
+_HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+_EARTH_RADIUS = 6371.0088 * u.km
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """
+    The angle in radians between two points on a sphere given in degrees.
+    """
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _time_key(time):
+    """
+    A time as an ISO string which sorts in time order, whatever the precision
+    it was given with.
+    """
+    if time is None:
+        return None
+    if isinstance(time, str):
+        time = datetime.fromisoformat(time)
+    return time.isoformat(timespec='microseconds')
+
+
+def _row_from_header(filename, header, output=None):
+    """
+    The fields of the index of a photo from the header of its map.
+    """
+    # the keys of a map's meta data are lower case, whatever they were made
+    # with
+    header = {key.lower(): value for key, value in header.items()}
+    plate_scale = header.get('cdelt1')
+    im_radius = None
+    if plate_scale and header.get('rsun_obs') is not None:
+        im_radius = header['rsun_obs'] / plate_scale
+    return {'filename': filename, 'output': output,
+            'time': header.get('dateobs', header.get('date-obs')),
+            'lat': header.get('lat'), 'lon': header.get('lon'),
+            'exposure_time': header.get('exptime'),
+            'camera': header.get('telecop'), 'author': header.get('author'),
+            'im_cx': header.get('crpix2'), 'im_cy': header.get('crpix1'),
+            'im_radius': im_radius, 'plate_scale': plate_scale,
+            'crota2': header.get('crota2'), 'phase': header.get('phase'),
+            'fromc2': header.get('fromc2'), 'fromc3': header.get('fromc3')}
+
+
+class PhotoIndex:
+    """
+    An SQLite database of the time, location and camera of photos and of the
+    disk found in them, which can be queried without reading the photos.
+
+    The index is filled from the rows of `eclipse.scan.scan_photos`, from the
+    headers of maps, or by `eclipse.batch.process_batch` as it converts
+    photos. A photo is identified by its filename, and adding it again
+    updates the fields which are given and keeps the others, so that a scan
+    and a later batch of the same photos fill in one row each. The time,
+    location and radius are indexed so that queries on them are fast.
+
+    Parameters
+    ----------
+    path : `str`
+        The filename of the database, which is created if needed, or
+        ``':memory:'``.
+
+    Examples
+    --------
+    >>> import astropy.units as u
+    >>> from eclipse.index import PhotoIndex
+    >>> index = PhotoIndex(':memory:')
+    >>> index.add({'filename': 'a.jpg', 'time': '2017-08-21T17:46:00',
+    ...            'lat': 44.37, 'lon': -119.4, 'im_radius': 850.0})
+    >>> index.add({'filename': 'b.jpg', 'time': '2017-08-21T18:20:00',
+    ...            'lat': 36.97, 'lon': -86.5, 'im_radius': 230.0})
+    >>> [row['filename'] for row in index.query(near=(44.5, -119.5),
+    ...                                         within=50 * u.km,
+    ...                                         min_radius=800)]
+    ['a.jpg']
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.create_function('angular_distance', 4, _haversine)
+        columns = ', '.join(f"{name} {_COLUMN_TYPES.get(name, 'REAL')}"
+                            for name in INDEX_FIELDS)
+        with self._connection:
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS photos ({columns})')
+            # databases made before some columns were added get them empty
+            existing = {row['name'] for row in self._connection.execute(
+                'PRAGMA table_info(photos)')}
+            for name in INDEX_FIELDS:
+                if name not in existing:
+                    self._connection.execute(
+                        f'ALTER TABLE photos ADD COLUMN {name} '
+                        f"{_COLUMN_TYPES.get(name, 'REAL')}")
+            for columns in ('time', 'lat, lon', 'im_radius'):
+                name = 'photos_' + columns.replace(', ', '_')
+                self._connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name} ON photos ({columns})')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r})'
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM photos').fetchone()[0]
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self._connection.close()
+
+    def add_many(self, rows):
+        """
+        Add or update many photos in one transaction.
+
+        Parameters
+        ----------
+        rows : iterable of `dict`
+            The fields of each photo, with keys in `INDEX_FIELDS`, such as the
+            rows of `eclipse.scan.scan_photos`. Other keys are ignored, and
+            missing or `None` fields do not replace those already stored.
+
+        Returns
+        -------
+        n_rows : `int`
+            The number of photos added or updated.
+        """
+        columns = ', '.join(INDEX_FIELDS)
+        if _HAS_UPSERT:
+            values = ', '.join(f':{name}' for name in INDEX_FIELDS)
+            updates = ', '.join(f'{name} = COALESCE(excluded.{name}, {name})'
+                                for name in INDEX_FIELDS[1:])
+            statement = (f'INSERT INTO photos ({columns}) VALUES ({values}) '
+                         f'ON CONFLICT (filename) DO UPDATE SET {updates}')
+        else:
+            # replace the whole row, keeping the stored fields not given
+            values = ', '.join(
+                [':filename'] +
+                [f'COALESCE(:{name}, (SELECT {name} FROM photos '
+                 'WHERE filename = :filename))' for name in INDEX_FIELDS[1:]])
+            statement = (f'INSERT OR REPLACE INTO photos ({columns}) '
+                         f'VALUES ({values})')
+        n_rows = 0
+        with self._connection:
+            for row in rows:
+                row = {name: row.get(name) for name in INDEX_FIELDS}
+                row['time'] = _time_key(row['time'])
+                self._connection.execute(statement, row)
+                n_rows += 1
+        return n_rows
+
+    def add(self, row):
+        """
+        Add or update one photo, see `add_many`.
+        """
+        self.add_many([row])
+
+    def add_header(self, filename, header, output=None):
+        """
+        Add or update a photo from the header of its map.
+
+        Parameters
+        ----------
+        filename : `str`
+            The filename of the photo.
+
+        header : `dict`
+            The header of the map, as built by `eclipse.meta.build_meta`.
+
+        output : `str`, optional
+            The filename of the FITS file of the map.
+        """
+        self.add(_row_from_header(filename, header, output))
+
+    def query(self, start=None, end=None, near=None, within=None,
+              min_radius=None, max_radius=None, camera=None, phase=None,
+              limit=None):
+        """
+        Find the photos which match all the conditions given.
+
+        Parameters
+        ----------
+        start, end : `datetime.datetime` or `str`, optional
+            The earliest and latest time the photos were taken, inclusive.
+
+        near : `tuple` of `float`, optional
+            The latitude and longitude in degrees of a point the photos were
+            taken within ``within`` of.
+
+        within : `astropy.units.Quantity`, optional
+            The greatest distance from ``near``, as a length along the surface
+            of the Earth or an angle.
+
+        min_radius, max_radius : `float`, optional
+            The smallest and largest radius in pixels of the disk.
+
+        camera : `str`, optional
+            The model of the camera.
+
+        phase : `str`, optional
+            The phase of the eclipse, as written to the ``phase`` key of the
+            header by `eclipse.process.eclipse_image_to_map`, such as
+            ``'partial'`` or ``'total'``.
+
+        limit : `int`, optional
+            The largest number of photos to return.
+
+        Returns
+        -------
+        rows : `list` of `dict`
+            The fields of each photo, in order of time.
+        """
+        conditions = []
+        params = {}
+        if start is not None:
+            conditions.append('time >= :start')
+            params['start'] = _time_key(start)
+        if end is not None:
+            conditions.append('time <= :end')
+            params['end'] = _time_key(end)
+        if min_radius is not None:
+            conditions.append('im_radius >= :min_radius')
+            params['min_radius'] = min_radius
+        if max_radius is not None:
+            conditions.append('im_radius <= :max_radius')
+            params['max_radius'] = max_radius
+        if camera is not None:
+            conditions.append('camera = :camera')
+            params['camera'] = camera
+        if phase is not None:
+            conditions.append('phase = :phase')
+            params['phase'] = phase
+        if near is not None:
+            if within is None:
+                raise ValueError('The distance from the point must be given.')
+            if within.unit.physical_type == 'length':
+                within = (within / _EARTH_RADIUS) * u.rad
+            angle = within.to_value(u.rad)
+            lat, lon = near
+            params.update(lat=lat, lon=lon, angle=angle)
+            # a box around the point which the index can search, before the
+            # exact distance is computed for the photos inside it
+            dlat = math.degrees(angle)
+            conditions.append('lat BETWEEN :lat - :dlat AND :lat + :dlat')
+            params['dlat'] = dlat
+            cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90)))
+            if cos_lat > 0 and dlat / cos_lat < 180:
+                dlon = dlat / cos_lat
+                if -180 <= lon - dlon and lon + dlon <= 180:
+                    conditions.append(
+                        'lon BETWEEN :lon - :dlon AND :lon + :dlon')
+                    params['dlon'] = dlon
+            conditions.append('angular_distance(lat, lon, :lat, :lon) <= '
+                              ':angle')
+
+        statement = 'SELECT * FROM photos'
+        if conditions:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        statement += ' ORDER BY time'
+        if limit is not None:
+            statement += ' LIMIT :limit'
+            params['limit'] = limit
+        return [dict(row) for row in
+                self._connection.execute(statement, params)]
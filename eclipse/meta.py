@@ -1,104 +1,116 @@
 """Procedures to gather meta data from a photograph."""
-import astropy.wcs
+from collections import OrderedDict
+
 import numpy as np
 
 import astropy.wcs
-from astropy.coordinates import EarthLocation, SkyCoord
+from astropy.coordinates import EarthLocation
+from astropy.time import Time
 import astropy.units as u
-from datetime import datetime
 
 import sunpy
-import sunpy.map
 import sunpy.coordinates
+import sunpy.sun.constants
 from sunpy.util import MetaDict
 
-import exifread # to read information from the image
-
-__all__ = ['get_exif_location', 'get_meta_from_exif']
-
-
-def _convert_to_degress(value):
-    """
-    Helper function to convert the GPS coordinates stored in the EXIF to
-    degress in float format
-    :param value:
-    :type value: exifread.utils.Ratio
-    :rtype: float
-    """
-    d = float(value.values[0].num) / float(value.values[0].den)
-    m = float(value.values[1].num) / float(value.values[1].den)
-    s = float(value.values[2].num) / float(value.values[2].den)
+from eclipse.exif import (get_exif_location, get_image_time,
+                          get_meta_from_exif, read_exif)
 
-    return d + (m / 60.0) + (s / 3600.0)
+__all__ = ['read_exif', 'get_exif_location', 'get_meta_from_exif',
+           'build_meta_from_values', 'build_meta_batch',
+           'build_meta_batch_from_values',
+           'EphemerisCache', 'ephemeris']
 
 
-def get_exif_location(exif_data):
+class EphemerisCache:
     """
-    Returns the latitude and longitude, if available, from the provided
-    exif_data (obtained through get_exif_data above)
+    Memoize the ephemeris of the Sun for photos taken at nearly the same time
+    and place.
+
+    Times are rounded to the nearest ``time_tolerance`` and locations to the
+    nearest ``location_tolerance``, and each quantity is computed once, at the
+    rounded time and location, for every distinct key. The photos of one
+    eclipse share only a handful of keys, so after the first few photos the
+    ephemeris costs next to nothing. At most ``max_size`` values are kept,
+    and the least recently used is forgotten first, so that a long running
+    process does not grow without bound.
+
+    Parameters
+    ----------
+    time_tolerance : `astropy.units.Quantity`, optional
+        The resolution of the times. Defaults to 1 second, the resolution of
+        the EXIF time stamps.
+
+    location_tolerance : `astropy.units.Quantity`, optional
+        The resolution of the latitudes and longitudes. Defaults to 0.001
+        degrees, about a hundred meters.
+
+    max_size : `int`, optional
+        The largest number of values to keep. Defaults to 4096.
     """
-    lat = None
-    lon = None
-
-    gps_latitude = exif_data.get('GPS GPSLatitude', None)
-    gps_latitude_ref = exif_data.get('GPS GPSLatitudeRef', None)
-    gps_longitude = exif_data.get('GPS GPSLongitude', None)
-    gps_longitude_ref = exif_data.get('GPS GPSLongitudeRef', None)
-
-    if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
-        lat = _convert_to_degress(gps_latitude)
-        if gps_latitude_ref.values[0] != 'N':
-            lat = 0 - lat
-
-        lon = _convert_to_degress(gps_longitude)
-        if gps_longitude_ref.values[0] != 'E':
-            lon = 0 - lon
-
-    return lat, lon
-
-
-def get_image_time(exif_data):
-    """Get the time from the photograph."""
-    if "EXIF DateTimeOriginal" in exif_data:
-        datetime_str = exif_data['EXIF DateTimeOriginal'].values.replace(' ',
-                                                                    ':').split(
-            ':')
-        time = datetime(int(datetime_str[0]), int(datetime_str[1]),
-                        int(datetime_str[2]), int(datetime_str[3]),
-                        int(datetime_str[4]), int(datetime_str[5]))
-    return time
-
-
-def get_meta_from_exif(exif_data):
-    """Gather meta header from the EXIF data."""
-
-    if "EXIF ExposureTime" in exif_data:
-        exposure_tag = exif_data['EXIF ExposureTime']
-        exposure_time = exposure_tag.values[0].num / exposure_tag.values[
-            0].den * u.s
-    if "Image Artist" in exif_data:
-        author_str = exif_data['Image Artist'].values
-
-    if "Image Model" in exif_data:
-        camera_model_str = exif_data['Image Model'].values
-    lat, lon = get_exif_location(exif_data)
-    if ((lat != None) and (lon != None)):
-        gps = [lat, lon] * u.deg
-
-    time = get_image_time(exif_data)
-
-    result = {}
-    result.update({'AUTHOR': author_str})
-    result.update({'EXPTIME': exposure_time.to('s').value})
-    result.update({'TELECOP': camera_model_str})
-    result.update({'LAT': gps[0].to_value(u.deg)})
-    result.update({'LON': gps[1].to_value(u.deg)})
-    result.update({'DATEOBS': time.isoformat()})
-    return result
+    def __init__(self, time_tolerance=1 * u.s, location_tolerance=1e-3 * u.deg,
+                 max_size=4096):
+        self.time_tolerance = time_tolerance
+        self.location_tolerance = location_tolerance
+        self.max_size = max_size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def clear(self):
+        """Forget all the computed values."""
+        self._values.clear()
+
+    def _round_time(self, time):
+        tolerance = self.time_tolerance.to_value(u.s)
+        return round(Time(time).unix / tolerance) * tolerance
+
+    def _round_angle(self, angle):
+        tolerance = self.location_tolerance.to_value(u.deg)
+        return round(u.Quantity(angle, u.deg).value / tolerance) * tolerance
+
+    def _get(self, key, function, *args):
+        if key in self._values:
+            self._values.move_to_end(key)
+        else:
+            self._values[key] = function(*args)
+            if len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+        return self._values[key]
+
+    def earth_distance(self, time):
+        """The distance between the Sun and the Earth at ``time``."""
+        unix = self._round_time(time)
+        return self._get(('earth_distance', unix),
+                         sunpy.coordinates.sun.earth_distance,
+                         Time(unix, format='unix'))
+
+    def B0(self, time):
+        """The heliographic latitude of the centre of the disk at ``time``."""
+        unix = self._round_time(time)
+        return self._get(('B0', unix), sunpy.coordinates.sun.B0,
+                         Time(unix, format='unix'))
+
+    def orientation(self, lat, lon, time):
+        """
+        The angle of solar north from the local zenith for an observer at
+        (``lat``, ``lon``) at ``time``.
+        """
+        unix = self._round_time(time)
+        lat, lon = self._round_angle(lat), self._round_angle(lon)
+        location = EarthLocation(lat=lat * u.deg, lon=lon * u.deg)
+        return self._get(('orientation', lat, lon, unix),
+                         sunpy.coordinates.sun.orientation,
+                         location, Time(unix, format='unix'))
+
+
+#: The ephemeris cache used when building the meta data of photos.
+ephemeris = EphemerisCache()
 
 
 def get_plate_scale(time, im_radius):
-    dsun = sunpy.coordinates.sun.earth_distance(time.isoformat())
+    dsun = ephemeris.earth_distance(time)
     rsun_obs = np.arctan(sunpy.sun.constants.radius / dsun).to('arcsec')
     plate_scale = rsun_obs / im_radius
     return plate_scale
@@ -117,18 +129,70 @@ def build_wcs(im_cx, im_cy, plate_scale):
 
 def build_meta(wcs, exif_data):
     time = get_image_time(exif_data)
+    if time is None:
+        raise ValueError('The EXIF data has no time, which is needed to '
+                         'build the meta data.')
+    return _build_meta(wcs, time, get_meta_from_exif(exif_data))
+
+
+def build_meta_from_values(wcs, time, lat, lon, exposure_time=None,
+                           camera=None, author=None):
+    """
+    Build the meta data of a photo, such as a frame of a video, which has no
+    EXIF data.
+
+    This gives the same header as `build_meta` with the values that would be
+    read from the EXIF data given directly.
+
+    Parameters
+    ----------
+    wcs : `astropy.wcs.WCS`
+        The WCS of the photo, see `build_wcs`.
+
+    time : `datetime.datetime`
+        The time the photo was taken.
+
+    lat, lon : `float`
+        The latitude and longitude of the camera in degrees.
+
+    exposure_time : `float`, optional
+        The exposure time in seconds.
+
+    camera : `str`, optional
+        The model of the camera.
+
+    author : `str`, optional
+        The name of the photographer.
+
+    Returns
+    -------
+    header : `sunpy.util.MetaDict`
+        The header of the photo.
+    """
+    exif_meta = {'AUTHOR': author, 'EXPTIME': exposure_time,
+                 'TELECOP': camera, 'LAT': lat, 'LON': lon,
+                 'DATEOBS': time.isoformat()}
+    exif_meta = {key: value for key, value in exif_meta.items()
+                 if value is not None}
+    return _build_meta(wcs, time, exif_meta)
+
+
+def _build_meta(wcs, time, exif_meta):
     wcs.wcs.dateobs = time.isoformat()
     header = MetaDict(dict(wcs.to_header()))
 
-    header.update(get_meta_from_exif(exif_data))
-    dsun = sunpy.coordinates.sun.earth_distance(time.isoformat())
+    header.update(exif_meta)
+    if header.get('LAT') is None or header.get('LON') is None:
+        raise ValueError('The EXIF data has no GPS location, which is needed '
+                         'to build the meta data.')
+    dsun = ephemeris.earth_distance(time)
     lat = header.get('LAT') * u.deg
     lon = header.get('LON') * u.deg
     solar_rotation_angle = get_solar_rotation_angle(lat, lon, time)
     header.update({'crota2': solar_rotation_angle.to('deg').value})
     header.update({'dsun_obs': dsun.to('m').value})
     hgln_obs = 0 * u.deg
-    hglt_obs = sunpy.coordinates.sun.B0(time)
+    hglt_obs = ephemeris.B0(time)
     header.update({'hgln_obs': hgln_obs.to('deg').value})
     header.update({'hglt_obs': hglt_obs.to('deg').value})
     header.update({'ctype1': 'HPLN-TAN'})
@@ -139,9 +203,139 @@ def build_meta(wcs, exif_data):
     return header
 
 
+def build_meta_batch(im_cx, im_cy, im_radius, exif_data):
+    """
+    Build the meta data of many photos at once from their EXIF data.
+
+    This gives the same headers as `get_plate_scale`, `build_wcs` and
+    `build_meta` for each photo in turn, but the ephemeris of all the photos
+    is computed at once, see `build_meta_batch_from_values`.
+
+    Parameters
+    ----------
+    im_cx : `astropy.units.Quantity`
+        The x coordinates of the centres of the disks, one for each photo.
+
+    im_cy : `astropy.units.Quantity`
+        The y coordinates of the centres of the disks.
+
+    im_radius : `astropy.units.Quantity`
+        The radii of the disks.
+
+    exif_data : `list` of `dict`
+        The EXIF data of each photo.
+
+    Returns
+    -------
+    headers : `list` of `sunpy.util.MetaDict`
+        The header of each photo.
+    """
+    times = [get_image_time(tags) for tags in exif_data]
+    exif_meta = [get_meta_from_exif(tags) for tags in exif_data]
+    for i, (time, meta) in enumerate(zip(times, exif_meta)):
+        if time is None or 'LAT' not in meta or 'LON' not in meta:
+            raise ValueError(f'The EXIF data of photo {i} has no time or GPS '
+                             'location, which are needed to build the meta '
+                             'data.')
+    return build_meta_batch_from_values(
+        im_cx, im_cy, im_radius, times, [meta['LAT'] for meta in exif_meta],
+        [meta['LON'] for meta in exif_meta], exif_meta)
+
+
+def build_meta_batch_from_values(im_cx, im_cy, im_radius, times, lats, lons,
+                                 exif_meta=None):
+    """
+    Build the meta data of many photos, such as the frames of a video, at
+    once from their times and locations.
+
+    This gives the same headers as `get_plate_scale`, `build_wcs` and
+    `build_meta_from_values` for each photo in turn, but the ephemeris of all
+    the photos is computed with one call for each quantity on arrays of times
+    and locations, which is much faster for large batches.
+
+    Parameters
+    ----------
+    im_cx : `astropy.units.Quantity`
+        The x coordinates of the centres of the disks, one for each photo.
+
+    im_cy : `astropy.units.Quantity`
+        The y coordinates of the centres of the disks.
+
+    im_radius : `astropy.units.Quantity`
+        The radii of the disks.
+
+    times : sequence of `datetime.datetime`
+        The times the photos were taken.
+
+    lats, lons : array_like
+        The latitudes and longitudes of the cameras in degrees.
+
+    exif_meta : `list` of `dict`, optional
+        Further keys of the header of each photo, such as the exposure time
+        and camera, see `get_meta_from_exif`. The ``LAT``, ``LON`` and
+        ``DATEOBS`` keys are added to them.
+
+    Returns
+    -------
+    headers : `list` of `sunpy.util.MetaDict`
+        The header of each photo.
+    """
+    times = list(times)
+    lats = np.broadcast_to(np.asarray(lats, dtype=float), (len(times),))
+    lons = np.broadcast_to(np.asarray(lons, dtype=float), (len(times),))
+    if exif_meta is None:
+        exif_meta = [{} for _ in times]
+
+    # many photos share a time stamp and a location, so only compute the
+    # ephemeris for the distinct ones
+    keys = np.column_stack([Time(times).unix, lats, lons])
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    obstime = Time(keys[:, 0], format='unix')
+    location = EarthLocation(lat=keys[:, 1] * u.deg, lon=keys[:, 2] * u.deg)
+
+    dsun = sunpy.coordinates.sun.earth_distance(obstime).reshape(-1)[inverse]
+    hglt_obs = sunpy.coordinates.sun.B0(obstime).reshape(-1)[inverse]
+    solar_rotation_angle = sunpy.coordinates.sun.orientation(
+        location, obstime).reshape(-1)[inverse]
+    rsun_obs = np.arctan(sunpy.sun.constants.radius / dsun).to('arcsec')
+    plate_scale = (rsun_obs / im_radius).to_value('arcsec/pix')
+
+    # every WCS only differs in its reference pixel, scale and date
+    wcs = build_wcs(im_cx[:1], im_cy[:1], plate_scale[0] * u.arcsec / u.pix)
+    wcs.wcs.dateobs = times[0].isoformat()
+    template = dict(wcs.to_header())
+
+    # index plain arrays rather than quantities in the loop
+    crpix1, crpix2 = im_cy.to_value(u.pix), im_cx.to_value(u.pix)
+    crota2 = solar_rotation_angle.to_value(u.deg)
+    dsun = dsun.to_value(u.m)
+    hglt_obs = hglt_obs.to_value(u.deg)
+    rsun_obs = rsun_obs.to_value(u.arcsec)
+
+    headers = []
+    for i, time in enumerate(times):
+        header = MetaDict(template)
+        header.update({'crpix1': crpix1[i], 'crpix2': crpix2[i],
+                       'cdelt1': plate_scale[i], 'cdelt2': plate_scale[i],
+                       'date-obs': time.isoformat()})
+        header.update(exif_meta[i])
+        header.update({'LAT': float(lats[i]), 'LON': float(lons[i]),
+                       'DATEOBS': time.isoformat()})
+        header.update({'crota2': crota2[i],
+                       'dsun_obs': dsun[i],
+                       'hgln_obs': 0.0,
+                       'hglt_obs': hglt_obs[i],
+                       'ctype1': 'HPLN-TAN',
+                       'ctype2': 'HPLT-TAN',
+                       'rsun': dsun[i],
+                       'rsun_obs': rsun_obs[i]})
+        headers.append(header)
+    return headers
+
+
 def get_solar_rotation_angle(lat, lon, time, fudge_angle=0):
     """Get the solar rotation angle"""
-    loc = EarthLocation(lat=lat, lon=lon)
-    solar_rotation_angle = sunpy.coordinates.sun.orientation(loc, time)
+    solar_rotation_angle = ephemeris.orientation(lat, lon, time)
     return solar_rotation_angle + fudge_angle
 
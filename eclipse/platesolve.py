@@ -0,0 +1,393 @@
+"""Procedures to refine the WCS of a map from the stars and planets in it."""
+import csv
+import functools
+import os
+
+import astropy.units as u
+import numpy as np
+import scipy.ndimage as ndimage
+from astropy.coordinates import SkyCoord, get_body
+from scipy.spatial import cKDTree
+from sunpy.map import GenericMap
+
+__all__ = ['load_catalog', 'find_point_sources', 'predict_sources',
+           'match_sources', 'refine_wcs']
+
+#: The planets which are searched for by default.
+PLANETS = ('mercury', 'venus', 'mars', 'jupiter', 'saturn')
+
+# The distance the stars are placed at, far enough that the parallax between
+# the Earth and the Sun is negligible
+_STAR_DISTANCE = 1e6 * u.pc
+
+
+@functools.lru_cache()
+def load_catalog():
+    """
+    Load the catalogue of bright stars bundled with the package.
+
+    The catalogue has the J2000 positions and visual magnitudes of the
+    brightest stars within about 40 degrees of the ecliptic, where the Sun is
+    during an eclipse.
+
+    Returns
+    -------
+    names : `numpy.ndarray`
+        The names of the stars.
+
+    coords : `astropy.coordinates.SkyCoord`
+        The positions of the stars.
+
+    vmag : `numpy.ndarray`
+        The visual magnitudes of the stars.
+
+    tree : `scipy.spatial.cKDTree`
+        A tree of the unit vectors of the stars, to find those near a
+        direction quickly.
+    """
+    filename = os.path.join(os.path.dirname(__file__), 'data',
+                            'bright_stars.csv')
+    with open(filename) as f:
+        rows = list(csv.DictReader(line for line in f
+                                   if not line.startswith('#')))
+    names = np.array([row['name'] for row in rows])
+    coords = SkyCoord([row['ra'] for row in rows],
+                      [row['dec'] for row in rows], frame='icrs')
+    vmag = np.array([float(row['vmag']) for row in rows])
+    tree = cKDTree(coords.cartesian.xyz.value.T)
+    return names, coords, vmag, tree
+
+
+def find_point_sources(sunpymap, min_radius=1.5, threshold=5, box=15,
+                       max_sources=50):
+    """
+    Find stars and planets in a map, away from the disk and the inner corona.
+
+    The smooth corona is removed by subtracting the mean in a box around each
+    pixel, and the sources brighter than ``threshold`` times the robust
+    standard deviation of what is left, after smoothing it by a pixel, are
+    kept.
+
+    Parameters
+    ----------
+    sunpymap : `sunpy.map.GenericMap`
+        The map.
+
+    min_radius : `float`, optional
+        The distance from the centre of the disk, in units of its radius,
+        within which sources are not searched for. Defaults to 1.5.
+
+    threshold : `float`, optional
+        The detection threshold in standard deviations. Defaults to 5.
+
+    box : `int`, optional
+        The size in pixels of a source. The background is the mean in a box
+        four times larger. Defaults to 15.
+
+    max_sources : `int`, optional
+        The largest number of sources to return, the brightest first.
+        Defaults to 50.
+
+    Returns
+    -------
+    x, y : `numpy.ndarray`
+        The column and row of the centroid of each source.
+
+    flux : `numpy.ndarray`
+        The flux of each source above the background.
+    """
+    im = np.asarray(sunpymap.data, dtype=np.float32)
+    valid = np.isfinite(im)
+    if not valid.all():
+        im = np.where(valid, im, 0)
+    residual = im - ndimage.uniform_filter(im, 4 * box)
+    # smooth the noise, which is much finer than the sources
+    residual = ndimage.gaussian_filter(residual, 1)
+
+    rows, columns = np.ogrid[:im.shape[0], :im.shape[1]]
+    # the centre and radius of the disk, see eclipse.meta.build_wcs
+    radius = sunpymap.meta['rsun_obs'] / sunpymap.meta['cdelt1']
+    outside = ((rows - sunpymap.meta['crpix2']) ** 2 +
+               (columns - sunpymap.meta['crpix1']) ** 2 >
+               (min_radius * radius) ** 2)
+    if not valid.all():
+        # the background is wrong close to pixels outside of the photo
+        valid = ndimage.binary_erosion(valid, iterations=box)
+    mask = valid & outside
+    if not mask.any():
+        return np.empty(0), np.empty(0), np.empty(0)
+
+    values = residual[mask]
+    median = np.median(values)
+    noise = 1.4826 * np.median(np.abs(values - median))
+    labels, n_sources = ndimage.label(mask & (residual > median +
+                                              threshold * noise))
+    if n_sources == 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    # the sums over the pixels of each source, which are few
+    source_rows, source_columns = np.nonzero(labels)
+    source_labels = labels[source_rows, source_columns]
+    signal = residual[source_rows, source_columns] - median
+    flux = np.bincount(source_labels, signal, n_sources + 1)[1:]
+    centroids = np.column_stack([
+        np.bincount(source_labels, signal * source_rows, n_sources + 1)[1:],
+        np.bincount(source_labels, signal * source_columns,
+                    n_sources + 1)[1:]]) / flux[:, None]
+    brightest = np.argsort(flux)[::-1][:max_sources]
+    return (centroids[brightest, 1], centroids[brightest, 0],
+            flux[brightest])
+
+
+def predict_sources(sunpymap, max_magnitude=4, planets=PLANETS):
+    """
+    Predict the pixels of the catalogued stars and the planets in a map.
+
+    The stars near the Sun are found with the tree of `load_catalog`, so that
+    only those which may be in the map are transformed to its coordinates.
+
+    Parameters
+    ----------
+    sunpymap : `sunpy.map.GenericMap`
+        The map.
+
+    max_magnitude : `float`, optional
+        The faintest stars to include. Defaults to 4.
+
+    planets : sequence of `str`, optional
+        The planets to include. Defaults to `PLANETS`.
+
+    Returns
+    -------
+    names : `numpy.ndarray`
+        The name of each source in the map.
+
+    x, y : `numpy.ndarray`
+        The column and row of each source.
+    """
+    time = sunpymap.date
+    names, coords, vmag, tree = load_catalog()
+
+    # the angle from the Sun to the farthest corner of the map
+    n_rows, n_columns = sunpymap.data.shape
+    corners = np.array([[0, 0], [n_columns - 1, 0], [0, n_rows - 1],
+                        [n_columns - 1, n_rows - 1]])
+    center = sunpymap.wcs.world_to_pixel(
+        SkyCoord(0 * u.arcsec, 0 * u.arcsec,
+                 frame=sunpymap.coordinate_frame))
+    distance = np.hypot(*(corners - np.array(center)).T).max()
+    field = (1.1 * distance * sunpymap.meta['cdelt1'] * u.arcsec).to_value(
+        u.rad)
+
+    sun = get_body('sun', time)
+    sun_vector = SkyCoord(sun.ra, sun.dec).cartesian.xyz.value
+    nearby = np.array(tree.query_ball_point(sun_vector,
+                                            2 * np.sin(min(field, np.pi) / 2)),
+                      dtype=int)
+    nearby = nearby[vmag[nearby] <= max_magnitude]
+    stars = SkyCoord(coords[nearby].ra, coords[nearby].dec,
+                     distance=_STAR_DISTANCE, frame='icrs', obstime=time)
+    source_names = list(names[nearby])
+    source_coords = [stars.transform_to(sunpymap.coordinate_frame)]
+    for planet in planets:
+        source_coords.append(get_body(planet, time).transform_to(
+            sunpymap.coordinate_frame).reshape((1,)))
+        source_names.append(planet.capitalize())
+
+    x, y = sunpymap.wcs.world_to_pixel(
+        SkyCoord(np.concatenate([c.Tx for c in source_coords]),
+                 np.concatenate([c.Ty for c in source_coords]),
+                 frame=sunpymap.coordinate_frame))
+    inside = (x >= 0) & (x <= n_columns - 1) & (y >= 0) & (y <= n_rows - 1)
+    return np.array(source_names)[inside], x[inside], y[inside]
+
+
+def _similarity_fit(z_from, z_to):
+    """
+    The least squares similarity transform ``z_to = a * z_from + b`` of
+    points given as complex numbers.
+    """
+    mean_from = z_from.mean()
+    mean_to = z_to.mean()
+    a = (np.vdot(z_from - mean_from, z_to - mean_to) /
+         np.vdot(z_from - mean_from, z_from - mean_from))
+    return a, mean_to - a * mean_from
+
+
+def match_sources(x, y, predicted_x, predicted_y, center, tolerance=5,
+                  max_rotation=None, max_scale_error=0.1, min_matches=3):
+    """
+    Match detected sources to predicted ones and find the similarity
+    transform between them.
+
+    Each pair of a detected and a predicted source at a similar distance from
+    the centre of the Sun is a hypothesis of the rotation and scale about
+    it, and the hypothesis which brings the most predicted sources within
+    ``tolerance`` of a detected one wins. The transform is then fit to the
+    matched pairs by least squares, with a shift as well.
+
+    Parameters
+    ----------
+    x, y : `numpy.ndarray`
+        The pixels of the detected sources.
+
+    predicted_x, predicted_y : `numpy.ndarray`
+        The pixels of the predicted sources.
+
+    center : `tuple` of `float`
+        The pixel of the centre of the Sun.
+
+    tolerance : `float`, optional
+        The largest distance in pixels between matched sources. Defaults to
+        5.
+
+    max_rotation : `astropy.units.Quantity`, optional
+        The largest rotation to search. Defaults to `None`, any rotation.
+
+    max_scale_error : `float`, optional
+        The largest fractional error of the plate scale to search. Defaults
+        to 0.1.
+
+    min_matches : `int`, optional
+        The smallest number of matched sources. Defaults to 3.
+
+    Returns
+    -------
+    matches : `numpy.ndarray`
+        The index of the detected source matched to each predicted source, or
+        -1 if none is.
+
+    transform : `tuple` of `complex`
+        The transform ``(a, b)`` from the predicted pixels ``z = x + 1j * y``
+        to the detected ones, ``a * z + b``.
+
+    Raises
+    ------
+    ValueError
+        If fewer than ``min_matches`` sources are matched.
+    """
+    z_detected = np.asarray(x) + 1j * np.asarray(y)
+    z_predicted = np.asarray(predicted_x) + 1j * np.asarray(predicted_y)
+    if len(z_detected) < min_matches or len(z_predicted) < min_matches:
+        raise ValueError(f'Too few sources to match: {len(z_detected)} '
+                         f'detected and {len(z_predicted)} predicted.')
+    z_center = center[0] + 1j * center[1]
+    tree = cKDTree(np.column_stack([z_detected.real, z_detected.imag]))
+
+    # every pair at a similar distance from the Sun is a hypothesis
+    ratio = ((z_detected - z_center)[:, None] /
+             (z_predicted - z_center)[None, :]).ravel()
+    keep = np.abs(np.log(np.abs(ratio))) < np.log1p(max_scale_error)
+    if max_rotation is not None:
+        keep &= np.abs(np.angle(ratio)) < max_rotation.to_value(u.rad)
+    ratio = ratio[keep]
+    if len(ratio) == 0:
+        raise ValueError('No source is at a distance from the Sun close to '
+                         'that of a predicted one.')
+    moved = z_center + ratio[:, None] * (z_predicted - z_center)[None, :]
+    distances, _ = tree.query(np.column_stack([moved.real.ravel(),
+                                               moved.imag.ravel()]),
+                              distance_upper_bound=tolerance)
+    votes = np.isfinite(distances).reshape(moved.shape).sum(axis=1)
+    a, b = ratio[np.argmax(votes)], z_center * (1 - ratio[np.argmax(votes)])
+
+    for _ in range(3):
+        moved = a * z_predicted + b
+        distances, matches = tree.query(
+            np.column_stack([moved.real, moved.imag]),
+            distance_upper_bound=tolerance)
+        matches[~np.isfinite(distances)] = -1
+        matched = matches >= 0
+        if matched.sum() < min_matches:
+            raise ValueError(f'Only {matched.sum()} sources were matched, '
+                             f'{min_matches} are needed.')
+        a, b = _similarity_fit(z_predicted[matched],
+                               z_detected[matches[matched]])
+    return matches, (a, b)
+
+
+def refine_wcs(sunpymap, max_magnitude=4, planets=PLANETS, tolerance=5,
+               max_rotation=None, max_scale_error=0.1, min_matches=3,
+               full_output=False, **kwargs):
+    """
+    Refine the plate scale, rotation and pointing of a map from the stars
+    and planets in it.
+
+    The WCS built by `eclipse.meta` puts the centre of the Sun at the centre
+    of the disk of the Moon, takes the plate scale from the radius of the
+    Moon and the rotation from the time and location in the EXIF data. The
+    sources found by `find_point_sources` are matched to those predicted by
+    `predict_sources` with `match_sources`, and the similarity transform
+    between them corrects all three.
+
+    Parameters
+    ----------
+    sunpymap : `sunpy.map.GenericMap`
+        The map.
+
+    max_magnitude, planets
+        See `predict_sources`.
+
+    tolerance, max_rotation, max_scale_error, min_matches
+        See `match_sources`.
+
+    full_output : `bool`, optional
+        Whether to also return the matched sources. Defaults to `False`.
+
+    kwargs
+        Passed to `find_point_sources`.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map with the refined WCS. The number of matched sources and the
+        root mean square distance in pixels between them after the fit are
+        in the ``nmatch`` and ``psresid`` keys of the header.
+
+    matches : `dict`
+        If ``full_output``, the ``'name'`` of each matched source and its
+        detected (``'x'``, ``'y'``) and predicted (``'predicted_x'``,
+        ``'predicted_y'``) pixels.
+
+    Raises
+    ------
+    ValueError
+        If too few sources are matched.
+    """
+    x, y, _ = find_point_sources(sunpymap, **kwargs)
+    names, predicted_x, predicted_y = predict_sources(
+        sunpymap, max_magnitude=max_magnitude, planets=planets)
+    center = sunpymap.wcs.world_to_pixel(
+        SkyCoord(0 * u.arcsec, 0 * u.arcsec, frame=sunpymap.coordinate_frame))
+    matches, (a, b) = match_sources(
+        x, y, predicted_x, predicted_y, (float(center[0]), float(center[1])),
+        tolerance=tolerance, max_rotation=max_rotation,
+        max_scale_error=max_scale_error, min_matches=min_matches)
+    matched = matches >= 0
+    residual = (a * (predicted_x + 1j * predicted_y)[matched] + b -
+                (x + 1j * y)[matches[matched]])
+
+    # the pixels of the map are moved by the transform, so the reference
+    # pixel moves with them and the pixel to world matrix is divided by it
+    transform = np.array([[a.real, -a.imag], [a.imag, a.real]])
+    cd = sunpymap.wcs.wcs.get_pc() * sunpymap.wcs.wcs.get_cdelt()[:, None]
+    cd = cd @ np.linalg.inv(transform)
+    crpix = transform @ (sunpymap.wcs.wcs.crpix - 1) + [b.real, b.imag] + 1
+    scale = np.sqrt(abs(np.linalg.det(cd)))
+    unit = u.Unit(sunpymap.wcs.wcs.cunit[0])
+    header = sunpymap.meta.copy()
+    header.update({'crpix1': crpix[0], 'crpix2': crpix[1],
+                   'cdelt1': (scale * unit).to_value(u.arcsec),
+                   'cdelt2': (scale * unit).to_value(u.arcsec),
+                   'crota2': np.rad2deg(np.arctan2(cd[1, 0], cd[0, 0])),
+                   'nmatch': int(matched.sum()),
+                   'psresid': float(np.sqrt(np.mean(np.abs(residual) ** 2)))})
+    for key in ('pc1_1', 'pc1_2', 'pc2_1', 'pc2_2', 'cd1_1', 'cd1_2',
+                'cd2_1', 'cd2_2'):
+        header.pop(key, None)
+    refined = GenericMap(data=sunpymap.data, header=header)
+    if not full_output:
+        return refined
+    return refined, {'name': names[matched],
+                     'x': x[matches[matched]], 'y': y[matches[matched]],
+                     'predicted_x': predicted_x[matched],
+                     'predicted_y': predicted_y[matched]}
@@ -1,26 +1,693 @@
+import functools
+import os
+from datetime import datetime
+
 import astropy.units as u
-import exifread
-import matplotlib
+import matplotlib.image
 import numpy as np
 import scipy.ndimage as ndimage
-from skimage.transform import hough_circle, hough_circle_peaks
-from sunpy.map import GenericMap
+import scipy.optimize as optimize
+from PIL import Image
+from skimage.draw import circle_perimeter
+from skimage.transform import hough_circle
+from sunpy.map import GenericMap, Map
 
 import eclipse.meta as m
+from eclipse.profiling import _record, _stage
+
+__all__ = ['find_sun_center_and_radius', 'find_sun_and_moon',
+           'load_detection_image', 'find_sun_in_photo', 'rgb_to_gray',
+           'LazyMap', 'eclipse_image_to_map', 'eclipse_image_to_fits']
+
+#: The weights of the red, green and blue channels used by `rgb_to_gray`.
+LUMINANCE_WEIGHTS = {
+    'average': (1 / 3, 1 / 3, 1 / 3),
+    'rec601': (0.299, 0.587, 0.114),
+    'rec709': (0.2126, 0.7152, 0.0722),
+}
+
+
+def rgb_to_gray(im_rgb, weights='average', dtype=np.float64, block_rows=64):
+    """
+    Convert a color image to grayscale.
+
+    The weighted sum of the channels is written straight into the grayscale
+    array a block of rows at a time, so that no full size floating point copy
+    of the color image is made.
+
+    Parameters
+    ----------
+    im_rgb : `numpy.ndarray`
+        The color image, with the channels along the last axis. A two
+        dimensional image, or one with a single channel, is taken to be
+        grayscale already. An alpha channel, the fourth of four or the second
+        of two channels, is left out.
+
+    weights : `str` or sequence of `float`, optional
+        The weights of the red, green and blue channels, or one of the names
+        in `LUMINANCE_WEIGHTS`. Defaults to ``'average'``, the mean of the
+        channels.
+
+    dtype : `numpy.dtype`, optional
+        The type of the grayscale image. Defaults to `numpy.float64`. For an
+        integer type the values of grayscale and color images alike are
+        scaled from the range of the type of the image to that of ``dtype``,
+        so 8 bit photos converted to `numpy.uint16` keep 8 bits of fraction
+        and 16 bit ones converted to `numpy.uint8` keep their top 8 bits.
+        Floating point images are taken to be between 0 and 1.
+
+    block_rows : `int`, optional
+        The number of rows converted at once. Defaults to 64.
+
+    Returns
+    -------
+    im : `numpy.ndarray`
+        The grayscale image.
+    """
+    dtype = np.dtype(dtype)
+    if im_rgb.ndim == 3 and im_rgb.shape[2] in (2, 4):
+        # leave out the alpha channel
+        im_rgb = im_rgb[..., :im_rgb.shape[2] - 1]
+    if im_rgb.ndim == 3 and im_rgb.shape[2] == 1:
+        im_rgb = im_rgb[..., 0]
+    if im_rgb.ndim == 2 and dtype.kind == 'f':
+        return im_rgb.astype(dtype, copy=False)
+    if im_rgb.ndim == 2:
+        # scaled to the integer type like a color image of one channel
+        im_rgb = im_rgb[..., np.newaxis]
+        weights = (1,)
+    elif isinstance(weights, str):
+        weights = LUMINANCE_WEIGHTS[weights]
+    weights = np.asarray(weights, dtype=dtype if dtype.kind == 'f'
+                         else np.float32)[:im_rgb.shape[2]]
 
-__all__ = ['find_sun_center_and_radius', 'eclipse_image_to_map']
+    if dtype.kind in 'ui':
+        if im_rgb.dtype.kind in 'ui':
+            image_max = np.iinfo(im_rgb.dtype).max
+            weights = weights * ((np.iinfo(dtype).max + 1) / (image_max + 1))
+        else:
+            image_max = 1
+            weights = weights * np.iinfo(dtype).max
+        weights = weights * min(1, np.iinfo(dtype).max /
+                                (image_max * weights.sum()))
 
+    im = np.empty(im_rgb.shape[:2], dtype=dtype)
+    for start in range(0, im.shape[0], block_rows):
+        block = im_rgb[start:start + block_rows] @ weights
+        if dtype.kind in 'ui':
+            block = np.clip(np.rint(block), np.iinfo(dtype).min,
+                            np.iinfo(dtype).max)
+        im[start:start + block_rows] = block
+    return im
 
-def find_sun_center_and_radius(im):
+
+def _row_filled_area(region):
+    """
+    The area of a region with the gaps in each of its rows filled in, which
+    fills a ring to a disk.
+    """
+    rows = region.any(axis=1)
+    first = np.argmax(region, axis=1)
+    last = region.shape[1] - np.argmax(region[:, ::-1], axis=1)
+    return np.sum((last - first)[rows])
+
+
+def _find_disk_roi(blur_im, scale=1):
+    """
+    Return the slices bounding the bright region which contains the Sun.
+
+    The bounding boxes of all the bright regions are found in one pass over
+    the labelled image, and their areas within their boxes with the Moon
+    filled in. The corona is taken to be the region with the largest area
+    weighted by how round it is: how square its bounding box is, times how
+    close the fraction of the box it fills is to the pi / 4 of a disk. So
+    lights in the foreground, lens flares, a bright edge cut off by the
+    frame or a bright square are not chosen. If ``scale`` is greater than
+    one the regions are found in the image subsampled by that factor, which
+    is safe because it is already blurred, and the slices are widened by one
+    subsampled pixel.
+    """
+    small_im = blur_im[::scale, ::scale]
+    label_im, nb_labels = ndimage.label(small_im > small_im.mean() * 3)
+    if nb_labels == 0:
+        raise ValueError("Could not find the Sun in the image.")
+    boxes = ndimage.find_objects(label_im)
+    # counting within each box only touches the pixels near each region
+    areas = np.array([_row_filled_area(label_im[box] == label)
+                      for label, box in enumerate(boxes, start=1)])
+    sizes = np.array([[box.stop - box.start for box in boxes[i]]
+                      for i in range(nb_labels)])
+    squareness = sizes.min(axis=1) / sizes.max(axis=1)
+    fill = areas / sizes.prod(axis=1) / (np.pi / 4)
+    roundness = squareness * np.minimum(fill, 1 / fill)
+    slice_x, slice_y = boxes[np.argmax(areas * roundness)]
+    if scale == 1:
+        return slice_x, slice_y
+    return tuple(slice(max((box.start - 1) * scale, 0),
+                       min((box.stop + 1) * scale, length))
+                 for box, length in zip((slice_x, slice_y), blur_im.shape))
+
+
+def _sobel(roi):
+    """
+    Take the derivative of the image along each axis.
+    """
+    sx = ndimage.sobel(roi, axis=0, mode='constant')
+    sy = ndimage.sobel(roi, axis=1, mode='constant')
+    return sx, sy
+
+
+def _sobel_magnitude(roi):
+    """
+    Take the derivative of the image to find the edges of the Sun.
+    """
+    return np.hypot(*_sobel(roi))
+
+
+def _downsample(im, factor):
+    """
+    Downsample an image by averaging ``factor`` x ``factor`` blocks of pixels.
+    """
+    if factor == 1:
+        return im
+    ny, nx = (im.shape[0] // factor) * factor, (im.shape[1] // factor) * factor
+    blocks = im[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor)
+    return blocks.mean(axis=(1, 3))
+
+
+def _hough_batches(edges, hough_radii, max_accumulator_bytes=None):
+    """
+    Yield the radii and Hough accumulator planes in batches which each take
+    at most ``max_accumulator_bytes`` of memory, counting the two boolean
+    masks of the accumulator which `_pyramid_search` makes. The caller must
+    drop each batch before asking for the next.
+
+    At least one radius is always searched at a time, so a single plane larger
+    than the budget is still computed.
+    """
+    if max_accumulator_bytes is None:
+        batch_size = len(hough_radii)
+    else:
+        plane_bytes = edges.size * (np.dtype(np.float64).itemsize +
+                                    2 * np.dtype(bool).itemsize)
+        batch_size = max(int(max_accumulator_bytes // plane_bytes), 1)
+    for i in range(0, len(hough_radii), batch_size):
+        radii = hough_radii[i:i + batch_size]
+        yield radii, hough_circle(edges, radii)
+
+
+def _plateau_centre(peaks):
+    """
+    The rounded centroid of the first connected region of ``peaks``, the
+    centre which `~skimage.transform.hough_circle_peaks` gives a flat peak.
+    """
+    rows = np.flatnonzero(peaks.any(axis=1))
+    cols = np.flatnonzero(peaks.any(axis=0))
+    crop = peaks[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    labels, _ = ndimage.label(crop, structure=np.ones((3, 3)))
+    cx, cy = ndimage.center_of_mass(crop, labels, 1)
+    return rows[0] + int(np.round(cx)), cols[0] + int(np.round(cy))
+
+
+def _hough_search(edges, hough_radii, max_accumulator_bytes=None):
+    """
+    Exhaustive Hough search for the most prominent circle in an edge map.
+
+    Returns the accumulator value, the row and column of the centre and the
+    radius of the circle. Only the best circle of each batch of radii is kept.
+    """
+    best = (-np.inf, None, None, None)
+    for radii, hough_res in _hough_batches(edges, hough_radii,
+                                           max_accumulator_bytes):
+        # the peak which hough_circle_peaks ranks first, the last radius of
+        # equal peaks, found without copying the accumulator
+        accums = hough_res.max(axis=(1, 2))
+        i_r = np.flatnonzero(accums == accums.max())[-1]
+        i_x, i_y = _plateau_centre(hough_res[i_r] == accums[i_r])
+        if accums[i_r] >= best[0]:
+            best = (accums[i_r], i_x, i_y, radii[i_r])
+        # free this batch before the next is computed
+        del hough_res
+    return best
+
+
+def _perimeter_score(sob, cxs, cys, radius):
+    """
+    The mean of ``sob`` along the perimeter of circles of the given radius
+    centred on each of (``cxs``, ``cys``).
+    """
+    rr, cc = circle_perimeter(0, 0, int(radius))
+    x = cxs[:, np.newaxis] + rr
+    y = cys[:, np.newaxis] + cc
+    inside = (x >= 0) & (x < sob.shape[0]) & (y >= 0) & (y < sob.shape[1])
+    values = sob[np.clip(x, 0, sob.shape[0] - 1), np.clip(y, 0, sob.shape[1] - 1)]
+    return np.where(inside, values, 0).sum(axis=1) / len(rr)
+
+
+def _best_circle(sob, cxs, cys, radii):
+    """
+    Of the candidate circles return the one whose perimeter follows the
+    strongest gradient.
+
+    The thresholded edge of the blurred Sun is many pixels wide so many
+    circles fit inside it equally well, the limb itself is the ridge of the
+    gradient magnitude.
+    """
+    best = (-np.inf, None, None, None)
+    for radius in np.unique(radii):
+        this_radius = radii == radius
+        score = _perimeter_score(sob, cxs[this_radius], cys[this_radius], radius)
+        i = np.argmax(score)
+        if score[i] > best[0]:
+            best = (score[i], cxs[this_radius][i], cys[this_radius][i], radius)
+    return best
+
+
+def _pyramid_search(sob, hough_radii, max_accumulator_bytes=None):
+    """
+    Hough search for the most prominent circle in a coarse level of the
+    pyramid, choosing between equally prominent circles with the gradient.
+    """
+    edges = sob > (sob.mean() * 5)
+    best_accum = -np.inf
+    candidates = []
+    for radii, hough_res in _hough_batches(edges, hough_radii,
+                                           max_accumulator_bytes):
+        accum = hough_res.max()
+        if accum > best_accum and not np.isclose(accum, best_accum):
+            best_accum, candidates = accum, []
+        if np.isclose(accum, best_accum):
+            # the values within the tolerance of np.isclose, found with
+            # boolean rather than floating point temporaries
+            tolerance = 1e-8 + 1e-5 * abs(best_accum)
+            close = hough_res >= best_accum - tolerance
+            close &= hough_res <= best_accum + tolerance
+            i_r, i_x, i_y = np.nonzero(close)
+            del close
+            candidates.append((i_x, i_y, radii[i_r]))
+        # free this batch before the next is computed
+        del hough_res
+    i_x, i_y, radii = (np.concatenate(c) for c in zip(*candidates))
+    return _best_circle(sob, i_x, i_y, radii.astype(int))
+
+
+def _refine_circle(sob, cx, cy, radius, margin):
+    """
+    Refine a circle by searching the radii within ``margin`` of ``radius`` and
+    the centres within ``margin`` of (``cx``, ``cy``).
+    """
+    offsets = np.arange(-margin, margin + 1)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    cxs = (int(round(cx)) + dx).ravel()
+    cys = (int(round(cy)) + dy).ravel()
+    radii = int(round(radius)) + offsets
+    radii = radii[radii > 0]
+    return _best_circle(sob, np.tile(cxs, len(radii)), np.tile(cys, len(radii)),
+                        np.repeat(radii, len(cxs)))
+
+
+def _limb_points(sx, sy):
+    """
+    Return the row and column of the edge pixels which lie on the ridge of the
+    gradient magnitude.
+
+    Pixels above the edge threshold are kept only if the gradient magnitude
+    is not smaller on either side of them along the gradient direction, which
+    thins the wide edge of the blurred Sun to a line along the limb. The
+    border of the region, where the gradient jumps to the zero padding, is
+    left out.
+    """
+    sob = np.hypot(sx, sy)
+    inner = sob[1:-1, 1:-1]
+    x, y = np.nonzero(inner > (np.percentile(inner, 99) / 2))
+    x, y = x + 1, y + 1
+    # step to the neighbouring pixel closest to the gradient direction
+    angle = np.arctan2(sx[x, y], sy[x, y])
+    dx = np.rint(np.sin(angle)).astype(int)
+    dy = np.rint(np.cos(angle)).astype(int)
+    ridge = ((sob[x, y] >= sob[x + dx, y + dy]) &
+             (sob[x, y] >= sob[x - dx, y - dy]))
+    return x[ridge], y[ridge]
+
+
+def _circle_through(x, y):
+    """
+    The centres and radii of the circles through each triple of points.
+
+    ``x`` and ``y`` have shape ``(n, 3)``. Degenerate triples give a radius of
+    `numpy.inf`.
+    """
+    ax, bx, cx = x[:, 0], x[:, 1], x[:, 2]
+    ay, by, cy = y[:, 0], y[:, 1], y[:, 2]
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    a2, b2, c2 = ax ** 2 + ay ** 2, bx ** 2 + by ** 2, cx ** 2 + cy ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+        uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    radius = np.where(d == 0, np.inf, np.hypot(ax - ux, ay - uy))
+    return ux, uy, radius
+
+
+def _ransac_circle(x, y, min_radius, max_radius, residual_threshold=2,
+                   max_trials=500, seed=0):
+    """
+    Find the circle with the most points within ``residual_threshold`` of it,
+    from circles through random triples of the points.
+
+    Returns a boolean array marking the inliers of the best circle.
+    """
+    if len(x) < 3:
+        raise ValueError("Could not find the limb of the Sun in the image.")
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, len(x), size=(max_trials, 3))
+    ux, uy, radius = _circle_through(x[samples].astype(float),
+                                     y[samples].astype(float))
+    valid = (radius >= min_radius) & (radius <= max_radius)
+    best_inliers, best_count = None, 0
+    for i in np.flatnonzero(valid):
+        residuals = np.abs(np.hypot(x - ux[i], y - uy[i]) - radius[i])
+        inliers = residuals < residual_threshold
+        count = np.count_nonzero(inliers)
+        if count > best_count:
+            best_inliers, best_count = inliers, count
+    if best_inliers is None:
+        raise ValueError("Could not find the limb of the Sun in the image.")
+    return best_inliers
+
+
+def _fit_circle(x, y, cx, cy, radius):
+    """
+    Least-squares fit of a circle to the points, starting from the given
+    circle.
+
+    Returns the centre and radius and their one sigma uncertainties.
+    """
+    def residuals(p):
+        return np.hypot(x - p[0], y - p[1]) - p[2]
+
+    result = optimize.least_squares(residuals, [cx, cy, radius])
+    dof = max(len(x) - 3, 1)
+    variance = np.sum(result.fun ** 2) / dof
+    covariance = np.linalg.inv(result.jac.T @ result.jac) * variance
+    return result.x, np.sqrt(np.diag(covariance))
+
+
+def _limb_fit(x, y, min_radius, max_radius):
+    """
+    Fit a circle to the limb points with outliers, such as prominences and the
+    corona, rejected.
+
+    Returns the centre and radius, their one sigma uncertainties and the
+    number of points used in the fit.
+    """
+    inliers = _ransac_circle(x, y, min_radius, max_radius)
+    x, y = x[inliers].astype(float), y[inliers].astype(float)
+    # start the least-squares fit from the algebraic fit to the inliers
+    a = np.column_stack([x, y, np.ones_like(x)])
+    (p, q, r), *_ = np.linalg.lstsq(a, x ** 2 + y ** 2, rcond=None)
+    cx, cy = p / 2, q / 2
+    radius = np.sqrt(r + cx ** 2 + cy ** 2)
+    params, sigma = _fit_circle(x, y, cx, cy, radius)
+    return params, sigma, len(x)
+
+
+def _circle_hypotheses(x, y, cos, min_radius, max_radius, max_trials,
+                       min_alignment, rng):
+    """
+    Circles through random triples of the limb points, each classified as a
+    limb of the Sun or of the Moon from the direction of the gradient.
+
+    ``cos`` is a function giving the cosine of the angle between the gradient
+    at some points and the direction away from some centres. The Sun is
+    brighter inside its limb, so the gradient points towards its centre,
+    while the Moon is darker inside its limb. Triples whose gradients do not
+    all point the same way, which mostly straddle the two limbs, are
+    dropped.
+
+    Returns the centres and radii of the circles and whether each is a limb
+    of the Moon.
+    """
+    samples = rng.integers(0, len(x), size=(max_trials, 3))
+    ux, uy, radius = _circle_through(x[samples].astype(float),
+                                     y[samples].astype(float))
+    valid = (radius >= min_radius) & (radius <= max_radius)
+    samples, ux, uy, radius = (samples[valid], ux[valid], uy[valid],
+                               radius[valid])
+    alignment = cos(samples, ux[:, None], uy[:, None])
+    sun = np.all(alignment < -min_alignment, axis=1)
+    moon = np.all(alignment > min_alignment, axis=1)
+    keep = sun | moon
+    return ux[keep], uy[keep], radius[keep], moon[keep]
+
+
+def _count_inliers(x, y, alignment_sign, cos, ux, uy, radius,
+                   residual_threshold, min_alignment, block=64):
+    """
+    The number of limb points within ``residual_threshold`` of each circle
+    whose gradient points the right way for it, in blocks of circles to
+    bound the memory.
+    """
+    counts = np.empty(len(ux), dtype=int)
+    for start in range(0, len(ux), block):
+        end = start + block
+        cx, cy = ux[start:end, None], uy[start:end, None]
+        near = np.abs(np.hypot(x - cx, y - cy) -
+                      radius[start:end, None]) < residual_threshold
+        aligned = (alignment_sign[start:end, None] *
+                   cos(slice(None), cx, cy)) > min_alignment
+        counts[start:end] = np.count_nonzero(near & aligned, axis=1)
+    return counts
+
+
+def _fit_two_circles(sun_x, sun_y, moon_x, moon_y, sun, moon):
+    """
+    Least-squares fit of the limbs of the Sun and the Moon together.
+
+    Returns the centres and radii of both circles and their one sigma
+    uncertainties.
+    """
+    n_sun = len(sun_x)
+
+    def residuals(p):
+        return np.concatenate([np.hypot(sun_x - p[0], sun_y - p[1]) - p[2],
+                               np.hypot(moon_x - p[3], moon_y - p[4]) - p[5]])
+
+    result = optimize.least_squares(residuals, np.concatenate([sun, moon]))
+    dof = max(len(result.fun) - 6, 1)
+    variance = np.sum(result.fun ** 2) / dof
+    # the limbs are fit separately if the Moon is not found
+    jac = result.jac if len(moon_x) else result.jac[:n_sun, :3]
+    sigma = np.sqrt(np.diag(np.linalg.inv(jac.T @ jac) * variance))
+    return result.x, np.pad(sigma, (0, 6 - len(sigma)),
+                            constant_values=np.nan)
+
+
+def _obscuration(sun_radius, moon_radius, distance):
+    """
+    The fraction of the area of the disk of the Sun covered by the Moon,
+    from the area of the lens where the two disks overlap.
+    """
+    R, r, d = sun_radius, moon_radius, distance
+    if d >= R + r:
+        return 0.0
+    if d <= abs(R - r):
+        return min(r / R, 1.0) ** 2
+    area = (r ** 2 * np.arccos((d ** 2 + r ** 2 - R ** 2) / (2 * d * r)) +
+            R ** 2 * np.arccos((d ** 2 + R ** 2 - r ** 2) / (2 * d * R)) -
+            0.5 * np.sqrt((-d + r + R) * (d + r - R) * (d - r + R) *
+                          (d + r + R)))
+    return float(area / (np.pi * R ** 2))
+
+
+def _sun_and_moon_fit(roi, residual_threshold=2, max_trials=1000,
+                      min_alignment=0.8, seed=0):
+    """
+    Find the limbs of the Sun and of the Moon cutting into it in the region
+    of interest.
+
+    The limb points are classified by the direction of their gradient
+    relative to circles through random triples of them, the best circle of
+    each kind is the one with the most points, and both are then fit
+    together. If there are too few points on the limb of the Moon the photo
+    is taken to be of the uneclipsed Sun.
+
+    Returns the centre and radius of the Sun and of the Moon, or NaN for the
+    Moon if it is not found, their one sigma uncertainties and the number of
+    points on each limb.
+    """
+    sx, sy = _sobel(roi)
+    x, y = _limb_points(sx, sy)
+    if len(x) < 3:
+        raise ValueError("Could not find the limb of the Sun in the image.")
+    magnitude = np.hypot(sx[x, y], sy[x, y])
+    gx, gy = sx[x, y] / magnitude, sy[x, y] / magnitude
+    x, y = x.astype(float), y.astype(float)
+
+    def cos(points, cx, cy):
+        dx, dy = x[points] - cx, y[points] - cy
+        return (gx[points] * dx + gy[points] * dy) / np.hypot(dx, dy)
+
+    rng = np.random.default_rng(seed)
+    min_radius = np.mean(roi.shape) / 8
+    # the centre of the Moon may lie outside the region of the crescent
+    max_radius = 2 * max(roi.shape)
+    ux, uy, radius, is_moon = _circle_hypotheses(
+        x, y, cos, min_radius, max_radius, max_trials, min_alignment, rng)
+    if not np.any(~is_moon):
+        raise ValueError("Could not find the limb of the Sun in the image.")
+    sign = np.where(is_moon, 1, -1)
+    counts = _count_inliers(x, y, sign, cos, ux, uy, radius,
+                            residual_threshold, min_alignment)
+
+    circles = []
+    for kind in (False, True):
+        index = np.flatnonzero(is_moon == kind)
+        if kind:
+            # the Moon looks between 0.92 and 1.08 times as big as the Sun
+            ratio = radius[index] / circles[0][0][2]
+            index = index[(ratio > 0.8) & (ratio < 1.25)]
+        best = index[np.argmax(counts[index])] if len(index) else None
+        if best is None:
+            circles.append((np.array([np.nan] * 3), np.zeros(len(x), bool)))
+            continue
+        near = np.abs(np.hypot(x - ux[best], y - uy[best]) -
+                      radius[best]) < residual_threshold
+        aligned = sign[best] * cos(slice(None), ux[best],
+                                   uy[best]) > min_alignment
+        circles.append((np.array([ux[best], uy[best], radius[best]]),
+                        near & aligned))
+    (sun, sun_points), (moon, moon_points) = circles
+    if np.count_nonzero(moon_points) < max(10, 0.05 *
+                                           np.count_nonzero(sun_points)):
+        moon, moon_points = np.array([np.nan] * 3), np.zeros(len(x), bool)
+
+    params, sigma = _fit_two_circles(x[sun_points], y[sun_points],
+                                     x[moon_points], y[moon_points], sun,
+                                     moon if np.isfinite(moon).all()
+                                     else np.zeros(3))
+    if not moon_points.any():
+        params[3:] = np.nan
+    return (params[:3], params[3:], sigma[:3], sigma[3:],
+            np.count_nonzero(sun_points), np.count_nonzero(moon_points))
+
+
+def _hough_circle_search(roi, pyramid_levels, refine_margin,
+                         max_accumulator_bytes):
+    """
+    Hough search for the circle of the Sun in the region of interest,
+    exhaustive or coarse-to-fine.
+
+    Returns the score, centre and radius of the circle, the number of radii
+    tried and the refinement error.
+    """
+    if pyramid_levels == 0:
+        sob = _sobel_magnitude(roi)
+        hough_radii = np.arange(np.floor(np.mean(sob.shape) / 4),
+                                np.ceil(np.mean(sob.shape) / 2), 10)
+        score, cx, cy, radius = _hough_search(sob > (sob.mean() * 5),
+                                              hough_radii,
+                                              max_accumulator_bytes)
+    else:
+        # search over every radius at the coarsest level
+        sob = _sobel_magnitude(_downsample(roi, 2 ** pyramid_levels))
+        hough_radii = np.arange(np.floor(np.mean(sob.shape) / 4),
+                                np.ceil(np.mean(sob.shape) / 2), 1)
+        score, cx, cy, radius = _pyramid_search(sob, hough_radii,
+                                                max_accumulator_bytes)
+    n_radii = len(hough_radii)
+    refinement_error = 0 * u.pix
+
+    # then refine the circle at each finer level of the pyramid
+    for level in range(pyramid_levels - 1, -1, -1):
+        sob = _sobel_magnitude(_downsample(roi, 2 ** level))
+        # the centre of a coarse pixel lies between two finer pixels
+        pred_cx, pred_cy, pred_radius = 2 * cx + 0.5, 2 * cy + 0.5, 2 * radius
+        score, cx, cy, radius = _refine_circle(sob, pred_cx, pred_cy,
+                                               pred_radius, refine_margin)
+        n_radii += 2 * refine_margin + 1
+        refinement_error = np.max(np.abs([cx - pred_cx, cy - pred_cy,
+                                          radius - pred_radius])) * u.pix
+
+    return score, cx, cy, radius, n_radii, refinement_error
+
+
+def find_sun_center_and_radius(im, method='hough', pyramid_levels=0,
+                               refine_margin=3, max_accumulator_bytes=None,
+                               blur_sigma=8, roi_scale=1, full_output=False):
     """
     Given an image of the eclipsed Sun find the center and radius of the
     image.
 
+    By default the circle is found with an exhaustive Hough transform of the
+    full resolution edge map over radii in steps of 10 pixels. If
+    ``pyramid_levels`` is greater than zero the search is done coarse-to-fine
+    instead. The edge map is first searched exhaustively after downsampling by
+    a factor of ``2 ** pyramid_levels``, and the circle is then refined at
+    every finer level, up to full resolution, over a narrow band of radii and a
+    small window of centres around the prediction from the level above. This
+    is much faster and uses much less memory for large photos, and gives the
+    radius to the nearest pixel.
+
+    The Hough accumulator holds one plane the size of the searched edge map
+    for every radius. If ``max_accumulator_bytes`` is given the radii are
+    searched in batches whose planes fit in that budget, and only the best
+    circle of each batch is kept, so that the peak memory does not depend on
+    the number of radii.
+
+    With ``method='fit'`` no Hough transform of the full image is done.
+    Instead the pixels along the ridge of the edge map are fit with a circle,
+    after rejecting outliers such as prominences and the corona with RANSAC.
+    This gives the centre and radius to a fraction of a pixel, with an
+    uncertainty, in a time which scales with the number of edge pixels. If
+    ``pyramid_levels`` is also given, only the edge pixels close to the circle
+    found by the coarse-to-fine Hough search are fit.
+
+    With ``method='partial'`` the photo is taken to be of a partial phase, in
+    which the Moon cuts a second circular edge into the Sun, and the limbs of
+    both are fit together, see `find_sun_and_moon`. The circle of the Sun is
+    returned, and the circle of the Moon and the obscuration are in the
+    information about the search. ``pyramid_levels`` is not used.
+
     Parameters
     ----------
 
     im : `numpy.ndarray`
-        The image.
+        The image. It is searched in its own type, so a `numpy.float32` or
+        `numpy.uint16` image uses a half or a quarter of the memory of a
+        `numpy.float64` one. Only the region around the Sun is converted to
+        floating point.
+
+    method : {'hough', 'fit', 'partial'}, optional
+        Whether to find the circle with a Hough transform, by fitting the
+        limb, or by fitting the limbs of the Sun and of the Moon of a partial
+        phase. Defaults to ``'hough'``.
+
+    pyramid_levels : `int`, optional
+        The number of times the image is halved in size before the coarse
+        search. Defaults to 0, which is an exhaustive search at full
+        resolution.
+
+    refine_margin : `int`, optional
+        The half-width in pixels of the band of radii and of the window of
+        centres searched at each refinement level. Defaults to 3.
+
+    max_accumulator_bytes : `int`, optional
+        The largest number of bytes of Hough accumulator, and of the
+        temporary arrays made from it, to hold in memory at once. At least
+        one radius is searched at a time. Defaults to `None`, which searches
+        all radii at once.
+
+    blur_sigma : `float`, optional
+        The width in pixels of the Gaussian used to smooth the image before
+        searching it. Defaults to 8.
+
+    roi_scale : `int`, optional
+        The factor to subsample the blurred image by when finding the region
+        around the Sun. A factor of 2 to 4 makes this stage several times
+        faster and smaller for large photos. Defaults to 1.
+
+    full_output : `bool`, optional
+        If `True` also return a dictionary of information about the search.
 
     Returns
     -------
@@ -34,37 +701,475 @@ def find_sun_center_and_radius(im):
     im_radius : `astropy.units.Quantity`
         The radius of the disk.
 
+    info : `dict`
+        Only returned if ``full_output`` is `True`. Contains the method
+        (``'method'``), the number of pyramid levels (``'pyramid_levels'``),
+        the number of Hough radii tried (``'n_radii'``), the score of the
+        circle (``'score'``, the Hough accumulator for an exhaustive search,
+        the mean gradient along the circle for a pyramid search or the number
+        of limb pixels fit), the largest change in the centre or radius made
+        by the final refinement (``'refinement_error'``) and the uncertainty
+        of the centre and radius (``'uncertainty'``). For the Hough searches
+        the uncertainty is half the step of the search grid, for the fit it is
+        the statistical one sigma error. For ``method='partial'`` it also
+        contains the centre and radius of the Moon (``'moon'``), or `None` if
+        it is not found, their uncertainty (``'moon_uncertainty'``) and the
+        fraction of the disk of the Sun covered (``'obscuration'``).
+
     """
+    if method not in ('hough', 'fit', 'partial'):
+        raise ValueError(f"Unknown method '{method}', expected 'hough', "
+                         "'fit' or 'partial'.")
 
-    blur_im = ndimage.gaussian_filter(im, 8)
-    mask = blur_im > blur_im.mean() * 3
+    with _stage('blur_label'):
+        blur_im = ndimage.gaussian_filter(im, blur_sigma)
 
-    # the following code limits the region to search for the circle of the Sun
-    label_im, nb_labels = ndimage.label(mask)
-    slice_x, slice_y = ndimage.find_objects(label_im == 1)[0]
-    roi = blur_im[slice_x, slice_y]
+        # the following code limits the region to search for the circle of
+        # the Sun
+        slice_x, slice_y = _find_disk_roi(blur_im, roi_scale)
+        roi = blur_im[slice_x, slice_y]
+        if roi.dtype.kind != 'f':
+            roi = roi.astype(np.float32)
+    _record(image_shape=im.shape, roi_shape=roi.shape)
 
-    # take the derivative of the image to find the edges of the Sun
-    sx = ndimage.sobel(roi, axis=0, mode='constant')
-    sy = ndimage.sobel(roi, axis=1, mode='constant')
-    sob = np.hypot(sx, sy)
+    n_radii, refinement_error = 0, 0 * u.pix
+    if method == 'hough' or (method == 'fit' and pyramid_levels > 0):
+        with _stage('hough'):
+            (score, cx, cy, radius, n_radii,
+             refinement_error) = _hough_circle_search(
+                roi, pyramid_levels, refine_margin, max_accumulator_bytes)
+        radius_step = 10 if pyramid_levels == 0 else 1
+        uncertainty = np.array([0.5, 0.5, radius_step / 2]) * u.pix
+    _record(n_radii=n_radii)
 
-    hough_radii = np.arange(np.floor(np.mean(sob.shape) / 4),
-                            np.ceil(np.mean(sob.shape) / 2), 10)
-    hough_res = hough_circle(sob > (sob.mean() * 5), hough_radii)
+    if method == 'fit':
+        with _stage('fit'):
+            x, y = _limb_points(*_sobel(roi))
+            min_radius = np.mean(roi.shape) / 8
+            max_radius = np.mean(roi.shape) / 2
+            if pyramid_levels > 0:
+                # only fit the limb close to the circle from the Hough search
+                near = (np.abs(np.hypot(x - cx, y - cy) - radius) <=
+                        2 * refine_margin)
+                x, y = x[near], y[near]
+                min_radius = radius - refine_margin
+                max_radius = radius + refine_margin
+            (cx, cy, radius), sigma, score = _limb_fit(x, y, min_radius,
+                                                       max_radius)
+        _record(n_limb_points=score)
+        uncertainty = sigma * u.pix
 
-    # Select the most prominent circle
-    accums, cy, cx, radius = hough_circle_peaks(hough_res, hough_radii,
-                                                total_num_peaks=1)
+    if method == 'partial':
+        with _stage('fit'):
+            ((cx, cy, radius), moon, sigma, moon_sigma, score,
+             n_moon) = _sun_and_moon_fit(roi)
+        _record(n_limb_points=score, n_moon_points=n_moon)
+        uncertainty = sigma * u.pix
 
-    im_cx = (cx + slice_x.start) * u.pix
-    im_cy = (cy + slice_y.start) * u.pix
-    im_radius = radius * u.pix
+    im_cx = np.array([cx + slice_x.start]) * u.pix
+    im_cy = np.array([cy + slice_y.start]) * u.pix
+    im_radius = np.array([radius]) * u.pix
+
+    if full_output:
+        info = {'method': method,
+                'pyramid_levels': pyramid_levels,
+                'n_radii': n_radii,
+                'score': score,
+                'refinement_error': refinement_error,
+                'uncertainty': uncertainty}
+        if method == 'partial':
+            info['obscuration'] = 0.0
+            info['moon'] = info['moon_uncertainty'] = None
+            if np.isfinite(moon).all():
+                info['moon'] = (np.array([moon[0] + slice_x.start]) * u.pix,
+                                np.array([moon[1] + slice_y.start]) * u.pix,
+                                np.array([moon[2]]) * u.pix)
+                info['moon_uncertainty'] = moon_sigma * u.pix
+                info['obscuration'] = _obscuration(
+                    radius, moon[2], np.hypot(moon[0] - cx, moon[1] - cy))
+        return im_cx, im_cy, im_radius, info
 
     return im_cx, im_cy, im_radius
 
 
-def eclipse_image_to_map(filename):
+def find_sun_and_moon(im, blur_sigma=2, roi_scale=1, full_output=False):
+    """
+    Given an image of a partial phase of an eclipse find the disks of the Sun
+    and of the Moon, and how much of the Sun is covered.
+
+    The Moon cuts a second circular edge into the Sun, which confuses a
+    search for a single circle. Instead the pixels along the ridge of the
+    edge map are classified as limb of the Sun or of the Moon by the
+    direction of their gradient, which points into the bright Sun on both
+    limbs and so towards the centre of the Sun but away from the centre of
+    the Moon. Circles through random triples of limb points whose gradients
+    agree are scored by the number of points on them, all at once, and the
+    best circle of each kind is then refined by fitting both limbs together.
+
+    Parameters
+    ----------
+    im : `numpy.ndarray`
+        The image, for example of a photo taken through a solar filter.
+
+    blur_sigma : `float`, optional
+        The width in pixels of the Gaussian used to smooth the image. Defaults
+        to 2, as a wide blur rounds the cusps where the limbs meet.
+
+    roi_scale : `int`, optional
+        The factor to subsample the blurred image by when finding the region
+        around the Sun, see `find_sun_center_and_radius`. Defaults to 1.
+
+    full_output : `bool`, optional
+        If `True` also return a dictionary of information about the search,
+        see `find_sun_center_and_radius`.
+
+    Returns
+    -------
+    sun : `tuple` of `astropy.units.Quantity`
+        The row and column of the centre and the radius of the disk of the
+        Sun, like the result of `find_sun_center_and_radius`.
+
+    moon : `tuple` of `astropy.units.Quantity` or `None`
+        The row and column of the centre and the radius of the disk of the
+        Moon, or `None` if the Sun is not eclipsed.
+
+    obscuration : `float`
+        The fraction of the area of the disk of the Sun covered by the Moon.
+
+    info : `dict`
+        Only returned if ``full_output`` is `True`.
+    """
+    im_cx, im_cy, im_radius, info = find_sun_center_and_radius(
+        im, method='partial', blur_sigma=blur_sigma, roi_scale=roi_scale,
+        full_output=True)
+    result = (im_cx, im_cy, im_radius), info['moon'], info['obscuration']
+    if full_output:
+        return result + (info,)
+    return result
+
+
+def load_detection_image(filename, scale=8):
+    """
+    Decode a reduced resolution grayscale version of a photo to find the Sun
+    in.
+
+    JPEG photos are reduced by a factor of 2, 4 or 8 while they are decoded,
+    which is much faster and takes much less memory than decoding the full
+    photo. Other photos are decoded at full resolution and then reduced by
+    averaging blocks of pixels. Like the map data the image is flipped so that
+    its first row is the bottom of the photo.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    scale : `int`, optional
+        The factor to reduce the photo by. Defaults to 8.
+
+    Returns
+    -------
+    im : `numpy.ndarray`
+        The reduced grayscale image.
+
+    scale : `int`
+        The factor the photo was reduced by.
+
+    shape : `tuple`
+        The shape of the full resolution photo.
+    """
+    with Image.open(filename) as image:
+        width, height = image.size
+        image.draft('L', (width // scale, height // scale))
+        im = np.asarray(image.convert('L'), dtype=float)
+    draft_scale = int(round(width / im.shape[1]))
+    im = _downsample(im, max(scale // draft_scale, 1))
+    return np.flipud(im), int(round(width / im.shape[1])), (height, width)
+
+
+def find_sun_in_photo(filename, scale=8, full_output=False, **kwargs):
+    """
+    Find the center and radius of the Sun in a photo without decoding it at
+    full resolution.
+
+    The Sun is found in a reduced resolution image of the photo, see
+    `load_detection_image`, and its center and radius are converted back to
+    pixels of the full photo.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    scale : `int`, optional
+        The factor to reduce the photo by. Defaults to 8.
+
+    full_output : `bool`, optional
+        If `True` also return a dictionary of information about the search,
+        with the reduction factor in ``'scale'``.
+
+    kwargs
+        Passed to `find_sun_center_and_radius`. The width of the blur is
+        reduced with the image unless ``blur_sigma`` is given.
+
+    Returns
+    -------
+    im_cx, im_cy, im_radius : `astropy.units.Quantity`
+        The center and radius of the disk in pixels of the full photo, see
+        `find_sun_center_and_radius`.
+    """
+    with _stage('decode_reduced'):
+        im, scale, (height, width) = load_detection_image(filename, scale)
+    kwargs.setdefault('blur_sigma', 8 / scale)
+    im_cx, im_cy, im_radius, info = find_sun_center_and_radius(
+        im, full_output=True, **kwargs)
+
+    im_cx, im_cy, im_radius = _to_photo_pixels(im_cx, im_cy, im_radius, scale,
+                                               im.shape[0], height)
+    if full_output:
+        info['scale'] = scale
+        info['uncertainty'] = info['uncertainty'] * scale
+        if info.get('moon') is not None:
+            info['moon'] = _to_photo_pixels(*info['moon'], scale, im.shape[0],
+                                            height)
+            info['moon_uncertainty'] = info['moon_uncertainty'] * scale
+        return im_cx, im_cy, im_radius, info
+    return im_cx, im_cy, im_radius
+
+
+def _to_photo_pixels(im_cx, im_cy, im_radius, scale, rows, height):
+    """
+    Convert a circle in a reduced image of ``rows`` rows to pixels of the
+    full photo of ``height`` rows.
+    """
+    # each reduced pixel covers a block of scale x scale photo pixels,
+    # counted from the top left of the photo before it was flipped
+    offset = (scale - 1) / 2
+    row = rows - 1 - im_cx.to_value(u.pix)
+    im_cx = (height - 1 - (row * scale + offset)) * u.pix
+    im_cy = (im_cy.to_value(u.pix) * scale + offset) * u.pix
+    return im_cx, im_cy, im_radius * scale
+
+
+def _decode_photo(filename, dtype=np.float64, weights='average',
+                  full_output=False):
+    """
+    Decode a photo to a grayscale image flipped like the data of a map.
+
+    If ``full_output`` is true the largest value of the type the photo was
+    stored with, 1 for floating point images, is also returned.
+    """
+    with _stage('decode'):
+        # flip the image as a view
+        im_rgb = np.flipud(matplotlib.image.imread(filename))
+    # remove the color information
+    with _stage('grayscale'):
+        im = rgb_to_gray(im_rgb, weights=weights, dtype=dtype)
+    if not full_output:
+        return im
+    if im_rgb.dtype.kind in 'ui':
+        return im, np.iinfo(im_rgb.dtype).max
+    return im, 1
+
+
+def _photo_meta(filename, im_cx, im_cy, im_radius, eclipse_grid=None):
+    """
+    Build the header of the map of a photo from the disk found in it and its
+    EXIF data.
+
+    If the EXIF data has no time or location they are taken from the eclipse
+    grid, see `eclipse.ephemeris.EclipseGrid.default_observer`, and flagged
+    with their errors in the header. A time read from a tag other than the
+    time the photo was taken is flagged with ``obs_src = 'exif_fallback'``,
+    and given the error of the grid if there is one.
+    """
+    with _stage('exif'):
+        tags = m.read_exif(filename)
+        time, time_tag = m.get_image_time(tags, with_tag=True)
+        exif_meta = m.get_meta_from_exif(tags)
+    # the time the photo was digitized or its file was written may be long
+    # after it was taken
+    exact_time = time_tag == 'EXIF DateTimeOriginal'
+
+    with _stage('meta'):
+        if time is None or 'LAT' not in exif_meta:
+            if eclipse_grid is None:
+                raise ValueError(
+                    f'{filename} has no time or GPS location in its EXIF '
+                    'data; give an eclipse grid to estimate them.')
+        elif not exact_time and eclipse_grid is None:
+            exif_meta['obs_src'] = 'exif_fallback'
+        if eclipse_grid is not None and (not exact_time or
+                                         'LAT' not in exif_meta):
+            from eclipse.ephemeris import _uncertainty_meta
+            estimate = _as_grid(eclipse_grid).default_observer()
+            source = 'default'
+            if exact_time:
+                estimate = estimate._replace(time=time, time_error=None)
+            elif time is not None:
+                # a rough time, which the Moon and the stars may refine
+                estimate = estimate._replace(time=time)
+                source = 'exif_fallback'
+            if 'LAT' in exif_meta:
+                estimate = estimate._replace(
+                    lat=exif_meta['LAT'], lon=exif_meta['LON'],
+                    lat_error=None, lon_error=None)
+            time = estimate.time
+            exif_meta.update({'LAT': estimate.lat, 'LON': estimate.lon,
+                              'DATEOBS': time.isoformat()})
+            exif_meta.update(_uncertainty_meta(estimate, source))
+
+        ###########################################################################
+        # With the time and the radius of the solar disk we can calculate the
+        # plate scale.
+        plate_scale = m.get_plate_scale(time, im_radius)
+
+        ###########################################################################
+        # We can now build a WCS object and a meta dictionary. We then append a
+        # few more meta tags to the meta dictionary.
+        wcs = m.build_wcs(im_cx, im_cy, plate_scale)
+        return m._build_meta(wcs, time, exif_meta)
+
+
+def _as_grid(eclipse_grid):
+    if isinstance(eclipse_grid, (str, os.PathLike)):
+        from eclipse.ephemeris import load_grid
+        return load_grid(os.fspath(eclipse_grid))
+    return eclipse_grid
+
+
+def _phase_meta(header, contact_grid):
+    """
+    The keys of the header which give the phase of the eclipse.
+    """
+    from eclipse.ephemeris import _phase_meta, load_contacts
+    if isinstance(contact_grid, (str, os.PathLike)):
+        contact_grid = load_contacts(os.fspath(contact_grid))
+    phase = contact_grid.phase(header['lat'], header['lon'],
+                               datetime.fromisoformat(header['date-obs']))
+    return _phase_meta(phase)[0]
+
+
+def _locate_observer(sunpymap, eclipse_grid):
+    """
+    Estimate the time and place of a photo whose header has the defaults of
+    `_photo_meta` from the Moon and the stars in it, keeping the defaults if
+    the stars are not found.
+    """
+    from eclipse.ephemeris import locate_observer
+    header = sunpymap.meta
+    known = {}
+    if 'timeerr' not in header:
+        known['time'] = datetime.fromisoformat(header['date-obs'])
+    if 'laterr' not in header:
+        known['lat'] = header['lat']
+        known['lon'] = header['lon']
+    with _stage('locate'):
+        try:
+            sunpymap, _ = locate_observer(sunpymap, _as_grid(eclipse_grid),
+                                          **known)
+        except ValueError:
+            pass
+    return sunpymap
+
+
+class LazyMap(GenericMap):
+    """
+    A map of a photo whose header is known but whose pixels are only decoded
+    when its data is first used.
+
+    The size of the photo is written to the header, so that the WCS,
+    coordinates and dimensions of the map can be used without decoding it,
+    for example to select photos from a large archive. A map which has not
+    been decoded yet is pickled without its pixels.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    header : `dict`
+        The header of the map.
+
+    shape : `tuple` of `int`
+        The number of rows and columns of the photo.
+
+    dtype : `numpy.dtype`, optional
+        The type of the data, see `rgb_to_gray`. Defaults to `numpy.float64`.
+
+    weights : `str` or sequence of `float`, optional
+        The weights of the color channels, see `rgb_to_gray`. Defaults to
+        ``'average'``.
+    """
+    def __init__(self, filename, header, shape, dtype=np.float64,
+                 weights='average', **kwargs):
+        self._loader = None
+        self._shape_only = False
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        header = dict(header)
+        header.setdefault('naxis1', self._shape[1])
+        header.setdefault('naxis2', self._shape[0])
+        super().__init__(self._placeholder(), header, **kwargs)
+        self.filename = filename
+        self._loader = functools.partial(_decode_photo, filename, dtype,
+                                         weights)
+
+    def _placeholder(self):
+        # an array of the right shape and type which takes no memory
+        return np.broadcast_to(np.zeros((), dtype=self._dtype), self._shape)
+
+    @property
+    def is_loaded(self):
+        """
+        Whether the pixels of the photo have been decoded.
+        """
+        return self._loader is None
+
+    @property
+    def data(self):
+        """
+        The data of the map, which is decoded from the photo the first time it
+        is used.
+        """
+        if self._loader is not None and not self._shape_only:
+            self._data = self._loader()
+            self._loader = None
+        return self._data
+
+    @property
+    def wcs(self):
+        # the WCS only needs the shape of the data
+        self._shape_only = True
+        try:
+            return super().wcs
+        finally:
+            self._shape_only = False
+
+    @property
+    def dimensions(self):
+        self._shape_only = True
+        try:
+            return super().dimensions
+        finally:
+            self._shape_only = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._loader is not None:
+            # the pixels are decoded where the map is unpickled instead
+            del state['_data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._loader is not None:
+            self._data = self._placeholder()
+
+
+def eclipse_image_to_map(filename, header=None, detection_scale=None,
+                         dtype=np.float64, weights='average', lazy=False,
+                         eclipse_grid=None, contact_grid=None, **kwargs):
     """
     Given the filename to a photo, convert it to a `sunpy.map.GenericMap` object.
 
@@ -73,31 +1178,151 @@ def eclipse_image_to_map(filename):
     filename : `str`
         The filename of the image.
 
+    header : `dict`, optional
+        The header of the map, for example from an earlier conversion of the
+        same photo. If given the Sun is not searched for and the EXIF data is
+        not read.
+
+    detection_scale : `int`, optional
+        If given, find the Sun in a version of the photo reduced by this
+        factor while decoding, see `find_sun_in_photo`, rather than in the
+        full resolution image.
+
+    dtype : `numpy.dtype`, optional
+        The type of the data of the map, see `rgb_to_gray`. Defaults to
+        `numpy.float64`. `numpy.float32` or `numpy.uint16` use much less
+        memory for large photos.
+
+    weights : `str` or sequence of `float`, optional
+        The weights of the color channels, see `rgb_to_gray`. Defaults to
+        ``'average'``.
+
+    lazy : `bool`, optional
+        If `True` return a `LazyMap`, whose header is built straight away but
+        whose pixels are only decoded when its data is used. The Sun is then
+        found in a reduced version of the photo, with ``detection_scale``
+        defaulting to 8. Defaults to `False`.
+
+    eclipse_grid : `eclipse.ephemeris.EclipseGrid` or `str`, optional
+        The grid of the eclipse, or the filename of a saved grid, used if the
+        EXIF data has no time or GPS location, or only a time other than when
+        the photo was taken, such as when its file was written. They are then
+        estimated from the Moon and the stars in the photo, see
+        `eclipse.ephemeris.locate_observer`, or if too few stars are found
+        taken from the middle of the eclipse in the grid, or for such a time
+        from the EXIF data, which is flagged with ``obs_src =
+        'exif_fallback'`` whether or not a grid is given. The estimated
+        values are flagged by the ``obs_src`` key of the header, and their
+        errors in seconds and degrees are in the ``timeerr``, ``laterr`` and
+        ``lonerr`` keys. Lazy maps only get the defaults.
+
+    contact_grid : `eclipse.ephemeris.ContactGrid` or `str`, optional
+        The contact times of the eclipse, or the filename of a saved grid. If
+        given the phase of the eclipse is written to the ``phase`` key of the
+        header, and the seconds from second and third contact, where the
+        eclipse is central, to the ``fromc2`` and ``fromc3`` keys.
+
+    kwargs
+        Passed to `find_sun_center_and_radius`, for example
+        ``pyramid_levels`` or ``max_accumulator_bytes``.
+
     Returns
     -------
     sunpymap : `sunpy.map.GenericMap`
         A SunPy map with valid metadata for the image.
 
+    Notes
+    -----
+    The time and peak memory of each stage, such as decoding, finding the Sun
+    and building the meta data, can be measured by calling this inside
+    `eclipse.profiling.profile`.
+
     """
-    # load the image data
-    im_rgb = np.flipud(matplotlib.image.imread(filename))
-    # remove the color information
-    im = np.average(im_rgb, axis=2)
+    if lazy and detection_scale is None:
+        detection_scale = 8
+    if header is None and detection_scale is not None:
+        # find the sun center and radius before decoding the full photo
+        with _stage('find_sun'):
+            im_cx, im_cy, im_radius = find_sun_in_photo(
+                filename, detection_scale, **kwargs)
+        if lazy:
+            header = _photo_meta(filename, im_cx, im_cy, im_radius,
+                                 eclipse_grid)
+            if contact_grid is not None:
+                header.update(_phase_meta(header, contact_grid))
+
+    if lazy:
+        with Image.open(filename) as image:
+            width, height = image.size
+        return LazyMap(filename, header, (height, width), dtype=dtype,
+                       weights=weights)
+
+    im = _decode_photo(filename, dtype=dtype, weights=weights)
 
-    # find the sun center and radius
-    im_cx, im_cy, im_radius = find_sun_center_and_radius(im)
+    if header is not None:
+        return GenericMap(data=im, header=header)
 
-    tags = exifread.process_file(open(filename, 'rb'))
-    time = m.get_image_time(tags)
+    if detection_scale is None:
+        # find the sun center and radius
+        with _stage('find_sun'):
+            im_cx, im_cy, im_radius = find_sun_center_and_radius(im, **kwargs)
 
-    ###############################################################################
-    # With the time and the radius of the solar disk we can calculate the plate
-    # scale.
-    plate_scale = m.get_plate_scale(time, im_radius)
+    sunpymap = GenericMap(data=im, header=_photo_meta(
+        filename, im_cx, im_cy, im_radius, eclipse_grid))
+    if (eclipse_grid is not None and
+            sunpymap.meta.get('obs_src') in ('default', 'exif_fallback')):
+        sunpymap = _locate_observer(sunpymap, eclipse_grid)
+    if contact_grid is not None:
+        sunpymap.meta.update(_phase_meta(sunpymap.meta, contact_grid))
+    return sunpymap
 
-    ###############################################################################
-    # We can now build a WCS object and a meta dictionary. We then append a few
-    # more meta tags to the meta dictionary.
-    wcs = m.build_wcs(im_cx, im_cy, plate_scale)
-    meta = m.build_meta(wcs, tags)
-    return GenericMap(data=im, header=meta)
+
+def eclipse_image_to_fits(filename, output, dtype=np.float32, overwrite=False,
+                          tile_rows=None, **kwargs):
+    """
+    Convert a photo to a map, write it to a FITS file and return a map of the
+    file which is mapped into memory rather than read.
+
+    Maps of floating point type are backed by a memory map of the file, so
+    that many of them can be kept or passed around cheaply. FITS stores
+    unsigned integers with an offset, so maps of `numpy.uint16` are read into
+    memory instead.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    output : `str`
+        The filename of the FITS file to write.
+
+    dtype : `numpy.dtype`, optional
+        The type of the data written. Defaults to `numpy.float32`.
+
+    overwrite : `bool`, optional
+        Whether to overwrite an existing FITS file. Defaults to `False`.
+
+    tile_rows : `int`, optional
+        If given the photo, which must be a TIFF file, is converted and
+        written this many rows at a time, see `eclipse.tiled.tiff_to_fits`,
+        so that mosaics of hundreds of megapixels can be converted in a
+        small amount of memory.
+
+    kwargs
+        Passed to `eclipse_image_to_map`, or to `eclipse.tiled.tiff_to_fits`
+        if ``tile_rows`` is given.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map of the FITS file.
+    """
+    if tile_rows is not None:
+        from eclipse.tiled import tiff_to_fits
+        return tiff_to_fits(filename, output, dtype=dtype, overwrite=overwrite,
+                            tile_rows=tile_rows, **kwargs)
+    sunpymap = eclipse_image_to_map(filename, dtype=dtype, **kwargs)
+    with _stage('save'):
+        sunpymap.save(output, overwrite=overwrite)
+    del sunpymap
+    return Map(output, memmap=np.dtype(dtype).kind == 'f')
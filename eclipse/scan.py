@@ -0,0 +1,98 @@
+"""Procedures to index the meta data of an archive of photographs."""
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+from eclipse.exif import get_meta_from_exif, read_exif
+
+__all__ = ['SCAN_FIELDS', 'scan_photo', 'scan_photos', 'write_index']
+
+#: The columns of the index written by `write_index`.
+SCAN_FIELDS = ('filename', 'time', 'lat', 'lon', 'exposure_time', 'camera',
+               'author', 'error')
+
+# the fields of the index given by each key of `get_meta_from_exif`
+_EXIF_FIELDS = {'DATEOBS': 'time', 'LAT': 'lat', 'LON': 'lon',
+                'EXPTIME': 'exposure_time', 'TELECOP': 'camera',
+                'AUTHOR': 'author'}
+
+
+def scan_photo(filename):
+    """
+    Read the time, location, exposure time, camera and author of a photo
+    from its EXIF data, without decoding the image.
+
+    Missing tags are left as `None`. If the file cannot be read at all the
+    reason is given in ``'error'``.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    Returns
+    -------
+    row : `dict`
+        The fields in `SCAN_FIELDS`.
+    """
+    row = dict.fromkeys(SCAN_FIELDS)
+    row['filename'] = filename
+    try:
+        tags = read_exif(filename)
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+        return row
+
+    for key, value in get_meta_from_exif(tags).items():
+        row[_EXIF_FIELDS[key]] = value
+    return row
+
+
+def scan_photos(filenames, max_workers=None):
+    """
+    Scan the EXIF data of many photos, see `scan_photo`.
+
+    Parameters
+    ----------
+    filenames : iterable of `str`
+        The filenames of the photos.
+
+    max_workers : `int`, optional
+        The number of processes. Defaults to `None`, which scans in this
+        process.
+
+    Yields
+    ------
+    row : `dict`
+        The fields of each photo, in the order of ``filenames``.
+    """
+    if max_workers is None or max_workers <= 1:
+        yield from map(scan_photo, filenames)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(scan_photo, filenames, chunksize=64)
+
+
+def write_index(rows, f):
+    """
+    Write the scanned fields of photos to a CSV file.
+
+    Parameters
+    ----------
+    rows : iterable of `dict`
+        The fields of each photo, as returned by `scan_photo`.
+
+    f : file-like
+        The text file to write to.
+
+    Returns
+    -------
+    n_rows : `int`
+        The number of photos written.
+    """
+    writer = csv.DictWriter(f, fieldnames=SCAN_FIELDS)
+    writer.writeheader()
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+    return n_rows
@@ -0,0 +1,222 @@
+"""Procedures to convert videos and bursts of photos to sequences of maps."""
+from collections import namedtuple
+from datetime import timedelta
+
+import astropy.units as u
+import matplotlib.image
+import numpy as np
+import scipy.ndimage as ndimage
+from sunpy.map import GenericMap
+
+import eclipse.meta as m
+from eclipse.process import (_refine_circle, _sobel_magnitude,
+                             find_sun_center_and_radius, rgb_to_gray)
+from eclipse.profiling import _record, _stage
+
+__all__ = ['TrackedFrame', 'iter_frames', 'track_sun', 'sequence_to_maps']
+
+TrackedFrame = namedtuple('TrackedFrame', ['index', 'im', 'im_cx', 'im_cy',
+                                           'im_radius', 'keyframe'])
+TrackedFrame.__doc__ = """
+A frame of a sequence with the disk found in it.
+
+``im`` is the grayscale frame, flipped like the data of a map, and ``im_cx``,
+``im_cy`` and ``im_radius`` are the centre and radius of the disk in pixels
+as returned by `eclipse.process.find_sun_center_and_radius`. ``keyframe`` is
+`True` if the disk was searched for in the whole frame and `False` if it was
+tracked from the frame before.
+"""
+
+
+def iter_frames(source):
+    """
+    Read the frames of a video or of a list of photos one at a time.
+
+    Parameters
+    ----------
+    source : `str` or iterable of `str`
+        The filename of a video, which is read with ``imageio`` and any of
+        its plugins, or the filenames of photos in order.
+
+    Yields
+    ------
+    im_rgb : `numpy.ndarray`
+        The color frame, in the orientation it is stored in the file.
+    """
+    if isinstance(source, str):
+        try:
+            import imageio.v3 as iio
+        except ImportError:
+            raise ImportError('Reading videos needs imageio, and a plugin '
+                              'such as imageio-ffmpeg for most formats.')
+        yield from iio.imiter(source)
+        return
+    for filename in source:
+        yield matplotlib.image.imread(filename)
+
+
+def _track_circle(im, cx, cy, radius, margin, blur_sigma):
+    """
+    Search for the circle within ``margin`` pixels of a predicted centre and
+    radius, blurring only the window around the prediction.
+
+    Returns the score, centre and radius of the circle.
+    """
+    pad = int(radius + margin + np.ceil(4 * blur_sigma)) + 2
+    row_start = max(int(cx) - pad, 0)
+    column_start = max(int(cy) - pad, 0)
+    window = im[row_start:int(cx) + pad + 1, column_start:int(cy) + pad + 1]
+    if window.dtype.kind != 'f':
+        window = window.astype(np.float32)
+    sob = _sobel_magnitude(ndimage.gaussian_filter(window, blur_sigma))
+    score, cx, cy, radius = _refine_circle(sob, cx - row_start,
+                                           cy - column_start, radius, margin)
+    return score, cx + row_start, cy + column_start, radius
+
+
+def track_sun(frames, keyframe_interval=30, search_margin=4,
+              min_score_ratio=0.5, dtype=np.float32, **kwargs):
+    """
+    Find the disk in every frame of a sequence, searching the whole frame
+    only on keyframes and tracking it in between.
+
+    On a keyframe the disk is found with
+    `eclipse.process.find_sun_center_and_radius`. In the frames after it the
+    disk is searched for only within ``search_margin`` pixels of its position
+    and radius predicted from the two frames before, in a window around the
+    disk, which is many times faster. The disk is searched for again in the
+    whole frame, and that frame becomes a keyframe, every
+    ``keyframe_interval`` frames, or sooner if the tracked disk drifts to the
+    edge of the search window or its edge becomes much weaker than on the
+    last keyframe, for example because of a cloud or a jump of the camera.
+
+    Parameters
+    ----------
+    frames : iterable of `numpy.ndarray`
+        The color or grayscale frames, as stored in the file, for example
+        from `iter_frames`.
+
+    keyframe_interval : `int`, optional
+        The largest number of frames between keyframes. Defaults to 30.
+
+    search_margin : `int`, optional
+        The largest change in pixels of the centre and the radius from the
+        prediction in tracked frames. Defaults to 4.
+
+    min_score_ratio : `float`, optional
+        The smallest mean gradient along the tracked limb, relative to that
+        on the last keyframe, before the disk is searched for again. Defaults
+        to 0.5.
+
+    dtype : `numpy.dtype`, optional
+        The type of the grayscale frames, see
+        `eclipse.process.rgb_to_gray`. Defaults to `numpy.float32`.
+
+    kwargs
+        Passed to `eclipse.process.find_sun_center_and_radius` on keyframes.
+
+    Yields
+    ------
+    frame : `TrackedFrame`
+        Each frame with the disk found in it.
+    """
+    blur_sigma = kwargs.get('blur_sigma', 8)
+    since_keyframe = keyframe_interval
+    history = []
+    for index, im_rgb in enumerate(frames):
+        im = rgb_to_gray(np.flipud(im_rgb), dtype=dtype)
+        keyframe = since_keyframe >= keyframe_interval
+        if not keyframe:
+            with _stage('track'):
+                # predict the disk from its motion over the last two frames
+                previous = history[-1]
+                before = history[-2] if len(history) > 1 else previous
+                prediction = [2 * p - b for p, b in zip(previous, before)]
+                score, cx, cy, radius = _track_circle(
+                    im, *prediction, search_margin, blur_sigma)
+            drift = np.abs(np.array([cx, cy, radius]) - np.rint(prediction))
+            keyframe = (score < min_score_ratio * reference_score or
+                        np.any(drift >= search_margin))
+
+        if keyframe:
+            with _stage('find_sun'):
+                im_cx, im_cy, im_radius = find_sun_center_and_radius(
+                    im, **kwargs)
+            cx, cy, radius = (value[0].to_value(u.pix)
+                              for value in (im_cx, im_cy, im_radius))
+            # the gradient along the limb that tracked frames are held to
+            reference_score = _track_circle(im, cx, cy, radius, 0,
+                                            blur_sigma)[0]
+            history, since_keyframe = [], 0
+        else:
+            im_cx, im_cy, im_radius = (np.array([value], dtype=float) * u.pix
+                                       for value in (cx, cy, radius))
+        history = history[-1:] + [(cx, cy, radius)]
+        since_keyframe += 1
+        _record(n_frames=index + 1)
+        yield TrackedFrame(index, im, im_cx, im_cy, im_radius, keyframe)
+
+
+def sequence_to_maps(source, start_time=None, frame_rate=None, lat=None,
+                     lon=None, exposure_time=None, camera=None, author=None,
+                     **kwargs):
+    """
+    Convert a video or a burst of photos to a sequence of maps, one frame at
+    a time.
+
+    The disk is found with `track_sun`, and the WCS and meta data of every
+    frame are built with `eclipse.meta`. The maps are made as they are
+    iterated over, so that long sequences do not need to fit in memory.
+
+    Parameters
+    ----------
+    source : `str` or sequence of `str`
+        The filename of a video or the filenames of photos in order, see
+        `iter_frames`.
+
+    start_time : `datetime.datetime`, optional
+        The time of the first frame of a video. Photos take their times from
+        their EXIF data.
+
+    frame_rate : `float`, optional
+        The number of frames per second of a video.
+
+    lat, lon : `float`, optional
+        The latitude and longitude of the camera of a video in degrees.
+
+    exposure_time, camera, author : optional
+        The exposure time in seconds, camera model and photographer of a
+        video, written to the header if given.
+
+    kwargs
+        Passed to `track_sun`.
+
+    Yields
+    ------
+    sunpymap : `sunpy.map.GenericMap`
+        The map of each frame.
+    """
+    is_video = isinstance(source, str)
+    if is_video:
+        if None in (start_time, frame_rate, lat, lon):
+            raise ValueError('The start time, frame rate and location of a '
+                             'video must be given.')
+    else:
+        source = list(source)
+
+    for frame in track_sun(iter_frames(source), **kwargs):
+        with _stage('meta'):
+            if is_video:
+                time = start_time + timedelta(seconds=frame.index / frame_rate)
+                plate_scale = m.get_plate_scale(time, frame.im_radius)
+                wcs = m.build_wcs(frame.im_cx, frame.im_cy, plate_scale)
+                meta = m.build_meta_from_values(
+                    wcs, time, lat, lon, exposure_time=exposure_time,
+                    camera=camera, author=author)
+            else:
+                tags = m.read_exif(source[frame.index])
+                time = m.get_image_time(tags)
+                plate_scale = m.get_plate_scale(time, frame.im_radius)
+                wcs = m.build_wcs(frame.im_cx, frame.im_cy, plate_scale)
+                meta = m.build_meta(wcs, tags)
+        yield GenericMap(data=frame.im, header=meta)
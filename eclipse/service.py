@@ -0,0 +1,233 @@
+"""A service which converts photos to maps as they arrive in a directory."""
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from eclipse.batch import (PHOTO_EXTENSIONS, BatchResult, _output_filename,
+                           _process_photo)
+from eclipse.cache import ResultCache, _normalize_params
+from eclipse.index import PhotoIndex
+
+__all__ = ['InboxService']
+
+
+def _list_photos(inbox):
+    """
+    The size and modification time of each photo in the inbox.
+    """
+    photos = {}
+    for entry in os.scandir(inbox):
+        if entry.name.lower().endswith(PHOTO_EXTENSIONS) and entry.is_file():
+            stat = entry.stat()
+            photos[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return photos
+
+
+class InboxService:
+    """
+    Convert photos to maps as they are uploaded to an inbox directory.
+
+    The inbox is polled for new photos, which are queued once their size
+    has stopped changing between two polls, so that photos still being
+    uploaded are not read. A fixed number of photos are converted at a time
+    by a pool of processes, each decoding its photo and writing its FITS
+    file, so that the event loop only waits on them. The queue is bounded:
+    when it is full the watcher stops queueing photos until there is room,
+    so a burst of uploads waits in the inbox rather than in memory.
+
+    Photos whose FITS file already exists are skipped unless ``overwrite``
+    is true, so the service can be restarted on the same inbox.
+
+    Parameters
+    ----------
+    inbox : `str`
+        The directory photos are uploaded to.
+
+    output_dir : `str`
+        The directory to write the FITS files to.
+
+    max_workers : `int`, optional
+        The number of processes. Defaults to the number of CPUs.
+
+    max_queue : `int`, optional
+        The largest number of photos waiting to be converted. Defaults to
+        twice the number of processes.
+
+    poll_interval : `float`, optional
+        The time in seconds between polls of the inbox. Defaults to 1.
+
+    overwrite : `bool`, optional
+        Whether to overwrite existing FITS files. Defaults to `False`.
+
+    cache : `eclipse.cache.ResultCache` or `str`, optional
+        A cache of the results, see `eclipse.batch.process_batch`.
+
+    index : `eclipse.index.PhotoIndex` or `str`, optional
+        An index to add each photo converted to, see
+        `eclipse.batch.process_batch`.
+
+    latency_window : `int`, optional
+        The number of most recent photos the latency percentiles are computed
+        over. Defaults to 1000.
+
+    kwargs
+        Passed to `eclipse.process.eclipse_image_to_map`.
+    """
+    def __init__(self, inbox, output_dir, max_workers=None, max_queue=None,
+                 poll_interval=1.0, overwrite=False, cache=None, index=None,
+                 latency_window=1000, **kwargs):
+        self.inbox = inbox
+        self.output_dir = output_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue or 2 * self.max_workers
+        self.poll_interval = poll_interval
+        self.overwrite = overwrite
+        self.cache = ResultCache(cache) if isinstance(cache, str) else cache
+        self.index = PhotoIndex(index) if isinstance(index, str) else index
+        self.kwargs = kwargs
+        if self.cache is not None:
+            _normalize_params(kwargs)
+        self.n_converted = 0
+        self.n_failed = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._queue = None
+        self._n_running = 0
+        self._stopping = None
+        self._executor = None
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({self.inbox!r}, '
+                f'{self.output_dir!r}, max_workers={self.max_workers})')
+
+    def stats(self):
+        """
+        The state of the service.
+
+        Returns
+        -------
+        stats : `dict`
+            The number of photos waiting in the queue (``'queued'``), being
+            converted (``'running'``), converted (``'converted'``) and failed
+            (``'failed'``), and the 50th, 90th and 99th percentiles in
+            seconds of the time from a photo being found in the inbox to its
+            FITS file being written (``'latency_p50'``, ``'latency_p90'``,
+            ``'latency_p99'``, `None` before any photo is done).
+        """
+        stats = {'queued': self._queue.qsize() if self._queue else 0,
+                 'running': self._n_running,
+                 'converted': self.n_converted,
+                 'failed': self.n_failed}
+        percentiles = [None] * 3
+        if self._latencies:
+            percentiles = np.percentile(self._latencies, [50, 90, 99])
+        for p, value in zip((50, 90, 99), percentiles):
+            stats[f'latency_p{p}'] = None if value is None else float(value)
+        return stats
+
+    def stop(self):
+        """
+        Stop watching the inbox. The photos already queued are finished.
+        """
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _watch(self):
+        """
+        Poll the inbox and queue the photos which have finished uploading.
+        """
+        loop = asyncio.get_running_loop()
+        seen = set()
+        last = {}
+        taken = {}
+        while not self._stopping.is_set():
+            # the file system is read in a thread so that it does not block
+            # the loop
+            photos = await loop.run_in_executor(None, _list_photos,
+                                                self.inbox)
+            for filename, state in photos.items():
+                if filename in seen or last.get(filename) != state:
+                    continue
+                seen.add(filename)
+                output = _output_filename(filename, self.output_dir, taken)
+                if not self.overwrite and await loop.run_in_executor(
+                        None, os.path.exists, output):
+                    continue
+                # waits here while the queue is full
+                await self._queue.put((filename, output, time.monotonic()))
+            last = photos
+            try:
+                await asyncio.wait_for(self._stopping.wait(),
+                                       self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _convert(self, on_result):
+        """
+        Convert the queued photos one at a time in the pool.
+
+        A photo which cannot be converted, even one whose process dies, is
+        counted as failed, and a broken pool is replaced, so that one bad
+        upload does not stop the service.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            filename, output, found = await self._queue.get()
+            if filename is None:
+                return
+            self._n_running += 1
+            executor = self._executor
+            try:
+                result = await loop.run_in_executor(
+                    executor, _process_photo, filename, output,
+                    self.overwrite, self.kwargs, self.cache)
+            except Exception as e:
+                result = BatchResult(filename, None,
+                                     f'{type(e).__name__}: {e}')
+                if (isinstance(e, BrokenProcessPool) and
+                        executor is self._executor):
+                    executor.shutdown(wait=False)
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers)
+            finally:
+                self._n_running -= 1
+            latency = time.monotonic() - found
+            if result.error is None:
+                self.n_converted += 1
+                self._latencies.append(latency)
+                if self.index is not None:
+                    self.index.add_header(result.filename, result.header,
+                                          result.output)
+            else:
+                self.n_failed += 1
+            if on_result is not None:
+                on_result(result, latency)
+
+    async def run(self, on_result=None):
+        """
+        Watch the inbox and convert the photos which arrive until `stop` is
+        called.
+
+        Parameters
+        ----------
+        on_result : callable, optional
+            Called with the `eclipse.batch.BatchResult` of each photo and the
+            time in seconds since it was found in the inbox.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = asyncio.Event()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        workers = [asyncio.create_task(self._convert(on_result))
+                   for _ in range(self.max_workers)]
+        try:
+            await self._watch()
+        finally:
+            for _ in workers:
+                await self._queue.put((None, None, None))
+            await asyncio.gather(*workers)
+            self._executor.shutdown()
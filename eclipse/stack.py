@@ -0,0 +1,162 @@
+"""Procedures to stack brackets of exposures into one map of the corona."""
+import astropy.units as u
+import numpy as np
+import scipy.ndimage as ndimage
+from sunpy.map import GenericMap
+
+import eclipse.meta as m
+from eclipse.process import _decode_photo, _photo_meta, find_sun_in_photo
+from eclipse.profiling import _stage
+
+__all__ = ['stack_bracket']
+
+
+def _exposure_weights(im, low, high):
+    """
+    The weight of each pixel in the merged image, a hat function which is
+    largest in the middle of the range of well exposed values and falls to
+    zero at the noise floor ``low`` and at saturation ``high``.
+    """
+    weights = np.minimum(im - low, high - im)
+    np.clip(weights, 0, None, out=weights)
+    # pixels outside of the frame after registration are NaN
+    weights[np.isnan(weights)] = 0
+    return weights
+
+
+def stack_bracket(filenames, reference=0, low=5, high=250, dtype=np.float32,
+                  detection_scale=8, block_rows=256, **kwargs):
+    """
+    Stack a bracket of exposures of an eclipse into one high dynamic range
+    map.
+
+    Each photo is registered to the reference photo by the centre of the
+    disk, found with `eclipse.process.find_sun_in_photo`, divided by its
+    exposure time from the EXIF data and added to running sums weighted by
+    how well exposed each pixel is. The photos are decoded one at a time and
+    the sums are updated a block of rows at a time, so the memory used is a
+    few arrays the size of one photo however many photos are stacked. Pixels
+    which are saturated or below the noise floor in every photo are taken
+    from the shortest exposure.
+
+    The photos are assumed to be taken from a fixed mount within a few
+    seconds, so only the shift of the disk between them is corrected, not a
+    rotation or change of scale.
+
+    Parameters
+    ----------
+    filenames : sequence of `str`
+        The filenames of the photos of the bracket.
+
+    reference : `int`, optional
+        The index of the photo whose disk position and meta data the map
+        takes. Defaults to 0.
+
+    low, high : `float`, optional
+        The noise floor and the saturation level of the grayscale photos, on
+        a scale of 0 to 255 which is stretched to the range of the type of
+        each photo, so that they hold for 8 bit, 16 bit and floating point
+        photos alike. Defaults to 5 and 250.
+
+    dtype : `numpy.dtype`, optional
+        The floating point type of the photos and of the sums. Defaults to
+        `numpy.float32`.
+
+    detection_scale : `int`, optional
+        The factor to reduce the photos by to find the disk, see
+        `eclipse.process.find_sun_in_photo`. Defaults to 8.
+
+    block_rows : `int`, optional
+        The number of rows merged at once. Defaults to 256.
+
+    kwargs
+        Passed to `eclipse.process.find_sun_center_and_radius`. The limb is
+        fit (``method='fit'``) unless another method is given.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map, in data numbers per second.
+
+    Raises
+    ------
+    ValueError
+        If ``dtype`` is not a floating point type, or a photo has no time or
+        exposure time in its EXIF data.
+    """
+    kwargs.setdefault('method', 'fit')
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError(f'The photos are stacked in a floating point type, '
+                         f'not {dtype}.')
+    filenames = list(filenames)
+    if not filenames:
+        raise ValueError('There are no photos to stack.')
+    exposure_times = []
+    times = []
+    for filename in filenames:
+        tags = m.read_exif(filename)
+        exposure_time = m.get_meta_from_exif(tags).get('EXPTIME')
+        if not exposure_time or exposure_time <= 0:
+            raise ValueError(f'{filename} has no exposure time in its EXIF '
+                             'data, which is needed to stack it.')
+        time = m.get_image_time(tags)
+        if time is None:
+            raise ValueError(f'{filename} has no time in its EXIF data, '
+                             'which is needed to stack it.')
+        exposure_times.append(exposure_time)
+        times.append(time)
+    exposure_times = np.array(exposure_times, dtype=float)
+    shortest = np.argmin(exposure_times)
+
+    disks = []
+    for filename in filenames:
+        with _stage('find_sun'):
+            disks.append(find_sun_in_photo(filename, detection_scale,
+                                           **kwargs))
+    ref_cx, ref_cy, ref_radius = disks[reference]
+
+    weighted_sum = weight_sum = registered = None
+    for i, (filename, exposure_time) in enumerate(zip(filenames,
+                                                      exposure_times)):
+        im, data_max = _decode_photo(filename, dtype=dtype, full_output=True)
+        if weighted_sum is None:
+            weighted_sum = np.zeros(im.shape, dtype=dtype)
+            weight_sum = np.zeros(im.shape, dtype=dtype)
+            registered = np.empty(im.shape, dtype=dtype)
+        with _stage('register'):
+            shift = [(ref_cx - disks[i][0])[0].to_value(u.pix),
+                     (ref_cy - disks[i][1])[0].to_value(u.pix)]
+            ndimage.shift(im, shift, output=registered, order=1,
+                          mode='constant', cval=np.nan)
+        del im
+
+        with _stage('merge'):
+            for start in range(0, registered.shape[0], block_rows):
+                rows = slice(start, start + block_rows)
+                block = registered[rows]
+                weights = _exposure_weights(block, low * data_max / 255,
+                                            high * data_max / 255)
+                if i == shortest:
+                    # a tiny weight so that pixels which are badly exposed in
+                    # every photo take the value of the shortest exposure
+                    weights += np.where(np.isnan(block), 0,
+                                        1e-6 * data_max / 255)
+                weighted_sum[rows] += (weights * np.nan_to_num(block) /
+                                       exposure_time)
+                weight_sum[rows] += weights
+
+    with _stage('merge'):
+        hdr = np.divide(weighted_sum, weight_sum, out=weighted_sum,
+                        where=weight_sum > 0)
+        hdr[weight_sum == 0] = np.nan
+
+    header = _photo_meta(filenames[reference], ref_cx, ref_cy, ref_radius)
+    header.update({'exptime': 1.0,
+                   'bunit': 'DN/s',
+                   'nframes': len(filenames),
+                   'exptmin': float(exposure_times.min()),
+                   'exptmax': float(exposure_times.max()),
+                   'date-beg': min(times).isoformat(),
+                   'date-end': max(times).isoformat()})
+    return GenericMap(data=hdr, header=header)
@@ -0,0 +1,267 @@
+"""Procedures to make synthetic photos of solar eclipses."""
+from datetime import datetime
+from fractions import Fraction
+
+import numpy as np
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+__all__ = ['make_eclipse_image', 'make_partial_eclipse_image',
+           'write_eclipse_photo']
+
+# The tags of the EXIF and GPS directories of a JPEG file
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_ARTIST = 0x013b
+_MODEL = 0x0110
+_DATE_TIME_ORIGINAL = 0x9003
+_EXPOSURE_TIME = 0x829a
+_GPS_LATITUDE_REF = 0x0001
+_GPS_LATITUDE = 0x0002
+_GPS_LONGITUDE_REF = 0x0003
+_GPS_LONGITUDE = 0x0004
+
+
+def make_eclipse_image(shape=(1824, 2736), center=None, radius=None,
+                       corona_index=3, corona_brightness=250, noise=3,
+                       n_prominences=3, seed=0, block_rows=256):
+    """
+    Make a color image of a total solar eclipse with a known position of the
+    Moon.
+
+    The dark disk of the Moon is surrounded by a corona whose brightness
+    falls off as a power of the distance from the centre, with a few red
+    prominences sticking out of the limb and Gaussian noise on top. The image
+    is made a block of rows at a time, so that frames of 50 megapixels or
+    more can be made without large floating point temporaries.
+
+    Parameters
+    ----------
+    shape : `tuple` of `int`, optional
+        The number of rows and columns of the image.
+
+    center : `tuple` of `float`, optional
+        The row and column of the centre of the disk, in the flipped
+        orientation that `eclipse.process` works in. Defaults to a point
+        close to the middle of the image.
+
+    radius : `float`, optional
+        The radius of the disk in pixels. Defaults to an eighth of the
+        smaller side of the image.
+
+    corona_index : `float`, optional
+        The power of the fall off of the corona. Defaults to 3.
+
+    corona_brightness : `float`, optional
+        The brightness of the corona at the limb. Defaults to 250.
+
+    noise : `float`, optional
+        The standard deviation of the noise. Defaults to 3.
+
+    n_prominences : `int`, optional
+        The number of prominences. Defaults to 3.
+
+    seed : `int`, optional
+        The seed of the random numbers. Defaults to 0.
+
+    block_rows : `int`, optional
+        The number of rows made at once. Defaults to 256.
+
+    Returns
+    -------
+    im_rgb : `numpy.ndarray`
+        The 8 bit color image, in the orientation it is stored in a file.
+
+    truth : `dict`
+        The row (``'im_cx'``) and column (``'im_cy'``) of the centre and the
+        radius (``'im_radius'``) of the disk in pixels.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    if radius is None:
+        radius = min(shape) / 8
+    if center is None:
+        center = (height / 2 + rng.uniform(-0.1, 0.1) * height,
+                  width / 2 + rng.uniform(-0.1, 0.1) * width)
+    cx, cy = center
+    angles = rng.uniform(0, 2 * np.pi, n_prominences)
+    prominences = [(cx + radius * np.cos(a), cy + radius * np.sin(a),
+                    rng.uniform(0.03, 0.08) * radius) for a in angles]
+    # the color of the corona and of the prominences
+    corona_color = np.array([1, 1, 0.95], dtype=np.float32)
+    prominence_color = np.array([1, 0.3, 0.4], dtype=np.float32)
+
+    im_rgb = np.empty((height, width, 3), dtype=np.uint8)
+    y = np.arange(width, dtype=np.float32)
+    for start in range(0, height, block_rows):
+        x = np.arange(start, min(start + block_rows, height),
+                      dtype=np.float32)[:, np.newaxis]
+        r = np.hypot(x - cx, y - cy) / radius
+        corona = np.where(r > 1, corona_brightness *
+                          np.maximum(r, 1) ** -corona_index, 0)
+        block = corona[..., np.newaxis] * corona_color
+        for px, py, size in prominences:
+            # only the pixels within a few sizes of a prominence are changed
+            rows = np.abs(x[:, 0] - px) < 5 * size
+            columns = slice(max(int(py - 5 * size), 0),
+                            max(int(py + 5 * size) + 1, 0))
+            if not rows.any():
+                continue
+            blob = corona_brightness * np.exp(
+                -((x[rows] - px) ** 2 + (y[columns] - py) ** 2) /
+                (2 * size ** 2))
+            blob[r[rows, columns] <= 1] = 0
+            window = block[rows, columns]
+            block[rows, columns] = np.maximum(
+                window, blob[..., np.newaxis] * prominence_color)
+        block += noise * rng.standard_normal(block.shape, dtype=np.float32)
+        # the image is stored upside down compared to eclipse.process
+        rows = slice(height - start - len(x), height - start)
+        im_rgb[rows] = np.clip(np.rint(block[::-1]), 0, 255)
+    return im_rgb, {'im_cx': cx, 'im_cy': cy, 'im_radius': radius}
+
+
+def make_partial_eclipse_image(shape=(600, 800), sun_center=None,
+                               sun_radius=None, moon_offset=(0.4, 0.6),
+                               moon_radius=None, brightness=220,
+                               limb_darkening=0.6, noise=3, seed=0):
+    """
+    Make a color image of a partial solar eclipse, taken through a solar
+    filter, with known positions of the Sun and the Moon.
+
+    The disk of the Sun is darkened towards its limb and the disk of the
+    Moon, which is black, cuts into it, with Gaussian noise on top.
+
+    Parameters
+    ----------
+    shape : `tuple` of `int`, optional
+        The number of rows and columns of the image.
+
+    sun_center : `tuple` of `float`, optional
+        The row and column of the centre of the Sun, in the flipped
+        orientation that `eclipse.process` works in. Defaults to a point
+        close to the middle of the image.
+
+    sun_radius : `float`, optional
+        The radius of the Sun in pixels. Defaults to a quarter of the smaller
+        side of the image.
+
+    moon_offset : `tuple` of `float`, optional
+        The row and column of the centre of the Moon relative to the centre
+        of the Sun, in radii of the Sun. Defaults to ``(0.4, 0.6)``.
+
+    moon_radius : `float`, optional
+        The radius of the Moon in pixels. Defaults to 1.03 radii of the Sun.
+
+    brightness : `float`, optional
+        The brightness of the centre of the Sun. Defaults to 220.
+
+    limb_darkening : `float`, optional
+        The linear limb darkening coefficient. Defaults to 0.6.
+
+    noise : `float`, optional
+        The standard deviation of the noise. Defaults to 3.
+
+    seed : `int`, optional
+        The seed of the random numbers. Defaults to 0.
+
+    Returns
+    -------
+    im_rgb : `numpy.ndarray`
+        The 8 bit color image, in the orientation it is stored in a file.
+
+    truth : `dict`
+        The row (``'sun_cx'``, ``'moon_cx'``) and column (``'sun_cy'``,
+        ``'moon_cy'``) of the centres and the radii (``'sun_radius'``,
+        ``'moon_radius'``) of the disks in pixels.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    if sun_radius is None:
+        sun_radius = min(shape) / 4
+    if moon_radius is None:
+        moon_radius = 1.03 * sun_radius
+    if sun_center is None:
+        sun_center = (height / 2 + rng.uniform(-0.05, 0.05) * height,
+                      width / 2 + rng.uniform(-0.05, 0.05) * width)
+    sun_cx, sun_cy = sun_center
+    moon_cx = sun_cx + moon_offset[0] * sun_radius
+    moon_cy = sun_cy + moon_offset[1] * sun_radius
+
+    x, y = np.ogrid[:height, :width]
+    r = np.hypot(x - sun_cx, y - sun_cy) / sun_radius
+    mu = np.sqrt(np.clip(1 - r ** 2, 0, 1))
+    im = np.where(r <= 1, brightness * (1 - limb_darkening * (1 - mu)), 0)
+    im[np.hypot(x - moon_cx, y - moon_cy) <= moon_radius] = 0
+    # the filter passes a yellow white
+    im = im[..., np.newaxis] * np.array([1, 0.9, 0.7], dtype=np.float32)
+    im += noise * rng.standard_normal(im.shape, dtype=np.float32)
+    im_rgb = np.clip(np.rint(im[::-1]), 0, 255).astype(np.uint8)
+    return im_rgb, {'sun_cx': sun_cx, 'sun_cy': sun_cy,
+                    'sun_radius': sun_radius, 'moon_cx': moon_cx,
+                    'moon_cy': moon_cy, 'moon_radius': moon_radius}
+
+
+def _rational(value, max_denominator=10000):
+    fraction = Fraction(value).limit_denominator(max_denominator)
+    return IFDRational(fraction.numerator, fraction.denominator)
+
+
+def _dms(degrees):
+    degrees = abs(degrees)
+    minutes = (degrees % 1) * 60
+    seconds = (minutes % 1) * 60
+    return (IFDRational(int(degrees), 1), IFDRational(int(minutes), 1),
+            _rational(seconds, 1000))
+
+
+def write_eclipse_photo(filename, im_rgb, time=datetime(2017, 8, 21, 17, 46),
+                        lat=44.37, lon=-119.4, exposure_time=1 / 500,
+                        camera='Synthetic', author='eclipse', quality=95):
+    """
+    Write an image to a JPEG file with the EXIF data that
+    `eclipse.process.eclipse_image_to_map` needs.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the photo.
+
+    im_rgb : `numpy.ndarray`
+        The 8 bit color image, as returned by `make_eclipse_image`.
+
+    time : `datetime.datetime`, optional
+        The time the photo was taken. Defaults to totality of the 2017
+        eclipse in Oregon.
+
+    lat, lon : `float`, optional
+        The latitude and longitude of the camera in degrees. ``None`` leaves
+        out the location.
+
+    exposure_time : `float`, optional
+        The exposure time in seconds. ``None`` leaves it out.
+
+    camera : `str`, optional
+        The model of the camera.
+
+    author : `str`, optional
+        The name of the photographer.
+
+    quality : `int`, optional
+        The JPEG quality. Defaults to 95.
+    """
+    exif = Image.Exif()
+    exif[_ARTIST] = author
+    exif[_MODEL] = camera
+    exif_ifd = exif.get_ifd(_EXIF_IFD)
+    if time is not None:
+        exif_ifd[_DATE_TIME_ORIGINAL] = time.strftime('%Y:%m:%d %H:%M:%S')
+    if exposure_time is not None:
+        exif_ifd[_EXPOSURE_TIME] = _rational(exposure_time)
+    if lat is not None and lon is not None:
+        gps_ifd = exif.get_ifd(_GPS_IFD)
+        gps_ifd[_GPS_LATITUDE_REF] = 'N' if lat >= 0 else 'S'
+        gps_ifd[_GPS_LATITUDE] = _dms(lat)
+        gps_ifd[_GPS_LONGITUDE_REF] = 'E' if lon >= 0 else 'W'
+        gps_ifd[_GPS_LONGITUDE] = _dms(lon)
+    Image.fromarray(im_rgb).save(filename, quality=quality, exif=exif)
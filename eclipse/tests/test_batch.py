@@ -0,0 +1,121 @@
+import os
+import shutil
+
+import astropy.units as u
+
+from eclipse import SAMPLE_PHOTO, process
+from eclipse.batch import (_output_filename, _process_photo, find_photos,
+                           process_batch)
+from eclipse.cache import ResultCache
+from eclipse.index import PhotoIndex
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+
+class _KillingFilename(str):
+    """
+    A filename which kills the process it is sent to.
+    """
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def test_process_batch(tmp_path):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    shutil.copy(SAMPLE_PHOTO, photos / 'first.jpg')
+    shutil.copy(SAMPLE_PHOTO, photos / 'second.JPG')
+    (photos / 'broken.jpg').write_bytes(b'not a photo')
+    (photos / 'notes.txt').write_text('not a photo either')
+
+    filenames = find_photos(str(photos))
+    assert [os.path.basename(f) for f in filenames] == ['broken.jpg',
+                                                        'first.jpg',
+                                                        'second.JPG']
+
+    results = list(process_batch(filenames, str(tmp_path / 'maps'),
+                                 max_workers=2, profile=True,
+                                 index=str(tmp_path / 'index.sqlite'),
+                                 pyramid_levels=2))
+    assert sorted(r.filename for r in results) == filenames
+    errors = {os.path.basename(r.filename): r.error for r in results}
+    assert errors['broken.jpg'] is not None
+    assert errors['first.jpg'] is None and errors['second.JPG'] is None
+    assert sorted(os.listdir(tmp_path / 'maps')) == ['first.fits', 'second.fits']
+    profile = next(r.profile for r in results if r.error is None)
+    assert {'total', 'decode', 'find_sun', 'meta', 'save'} <= set(profile['stages'])
+    index = PhotoIndex(str(tmp_path / 'index.sqlite'))
+    rows = index.query(min_radius=200)
+    assert sorted(row['filename'] for row in rows) == filenames[1:]
+    assert rows[0]['output'].endswith('.fits')
+    # the time, location and camera come from the meta data of the maps
+    rows = index.query(near=(44.3, -116.1), within=10 * u.km,
+                       start='2017-08-21T11:00:00', camera='Canon EOS 70D')
+    assert sorted(row['filename'] for row in rows) == filenames[1:]
+    assert rows[0]['exposure_time'] > 0
+
+
+def test_output_filename_collisions(tmp_path):
+    taken = {}
+    first = _output_filename('day1/photo.jpg', 'maps', taken)
+    assert first == os.path.join('maps', 'photo.fits')
+    second = _output_filename('day2/photo.JPG', 'maps', taken)
+    assert second != first and second.startswith(os.path.join('maps',
+                                                              'photo-'))
+    # the same photo keeps its name
+    assert _output_filename('day1/photo.jpg', 'maps', taken) == first
+    assert _output_filename('day2/photo.JPG', 'maps', {}) == first
+
+    photos = [tmp_path / 'day1' / 'photo.jpg', tmp_path / 'day2' / 'photo.jpg']
+    for photo in photos:
+        photo.parent.mkdir()
+        shutil.copy(SAMPLE_PHOTO, photo)
+    results = list(process_batch([str(p) for p in photos],
+                                 str(tmp_path / 'maps'), max_workers=2,
+                                 pyramid_levels=2))
+    assert all(r.error is None for r in results)
+    assert len(set(r.output for r in results)) == 2
+    assert len(os.listdir(tmp_path / 'maps')) == 2
+
+
+def test_process_batch_survives_dead_process(tmp_path):
+    im_rgb, _ = make_eclipse_image((300, 400), radius=60)
+    photos = [str(tmp_path / f'{name}.jpg') for name in 'abc']
+    for photo in photos:
+        write_eclipse_photo(photo, im_rgb)
+    killer = _KillingFilename(str(tmp_path / 'killer.jpg'))
+
+    # the killer and the photo queued with it are lost with the process,
+    # and the photos after them are converted by a new one
+    results = {r.filename: r for r in process_batch(
+        [killer] + photos, str(tmp_path / 'maps'), max_workers=1)}
+    assert sorted(results) == sorted([killer] + photos)
+    assert 'BrokenProcessPool' in results[killer].error
+    assert results[photos[1]].error is None
+    assert results[photos[2]].error is None
+    assert os.path.exists(results[photos[2]].output)
+
+
+def test_process_batch_resume(tmp_path, monkeypatch):
+    shutil.copy(SAMPLE_PHOTO, tmp_path / 'photo.jpg')
+    filenames = [str(tmp_path / 'photo.jpg')]
+    output_dir = str(tmp_path / 'maps')
+    cache = ResultCache(str(tmp_path / 'cache'))
+
+    result, = process_batch(filenames, output_dir, max_workers=1,
+                            cache=cache, pyramid_levels=2)
+    assert result.error is None
+    assert len(cache) == 1
+    cached = cache.get(cache.key(filenames[0], {'pyramid_levels': 2}))
+    assert 200 < cached['im_radius'] < 240
+
+    # a finished photo is skipped, and one whose output has gone is redone
+    # without searching for the Sun
+    def fail(*args, **kwargs):
+        raise AssertionError('the Sun should not be searched for')
+    monkeypatch.setattr(process, 'find_sun_center_and_radius', fail)
+    assert _process_photo(filenames[0], result.output, False,
+                          {'pyramid_levels': 2}, cache).error is None
+    os.remove(result.output)
+    assert _process_photo(filenames[0], result.output, False,
+                          {'pyramid_levels': 2}, cache).error is None
+    assert os.path.exists(result.output)
@@ -0,0 +1,59 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from eclipse import SAMPLE_PHOTO
+from eclipse.cache import ResultCache
+
+
+def test_key_depends_on_params():
+    assert ResultCache.key(SAMPLE_PHOTO) == ResultCache.key(SAMPLE_PHOTO, {})
+    assert (ResultCache.key(SAMPLE_PHOTO, {'pyramid_levels': 2}) !=
+            ResultCache.key(SAMPLE_PHOTO, {'pyramid_levels': 3}))
+
+    # types given as numpy types or as strings make the same key
+    assert (ResultCache.key(SAMPLE_PHOTO, {'dtype': np.float32}) ==
+            ResultCache.key(SAMPLE_PHOTO, {'dtype': np.dtype('float32')}))
+    assert (ResultCache.key(SAMPLE_PHOTO, {'weights': (0.3, 0.6, 0.1)}) ==
+            ResultCache.key(SAMPLE_PHOTO, {'weights': [0.3, 0.6, 0.1]}))
+    with pytest.raises(TypeError, match='eclipse_grid'):
+        ResultCache.key(SAMPLE_PHOTO, {'eclipse_grid': object()})
+
+
+def test_put_get_invalidate(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get('a') is None
+    cache.put('a', {'im_radius': 219.0})
+    cache.put('b', {'im_radius': 220.0})
+    assert cache.get('a') == {'im_radius': 219.0}
+    assert len(cache) == 2
+
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+    # a result which cannot be written leaves no temporary file behind
+    with pytest.raises(TypeError):
+        cache.put('c', {'value': object()})
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for i, key in enumerate('abc'):
+        cache.put(key, {'value': 'x' * 100})
+        path = os.path.join(str(tmp_path), key + '.json')
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    # reading a result makes it the most recently used
+    cache.get('a')
+
+    cache.max_bytes = cache.size * 2 // 3
+    cache.put('d', {'value': 'x' * 100})
+    assert cache.size <= cache.max_bytes
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('d') is not None
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import astropy.units as u
+import numpy as np
+import scipy.ndimage as ndimage
+from astropy.coordinates import SkyCoord
+from sunpy.map import GenericMap
+
+import eclipse.meta as m
+from eclipse.coalign import build_target_wcs, coalign_maps, pixel_mapping
+from eclipse.synthetic import make_eclipse_image
+
+
+def _site_map(shape, center, radius, lat, lon, seed):
+    im_rgb, truth = make_eclipse_image(shape, center=center, radius=radius,
+                                       seed=seed)
+    im = np.flipud(im_rgb).mean(axis=2)
+    im_cx, im_cy, im_radius = (np.array([truth[key]]) * u.pix
+                               for key in ('im_cx', 'im_cy', 'im_radius'))
+    time = datetime(2017, 8, 21, 17, 46)
+    plate_scale = m.get_plate_scale(time, im_radius)
+    wcs = m.build_wcs(im_cx, im_cy, plate_scale)
+    meta = m.build_meta_from_values(wcs, time, lat, lon)
+    return GenericMap(data=im, header=meta)
+
+
+def test_coalign_maps():
+    # two sites with different cameras, so the maps differ in plate scale,
+    # position of the disk and rotation
+    maps = [_site_map((300, 400), (140, 210), 60, 44.37, -119.4, 0),
+            _site_map((400, 500), (210, 240), 90, 36.97, -86.5, 1)]
+    assert maps[0].meta['crota2'] != maps[1].meta['crota2']
+
+    target_wcs = build_target_wcs([sunpymap.meta for sunpymap in maps],
+                                  extent=1.5)
+    aligned = list(coalign_maps(maps, target_wcs, max_workers=1))
+    assert len(aligned) == 2
+
+    for original, sunpymap in zip(maps, aligned):
+        assert sunpymap.data.shape == target_wcs.array_shape
+        assert sunpymap.meta['crota2'] == 0
+        assert sunpymap.meta['lon'] == original.meta['lon']
+        # the disk is where the grid puts the centre of the disk of the
+        # original map, with the same radius in both maps
+        world = original.wcs.wcs_pix2world(
+            [[original.meta['crpix1'], original.meta['crpix2']]], 0)
+        center = target_wcs.wcs_world2pix(world, 0)[0, ::-1]
+        disk = sunpymap.data < 20
+        labels, _ = ndimage.label(disk)
+        disk = labels == labels[tuple(np.rint(center).astype(int))]
+        assert np.allclose(ndimage.center_of_mass(disk), center, atol=0.5)
+        assert np.isclose(np.sqrt(disk.sum() / np.pi),
+                          original.meta['rsun_obs'] / sunpymap.meta['cdelt1'],
+                          rtol=0.02)
+
+        # the pixels match those of the original map at the same
+        # coordinates, found by sunpy
+        rows, columns = np.mgrid[10:target_wcs.array_shape[0]:37,
+                                 10:target_wcs.array_shape[1]:41]
+        tx, ty = target_wcs.wcs_pix2world(columns.ravel(), rows.ravel(), 0)
+        coords = SkyCoord(tx * u.deg, ty * u.deg,
+                          frame=original.coordinate_frame)
+        x, y = original.world_to_pixel(coords)
+        expected = ndimage.map_coordinates(
+            original.data, [y.value, x.value], order=1, mode='constant',
+            cval=np.nan)
+        assert np.allclose(sunpymap.data[rows, columns].ravel(), expected,
+                           equal_nan=True, atol=1e-3)
+
+
+def test_pixel_mapping_affine():
+    sunpymap = _site_map((300, 400), (140, 210), 60, 44.37, -119.4, 0)
+    target_wcs = build_target_wcs([sunpymap.meta])
+    matrix, offset = pixel_mapping(dict(sunpymap.meta), target_wcs)
+    assert matrix.shape == (2, 2)
+    # the centre of the grid is the reference pixel of the map, which is
+    # counted from one
+    center = (np.array(target_wcs.array_shape) - 1) / 2
+    assert np.allclose(matrix @ center + offset,
+                       [sunpymap.meta['crpix2'] - 1,
+                        sunpymap.meta['crpix1'] - 1], atol=1e-6)
+
+
+def test_coalign_maps_streamed():
+    maps = [_site_map((300, 400), (140, 210), 60, 44.37, -119.4, seed)
+            for seed in range(5)]
+    target_wcs = build_target_wcs([sunpymap.meta for sunpymap in maps],
+                                  extent=1.5)
+    aligned = coalign_maps(iter(maps), target_wcs, max_workers=2,
+                           chunksize=2)
+    for original, sunpymap in zip(maps, aligned):
+        expected, = coalign_maps([original], target_wcs, max_workers=1)
+        np.testing.assert_allclose(sunpymap.data, expected.data, atol=1e-5)
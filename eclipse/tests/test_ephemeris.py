@@ -0,0 +1,205 @@
+from datetime import datetime
+
+import astropy.units as u
+import numpy as np
+import pytest
+from astropy.coordinates import EarthLocation, SkyCoord, get_body
+from astropy.time import Time
+from PIL import Image
+from sunpy.coordinates import Helioprojective
+from sunpy.map import GenericMap
+
+import eclipse.meta as m
+from eclipse.ephemeris import ContactGrid, EclipseGrid, locate_observer
+from eclipse.exif import get_image_time, read_exif
+from eclipse.platesolve import predict_sources
+from eclipse.process import eclipse_image_to_map
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+
+@pytest.fixture(scope='module')
+def grid():
+    # totality of the 2017 eclipse in Oregon
+    return EclipseGrid.compute(datetime(2017, 8, 21, 17, 14),
+                               datetime(2017, 8, 21, 17, 26), (43, 46),
+                               (-121, -117))
+
+
+def _meta(cx, cy, radius, time, lat, lon, plate_scale=None):
+    if plate_scale is None:
+        plate_scale = m.get_plate_scale(time, np.array([radius]) * u.pix)
+    wcs = m.build_wcs(np.array([cx]) * u.pix, np.array([cy]) * u.pix,
+                      plate_scale)
+    return m.build_meta_from_values(wcs, time, lat, lon)
+
+
+def test_grid_matches_sunpy(grid, tmp_path):
+    assert grid.shape == (13, 7, 9)
+    i, j, k = 7, 3, 3
+    time = Time(grid.times[i], format='unix')
+    location = EarthLocation(lat=grid.lats[j] * u.deg,
+                             lon=grid.lons[k] * u.deg)
+    moon = get_body('moon', time, location=location).transform_to(
+        Helioprojective(observer=location.get_itrs(time), obstime=time))
+    assert abs(grid.moon_x[i, j, k] - moon.Tx.to_value(u.arcsec)) < 2
+    assert abs(grid.moon_y[i, j, k] - moon.Ty.to_value(u.arcsec)) < 2
+
+    grid.save(tmp_path / 'grid.npz')
+    loaded = EclipseGrid.load(tmp_path / 'grid.npz')
+    assert np.array_equal(loaded.moon_x, grid.moon_x)
+    assert np.array_equal(loaded.times, grid.times)
+
+
+def test_infer(grid):
+    i, j, k = 7, 3, 3
+    estimate = grid.infer(grid.moon_x[i, j, k] * u.arcsec,
+                          grid.moon_y[i, j, k] * u.arcsec,
+                          grid.moon_radius[i, j, k] * u.arcsec)
+    assert estimate.time == datetime(2017, 8, 21, 17, 21)
+    assert abs(estimate.lat - 44.5) <= estimate.lat_error
+    assert abs(estimate.lon + 119.5) <= estimate.lon_error
+    assert estimate.time_error >= 30
+
+    # the Moon only moves along the path of the eclipse with time, so knowing
+    # the time and the latitude pins down the longitude
+    estimate = grid.infer(grid.moon_x[i, j, k] * u.arcsec,
+                          grid.moon_y[i, j, k] * u.arcsec,
+                          grid.moon_radius[i, j, k] * u.arcsec,
+                          time=datetime(2017, 8, 21, 17, 21), lat=44.5)
+    assert estimate.lon == -119.5
+    assert estimate.time_error is None and estimate.lat_error is None
+
+
+def test_locate_observer(grid):
+    i, j, k = 7, 3, 3
+    time = datetime(2017, 8, 21, 17, 21)
+    moon_x, moon_y, moon_radius = (grid.moon_x[i, j, k], grid.moon_y[i, j, k],
+                                   grid.moon_radius[i, j, k])
+
+    # a photo of the Moon where it is seen from 44.5N 119.5W, among the stars
+    im_rgb, truth = make_eclipse_image((1200, 1600), radius=40,
+                                       n_prominences=0)
+    im = np.flipud(im_rgb).mean(axis=2).astype(np.float32)
+    meta = _meta(truth['im_cx'], truth['im_cy'], truth['im_radius'], time,
+                 44.5, -119.5, moon_radius / truth['im_radius'] *
+                 u.arcsec / u.pix)
+    moon = GenericMap(im, meta).world_to_pixel(SkyCoord(
+        moon_x * u.arcsec, moon_y * u.arcsec,
+        frame=GenericMap(im, meta).coordinate_frame))
+    meta['crpix1'] += truth['im_cy'] - moon.x.value
+    meta['crpix2'] += truth['im_cx'] - moon.y.value
+    names, x, y = predict_sources(GenericMap(im, meta))
+    rows, columns = np.mgrid[:im.shape[0], :im.shape[1]]
+    for source_x, source_y in zip(x, y):
+        im += 200 * np.exp(-((columns - source_x) ** 2 +
+                             (rows - source_y) ** 2) / (2 * 1.5 ** 2))
+
+    # the map built without a time or location
+    default = grid.default_observer()
+    guess = GenericMap(im, _meta(truth['im_cx'], truth['im_cy'],
+                                 truth['im_radius'], default.time,
+                                 default.lat, default.lon))
+    located, estimate = locate_observer(guess, grid)
+    assert estimate.time == time
+    assert abs(estimate.lat - 44.5) <= estimate.lat_error
+    assert abs(estimate.lon + 119.5) <= estimate.lon_error
+    assert estimate.residual < 1
+    assert located.meta['obs_src'] == 'ephemeris'
+    assert located.meta['timeerr'] == estimate.time_error
+    assert located.date.isot.startswith('2017-08-21T17:21')
+    assert abs(located.meta['crpix1'] - meta['crpix1']) < 0.05
+    assert abs(located.meta['crota2'] - meta['crota2']) < 0.01
+
+
+def test_photo_without_exif_time_or_location(grid, tmp_path):
+    im_rgb, truth = make_eclipse_image((300, 400), radius=60)
+    filename = str(tmp_path / 'photo.jpg')
+    write_eclipse_photo(filename, im_rgb, time=None, lat=None, lon=None)
+    with pytest.raises(ValueError, match='eclipse grid'):
+        eclipse_image_to_map(filename)
+
+    # there are no stars, so the defaults of the grid are kept and flagged
+    sunpymap = eclipse_image_to_map(filename, eclipse_grid=grid)
+    default = grid.default_observer()
+    assert sunpymap.meta['obs_src'] == 'default'
+    assert sunpymap.meta['timeerr'] == default.time_error
+    assert sunpymap.meta['lat'] == default.lat
+    assert sunpymap.date.datetime == default.time
+
+    # only the location is estimated if the time is known
+    filename = str(tmp_path / 'timed.jpg')
+    write_eclipse_photo(filename, im_rgb, lat=None, lon=None)
+    sunpymap = eclipse_image_to_map(filename, eclipse_grid=grid)
+    assert 'timeerr' not in sunpymap.meta
+    assert sunpymap.meta['lonerr'] == default.lon_error
+    assert sunpymap.date.datetime == datetime(2017, 8, 21, 17, 46)
+
+
+def test_photo_with_only_file_time(grid, tmp_path):
+    im_rgb, truth = make_eclipse_image((300, 400), radius=60)
+    filename = str(tmp_path / 'photo.jpg')
+    write_eclipse_photo(filename, im_rgb, time=None)
+    # the time the file was written, as an editor leaves it
+    with Image.open(filename) as image:
+        exif = image.getexif()
+        exif[0x0132] = '2017:08:21 17:46:00'
+        image.save(filename, exif=exif, quality=95)
+    assert get_image_time(read_exif(filename), with_tag=True) == (
+        datetime(2017, 8, 21, 17, 46), 'Image DateTime')
+
+    # the time is used but flagged
+    sunpymap = eclipse_image_to_map(filename)
+    assert sunpymap.meta['obs_src'] == 'exif_fallback'
+    assert 'timeerr' not in sunpymap.meta
+    assert sunpymap.date.datetime == datetime(2017, 8, 21, 17, 46)
+
+    # and given the error of the grid, which could refine it from the stars
+    sunpymap = eclipse_image_to_map(filename, eclipse_grid=grid)
+    assert sunpymap.meta['obs_src'] == 'exif_fallback'
+    assert sunpymap.meta['timeerr'] == grid.default_observer().time_error
+    assert 'laterr' not in sunpymap.meta
+    assert sunpymap.date.datetime == datetime(2017, 8, 21, 17, 46)
+
+
+@pytest.fixture(scope='module')
+def contacts():
+    return ContactGrid.compute(datetime(2017, 8, 21, 15, 50),
+                               datetime(2017, 8, 21, 18, 50), (44, 45),
+                               (-120, -119), location_step=0.5 * u.deg)
+
+
+def test_contact_grid(contacts, tmp_path):
+    first, second, third, fourth = Time(
+        contacts.contact_times(44.37, -119.4), format='unix').datetime
+    assert datetime(2017, 8, 21, 16, 7) < first < datetime(2017, 8, 21, 16, 9)
+    assert datetime(2017, 8, 21, 17, 21) < second < third
+    assert 100 < (third - second).total_seconds() < 140
+    assert (datetime(2017, 8, 21, 18, 43) < fourth <
+            datetime(2017, 8, 21, 18, 45))
+
+    times = [datetime(2017, 8, 21, 16), datetime(2017, 8, 21, 17),
+             second + (third - second) / 2, datetime(2017, 8, 21, 18, 50)]
+    phase = contacts.phase([44.37] * 4, [-119.4] * 4, times)
+    assert list(phase.phase) == ['none', 'partial', 'total', 'none']
+    assert np.allclose(phase.from_second_contact[2],
+                       -phase.from_third_contact[2])
+    assert contacts.phase(40, -119.4, times[1]).phase == 'none'
+
+    contacts.save(tmp_path / 'contacts.npz')
+    loaded = ContactGrid.load(tmp_path / 'contacts.npz')
+    assert np.array_equal(loaded.contacts, contacts.contacts, equal_nan=True)
+    assert not loaded.annular
+
+
+def test_photo_phase(contacts, tmp_path):
+    im_rgb, truth = make_eclipse_image((300, 400), radius=60)
+    filename = str(tmp_path / 'photo.jpg')
+    write_eclipse_photo(filename, im_rgb, time=datetime(2017, 8, 21, 17, 22,
+                                                        30))
+    contacts.save(tmp_path / 'contacts.npz')
+    sunpymap = eclipse_image_to_map(filename,
+                                    contact_grid=str(tmp_path /
+                                                     'contacts.npz'))
+    assert sunpymap.meta['phase'] == 'total'
+    assert 0 < sunpymap.meta['fromc2'] < 120
+    assert -120 < sunpymap.meta['fromc3'] < 0
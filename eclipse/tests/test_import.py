@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import pytest
+
+# Modules which take most of the time to import, and which the command line
+# tool and reading EXIF data do not need
+HEAVY_MODULES = ['pkg_resources', 'astropy', 'sunpy', 'scipy', 'skimage',
+                 'matplotlib', 'PIL']
+
+
+def _imported(statement):
+    """
+    The top level packages imported by a statement in a new interpreter.
+    """
+    code = (f'import sys\n{statement}\n'
+            "print(' '.join({name.split('.')[0] for name in sys.modules}))")
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    return set(output.split())
+
+
+@pytest.mark.parametrize('statement', [
+    'import eclipse',
+    'import eclipse.cli',
+    'from eclipse import SAMPLE_PHOTO',
+    'import eclipse.scan, eclipse.batch, eclipse.exif',
+])
+def test_light_imports(statement):
+    assert _imported(statement).isdisjoint(HEAVY_MODULES)
+
+
+def test_lazy_submodules():
+    import eclipse
+    assert eclipse.meta.read_exif is eclipse.exif.read_exif
+    with pytest.raises(AttributeError):
+        eclipse.not_a_module
@@ -0,0 +1,89 @@
+import sqlite3
+from datetime import datetime
+
+import astropy.units as u
+
+from eclipse.index import PhotoIndex
+
+
+def test_photo_index(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    index = PhotoIndex(path)
+    # a scan of the archive, where the disks are not known yet
+    index.add_many([
+        {'filename': 'madras.jpg', 'time': '2017-08-21T17:20:00',
+         'lat': 44.63, 'lon': -121.13, 'camera': 'A', 'error': None},
+        {'filename': 'salem.jpg', 'time': '2017-08-21T17:17:30.5',
+         'lat': 44.94, 'lon': -123.04, 'camera': 'B'},
+        {'filename': 'casper.jpg', 'time': '2017-08-21T17:43:00',
+         'lat': 42.87, 'lon': -106.31, 'camera': 'A'}])
+    assert len(index) == 3
+    # the disks found by a batch are added to the same rows
+    index.add_header('madras.jpg', {'crpix1': 1400.0, 'crpix2': 900.0,
+                                    'cdelt1': 1.1, 'rsun_obs': 948.0,
+                                    'crota2': 12.0}, 'madras.fits')
+    index.add_header('salem.jpg', {'crpix1': 1400.0, 'crpix2': 900.0,
+                                   'cdelt1': 4.2, 'rsun_obs': 948.0})
+    index.close()
+
+    index = PhotoIndex(path)
+    madras, = index.query(near=(44.5, -121.0), within=50 * u.km)
+    assert madras['camera'] == 'A' and madras['output'] == 'madras.fits'
+    assert madras['im_radius'] > 800
+    assert [row['filename'] for row in index.query(near=(44.5, -121.0),
+                                                   within=2 * u.deg)] == [
+        'salem.jpg', 'madras.jpg']
+    assert index.query(near=(44.5, -121.0), within=50 * u.km,
+                       min_radius=900) == []
+    assert [row['filename'] for row in index.query(
+        start=datetime(2017, 8, 21, 17, 17, 30),
+        end='2017-08-21T17:20:00')] == ['salem.jpg', 'madras.jpg']
+    assert [row['filename'] for row in index.query(camera='A', limit=1)] == [
+        'madras.jpg']
+
+
+def _phase_rows(index):
+    index.add_header('madras.jpg', {'date-obs': '2017-08-21T17:20:00',
+                                    'phase': 'total', 'fromc2': 15.0,
+                                    'fromc3': -80.0})
+    index.add_header('salem.jpg', {'date-obs': '2017-08-21T17:14:00',
+                                   'phase': 'partial'})
+    # a later scan without the phase keeps it
+    index.add({'filename': 'madras.jpg', 'camera': 'A'})
+
+
+def test_query_phase():
+    index = PhotoIndex(':memory:')
+    _phase_rows(index)
+    madras, = index.query(phase='total')
+    assert madras['filename'] == 'madras.jpg' and madras['camera'] == 'A'
+    assert (madras['fromc2'], madras['fromc3']) == (15.0, -80.0)
+    salem, = index.query(phase='partial')
+    assert salem['filename'] == 'salem.jpg' and salem['fromc2'] is None
+
+
+def test_add_without_upsert(monkeypatch):
+    # SQLite before 3.24 has no INSERT ... ON CONFLICT DO UPDATE
+    monkeypatch.setattr('eclipse.index._HAS_UPSERT', False)
+    index = PhotoIndex(':memory:')
+    _phase_rows(index)
+    assert len(index) == 2
+    madras, = index.query(phase='total')
+    assert madras['filename'] == 'madras.jpg' and madras['camera'] == 'A'
+    assert madras['time'].startswith('2017-08-21T17:20:00')
+
+
+def test_index_adds_new_columns(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    # an index made before the phase of the eclipse was stored
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('CREATE TABLE photos (filename TEXT PRIMARY KEY, '
+                           'time TEXT)')
+        connection.execute("INSERT INTO photos VALUES ('a.jpg', NULL)")
+    connection.close()
+
+    index = PhotoIndex(path)
+    index.add({'filename': 'a.jpg', 'phase': 'total'})
+    assert [row['filename'] for row in index.query(phase='total')] == [
+        'a.jpg']
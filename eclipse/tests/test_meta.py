@@ -1,3 +1,10 @@
+from datetime import datetime
+
+import astropy.units as u
+import numpy as np
+from astropy.tests.helper import assert_quantity_allclose
+import sunpy.coordinates
+
 from eclipse import SAMPLE_PHOTO
 from eclipse import meta
 import exifread
@@ -7,3 +14,121 @@ def test_sample_photo_date():
     result = meta.get_meta_from_exif(tags)
     assert result.get('DATEOBS') is not None
 
+
+def test_ephemeris_cache(monkeypatch):
+    calls = []
+    earth_distance = sunpy.coordinates.sun.earth_distance
+
+    def counting_earth_distance(time):
+        calls.append(time)
+        return earth_distance(time)
+    monkeypatch.setattr(sunpy.coordinates.sun, 'earth_distance',
+                        counting_earth_distance)
+
+    cache = meta.EphemerisCache(time_tolerance=10 * u.s)
+    first = cache.earth_distance(datetime(2017, 8, 21, 18, 0, 0))
+    second = cache.earth_distance(datetime(2017, 8, 21, 18, 0, 4))
+    assert first == second
+    assert len(calls) == 1
+    cache.earth_distance(datetime(2017, 8, 21, 18, 0, 6))
+    assert len(calls) == 2
+
+    angle = cache.orientation(44.3029 * u.deg, -116.088 * u.deg,
+                              datetime(2017, 8, 21, 18, 0, 0))
+    assert len(cache) == 3
+    cache.clear()
+    assert len(cache) == 0
+    assert_quantity_allclose(angle, cache.orientation(
+        44.3029 * u.deg, -116.088 * u.deg, datetime(2017, 8, 21, 18, 0, 0)))
+
+
+def test_ephemeris_cache_max_size(monkeypatch):
+    calls = []
+    earth_distance = sunpy.coordinates.sun.earth_distance
+
+    def counting_earth_distance(time):
+        calls.append(time)
+        return earth_distance(time)
+    monkeypatch.setattr(sunpy.coordinates.sun, 'earth_distance',
+                        counting_earth_distance)
+
+    cache = meta.EphemerisCache(max_size=2)
+    first, second, third = (datetime(2017, 8, 21, 18, 0, second)
+                            for second in range(3))
+    cache.earth_distance(first)
+    cache.earth_distance(second)
+    # using the first time keeps it, so the second is forgotten instead
+    cache.earth_distance(first)
+    cache.earth_distance(third)
+    assert len(cache) == 2
+    cache.earth_distance(first)
+    assert len(calls) == 3
+    cache.earth_distance(second)
+    assert len(calls) == 4
+
+
+def test_build_meta_batch():
+    tags = [exifread.process_file(open(filename, 'rb'))
+            for filename in (SAMPLE_PHOTO, SAMPLE_PHOTO.replace('2017', ''))]
+    im_cx = [941, 1126] * u.pix
+    im_cy = [1222, 1767] * u.pix
+    im_radius = [223, 219] * u.pix
+
+    headers = meta.build_meta_batch(im_cx, im_cy, im_radius, tags)
+    assert len(headers) == 2
+    for i, header in enumerate(headers):
+        time = meta.get_image_time(tags[i])
+        plate_scale = meta.get_plate_scale(time, im_radius[i])
+        wcs = meta.build_wcs(im_cx[i:i + 1], im_cy[i:i + 1], plate_scale)
+        expected = meta.build_meta(wcs, tags[i])
+        assert set(header) == set(expected)
+        for key, value in expected.items():
+            if isinstance(value, str):
+                assert header[key] == value
+            else:
+                # the scalar version rounds the location for its cache
+                assert np.isclose(header[key], value, rtol=1e-5), key
+
+
+def test_build_meta_from_values():
+    tags = meta.read_exif(SAMPLE_PHOTO)
+    exif_meta = meta.get_meta_from_exif(tags)
+    time = meta.get_image_time(tags)
+    plate_scale = meta.get_plate_scale(time, [223] * u.pix)
+
+    expected = meta.build_meta(
+        meta.build_wcs([941] * u.pix, [1222] * u.pix, plate_scale), tags)
+    header = meta.build_meta_from_values(
+        meta.build_wcs([941] * u.pix, [1222] * u.pix, plate_scale), time,
+        exif_meta['LAT'], exif_meta['LON'],
+        exposure_time=exif_meta['EXPTIME'], camera=exif_meta['TELECOP'],
+        author=exif_meta['AUTHOR'])
+    assert dict(header) == dict(expected)
+
+
+def test_build_meta_batch_from_values():
+    # the frames of a video from one place
+    times = [datetime(2017, 8, 21, 17, 21, 0),
+             datetime(2017, 8, 21, 17, 21, 1)]
+    im_cx = [941, 943] * u.pix
+    im_cy = [1222, 1221] * u.pix
+    im_radius = [223, 223] * u.pix
+    headers = meta.build_meta_batch_from_values(im_cx, im_cy, im_radius,
+                                                times, 44.37, -119.4)
+    assert len(headers) == 2
+    for i, header in enumerate(headers):
+        plate_scale = meta.get_plate_scale(times[i], im_radius[i])
+        expected = meta.build_meta_from_values(
+            meta.build_wcs(im_cx[i:i + 1], im_cy[i:i + 1], plate_scale),
+            times[i], 44.37, -119.4)
+        assert set(header) == set(expected)
+        for key, value in expected.items():
+            if isinstance(value, str):
+                assert header[key] == value
+            else:
+                assert np.isclose(header[key], value, rtol=1e-5), key
+
+
+def test_missing_exif():
+    assert meta.get_image_time({}) is None
+    assert meta.get_meta_from_exif({}) == {}
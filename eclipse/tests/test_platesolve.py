@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import astropy.units as u
+import numpy as np
+import pytest
+from sunpy.map import GenericMap
+
+import eclipse.meta as m
+from eclipse.platesolve import (find_point_sources, load_catalog,
+                                match_sources, predict_sources, refine_wcs)
+from eclipse.synthetic import make_eclipse_image
+
+
+def _meta(cx, cy, radius, rotation=0):
+    time = datetime(2017, 8, 21, 17, 46)
+    plate_scale = m.get_plate_scale(time, np.array([radius]) * u.pix)
+    wcs = m.build_wcs(np.array([cx]) * u.pix, np.array([cy]) * u.pix,
+                      plate_scale)
+    meta = m.build_meta_from_values(wcs, time, 44.37, -119.4)
+    meta['crota2'] += rotation
+    return meta
+
+
+@pytest.fixture(scope='module')
+def star_field():
+    # a wide field around the Sun in Leo, with a small disk
+    im_rgb, truth = make_eclipse_image((600, 800), radius=12, n_prominences=0)
+    im = np.flipud(im_rgb).mean(axis=2).astype(np.float32)
+    true_map = GenericMap(im, _meta(truth['im_cx'], truth['im_cy'],
+                                    truth['im_radius']))
+    names, x, y = predict_sources(true_map)
+    rows, columns = np.mgrid[:im.shape[0], :im.shape[1]]
+    for source_x, source_y in zip(x, y):
+        im += 200 * np.exp(-((columns - source_x) ** 2 +
+                             (rows - source_y) ** 2) / (2 * 1.5 ** 2))
+    return im, truth, true_map.meta, names, x, y
+
+
+def test_load_catalog():
+    names, coords, vmag, tree = load_catalog()
+    assert len(names) == len(coords) == len(vmag) == tree.n
+    regulus = coords[list(names).index('Regulus')]
+    assert abs(regulus.ra.deg - 152.093) < 1e-3
+
+
+def test_find_point_sources(star_field):
+    im, truth, meta, names, x, y = star_field
+    assert 'Regulus' in names
+    found_x, found_y, flux = find_point_sources(GenericMap(im, meta))
+    for source_x, source_y in zip(x[2 < x], y[2 < x]):
+        assert np.hypot(found_x - source_x, found_y - source_y).min() < 0.1
+
+
+def test_match_sources():
+    rng = np.random.default_rng(0)
+    predicted_x, predicted_y = rng.uniform(0, 500, (2, 8))
+    # a rotation and a change of scale about the Sun, and a small shift
+    center = 250 + 250j
+    a = 1.02 * np.exp(0.3j)
+    b = center * (1 - a) + 2 - 1j
+    z = a * (predicted_x + 1j * predicted_y) + b
+    # two of the predicted sources are missing and there are three others
+    x = np.concatenate([z.real[2:], rng.uniform(0, 500, 3)])
+    y = np.concatenate([z.imag[2:], rng.uniform(0, 500, 3)])
+    matches, transform = match_sources(x, y, predicted_x, predicted_y,
+                                       (250, 250))
+    assert list(matches) == [-1, -1, 0, 1, 2, 3, 4, 5]
+    assert np.allclose(transform, (a, b))
+
+    with pytest.raises(ValueError):
+        match_sources(x[:2], y[:2], predicted_x, predicted_y, (250, 250))
+
+
+@pytest.mark.parametrize('rotation', [2, -25])
+def test_refine_wcs(star_field, rotation):
+    im, truth, true_meta, *_ = star_field
+    # a wrong disk, as the Moon is not centred on the Sun, and a wrong
+    # rotation, as if the location of the camera were wrong
+    guess = GenericMap(im, _meta(truth['im_cx'] + 2, truth['im_cy'] - 1,
+                                 truth['im_radius'] * 1.05, rotation))
+    refined, matches = refine_wcs(guess, full_output=True)
+    assert refined.meta['nmatch'] >= 3
+    assert refined.meta['psresid'] < 0.1
+    assert 'Regulus' in matches['name']
+    for key, tolerance in [('crpix1', 0.05), ('crpix2', 0.05),
+                           ('cdelt1', 0.01), ('crota2', 0.01)]:
+        assert abs(refined.meta[key] - true_meta[key]) < tolerance
@@ -0,0 +1,264 @@
+import mmap
+import pickle
+import tracemalloc
+
+import matplotlib.image
+import numpy as np
+import pytest
+
+from eclipse import SAMPLE_PHOTO
+from eclipse.process import (_hough_search, _pyramid_search,
+                             _sobel_magnitude, eclipse_image_to_fits,
+                             eclipse_image_to_map, find_sun_and_moon,
+                             find_sun_center_and_radius, find_sun_in_photo,
+                             load_detection_image, rgb_to_gray)
+from eclipse.synthetic import (make_eclipse_image, make_partial_eclipse_image,
+                               write_eclipse_photo)
+
+
+@pytest.fixture(scope='module')
+def sample_image():
+    im_rgb = np.flipud(matplotlib.image.imread(SAMPLE_PHOTO))
+    return np.average(im_rgb, axis=2)
+
+
+@pytest.fixture(scope='module')
+def exhaustive_result(sample_image):
+    return find_sun_center_and_radius(sample_image)
+
+
+@pytest.mark.parametrize('pyramid_levels', [2, 3])
+def test_pyramid_matches_exhaustive(sample_image, exhaustive_result,
+                                    pyramid_levels):
+    im_cx, im_cy, im_radius = exhaustive_result
+    p_cx, p_cy, p_radius, info = find_sun_center_and_radius(
+        sample_image, pyramid_levels=pyramid_levels, full_output=True)
+
+    assert abs(p_cx - im_cx)[0].value <= 1
+    assert abs(p_cy - im_cy)[0].value <= 1
+    # the exhaustive search only tries radii in steps of 10 pixels
+    assert abs(p_radius - im_radius)[0].value <= 5
+    assert info['pyramid_levels'] == pyramid_levels
+    assert info['refinement_error'].value <= 3
+
+
+@pytest.mark.parametrize('pyramid_levels', [0, 2])
+def test_bounded_accumulator_memory(sample_image, pyramid_levels):
+    expected = find_sun_center_and_radius(sample_image,
+                                          pyramid_levels=pyramid_levels)
+    # small enough to search one radius at a time
+    result = find_sun_center_and_radius(sample_image,
+                                        pyramid_levels=pyramid_levels,
+                                        max_accumulator_bytes=1)
+    for value, expected_value in zip(result, expected):
+        assert value == expected_value
+
+
+@pytest.mark.parametrize('search', [_hough_search, _pyramid_search])
+def test_accumulator_peak_memory(sample_image, search):
+    sob = _sobel_magnitude(sample_image[500:1400, 700:1700])
+    image = sob > (sob.mean() * 5) if search is _hough_search else sob
+    budget = 4 * sob.size * np.dtype(np.float64).itemsize
+
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        search(image, np.arange(100, 400, 10), max_accumulator_bytes=budget)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+    assert peak <= budget
+
+
+def test_limb_fit_sub_pixel():
+    # a dark Moon at a sub-pixel position surrounded by a bright corona with
+    # a prominence sticking out of the limb
+    cx, cy, radius = 300.3, 410.7, 120.4
+    x, y = np.mgrid[0:600, 0:800]
+    r = np.hypot(x - cx, y - cy)
+    im = np.where(r > radius, 250 * (np.maximum(r, radius) / radius) ** -3, 0)
+    im[(np.hypot(x - (cx + radius), y - cy) < 12) & (r > radius)] = 250
+    im += np.random.default_rng(0).normal(0, 3, im.shape)
+
+    im_cx, im_cy, im_radius, info = find_sun_center_and_radius(
+        im, method='fit', full_output=True)
+
+    assert abs(im_cx[0].value - cx) < 0.25
+    assert abs(im_cy[0].value - cy) < 0.25
+    # blurring the image moves the steepest gradient slightly inside the limb
+    assert abs(im_radius[0].value - radius) < 2
+    assert info['method'] == 'fit'
+    assert np.all(info['uncertainty'].value < 0.1)
+
+
+def test_unknown_method(sample_image):
+    with pytest.raises(ValueError):
+        find_sun_center_and_radius(sample_image, method='ellipse')
+
+
+@pytest.mark.parametrize('scale', [2, 8])
+def test_find_sun_in_reduced_photo(sample_image, scale):
+    expected = find_sun_center_and_radius(sample_image, method='fit')
+    result = find_sun_in_photo(SAMPLE_PHOTO, scale=scale, method='fit')
+    for value, expected_value in zip(result, expected):
+        assert abs(value - expected_value)[0].value < 1
+
+
+def test_load_detection_image(sample_image):
+    im, scale, shape = load_detection_image(SAMPLE_PHOTO, scale=4)
+    assert scale == 4
+    assert shape == sample_image.shape
+    assert im.shape == (shape[0] // 4, shape[1] // 4)
+
+
+def test_rgb_to_gray(sample_image):
+    im_rgb = np.flipud(matplotlib.image.imread(SAMPLE_PHOTO))
+    np.testing.assert_allclose(rgb_to_gray(im_rgb), sample_image)
+
+    im = rgb_to_gray(im_rgb, dtype=np.float32)
+    assert im.dtype == np.float32
+    np.testing.assert_allclose(im, sample_image, atol=1e-3)
+
+    # 8 bit photos are scaled to fill 16 bits
+    im = rgb_to_gray(im_rgb, dtype=np.uint16)
+    assert im.dtype == np.uint16
+    np.testing.assert_allclose(im / 256, sample_image, atol=0.5 / 256)
+
+    im = rgb_to_gray(im_rgb[:5, :5], weights='rec709')
+    expected = im_rgb[:5, :5] @ np.array([0.2126, 0.7152, 0.0722])
+    np.testing.assert_allclose(im, expected)
+
+    # the alpha channel of an RGBA image is left out
+    im_rgba = np.dstack([im_rgb, np.full(im_rgb.shape[:2], 255, np.uint8)])
+    np.testing.assert_allclose(rgb_to_gray(im_rgba), sample_image)
+
+    # floating point images between 0 and 1 fill the range of an integer type
+    im = rgb_to_gray(im_rgb / 255, dtype=np.uint16)
+    assert im.dtype == np.uint16
+    np.testing.assert_allclose(im / 65535, sample_image / 255,
+                               atol=1 / 65535)
+    assert rgb_to_gray(np.full((2, 2, 3), 1.5), dtype=np.uint8).max() == 255
+
+    # grayscale images are scaled like color ones
+    gray = np.rint(sample_image).astype(np.uint8)
+    im = rgb_to_gray(gray, dtype=np.uint16)
+    np.testing.assert_array_equal(im, gray.astype(np.uint16) * 256)
+    im = rgb_to_gray(gray / 255, dtype=np.uint16)
+    np.testing.assert_allclose(im / 65535, gray / 255, atol=1 / 65535)
+    np.testing.assert_array_equal(rgb_to_gray(gray[..., np.newaxis]), gray)
+
+    # and a wider type is narrowed to its top bits
+    im_rgb16 = im_rgb.astype(np.uint16) * 257
+    im = rgb_to_gray(im_rgb16, dtype=np.uint8)
+    np.testing.assert_allclose(im, sample_image, atol=1)
+    np.testing.assert_array_equal(rgb_to_gray(gray.astype(np.uint16) * 257,
+                                              dtype=np.uint8), gray)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint16])
+def test_find_sun_in_working_dtype(exhaustive_result, dtype):
+    im_rgb = np.flipud(matplotlib.image.imread(SAMPLE_PHOTO))
+    im = rgb_to_gray(im_rgb, dtype=dtype)
+    result = find_sun_center_and_radius(im)
+    for value, expected_value in zip(result, exhaustive_result):
+        assert abs(value - expected_value)[0].value <= 1
+
+
+@pytest.mark.parametrize('roi_scale', [1, 4])
+def test_disk_chosen_over_foreground(roi_scale):
+    im_rgb, truth = make_eclipse_image((600, 800), center=(330.2, 420.6),
+                                       radius=80)
+    im = np.flipud(im_rgb).mean(axis=2)
+    # a street light, found first in raster order, and a small round flare
+    im[20:50, 100:400] = 255
+    im[500:530, 650:680] = 255
+
+    im_cx, im_cy, im_radius = find_sun_center_and_radius(
+        im, method='fit', blur_sigma=2, roi_scale=roi_scale)
+    assert abs(im_cx[0].value - truth['im_cx']) < 0.5
+    assert abs(im_cy[0].value - truth['im_cy']) < 0.5
+    assert abs(im_radius[0].value - truth['im_radius']) < 1
+
+
+@pytest.mark.parametrize('roi_scale', [1, 4])
+def test_disk_chosen_over_bright_square(roi_scale):
+    im_rgb, truth = make_eclipse_image((600, 800), center=(330.2, 420.6),
+                                       radius=80)
+    im = np.flipud(im_rgb).mean(axis=2)
+    # a lit window, brighter and with a larger area than the corona around
+    # the dark Moon
+    im[410:590, 610:790] = 255
+
+    im_cx, im_cy, im_radius = find_sun_center_and_radius(
+        im, method='fit', blur_sigma=2, roi_scale=roi_scale)
+    assert abs(im_cx[0].value - truth['im_cx']) < 0.5
+    assert abs(im_cy[0].value - truth['im_cy']) < 0.5
+    assert abs(im_radius[0].value - truth['im_radius']) < 1
+
+
+def test_lazy_map(sample_image):
+    lazy_map = eclipse_image_to_map(SAMPLE_PHOTO, lazy=True, method='fit')
+    expected = eclipse_image_to_map(SAMPLE_PHOTO, detection_scale=8,
+                                    method='fit')
+
+    # the header, coordinates and shape are known without decoding
+    assert lazy_map.meta['crpix1'] == expected.meta['crpix1']
+    assert lazy_map.dimensions == expected.dimensions
+    assert lazy_map.bottom_left_coord.Tx == expected.bottom_left_coord.Tx
+    assert not lazy_map.is_loaded
+    assert len(pickle.dumps(lazy_map)) < 100_000
+
+    unpickled = pickle.loads(pickle.dumps(lazy_map))
+    np.testing.assert_allclose(unpickled.data, sample_image)
+    assert unpickled.is_loaded
+    np.testing.assert_allclose(lazy_map.data, sample_image)
+
+
+def test_eclipse_image_to_fits(tmp_path, sample_image):
+    sunpymap = eclipse_image_to_fits(SAMPLE_PHOTO, str(tmp_path / 'map.fits'),
+                                     detection_scale=8)
+    assert sunpymap.data.dtype == np.dtype('>f4')
+    base = sunpymap.data
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, mmap.mmap)
+    np.testing.assert_allclose(sunpymap.data, sample_image, atol=1e-3)
+
+
+@pytest.mark.parametrize('moon_offset', [(0.4, 0.6), (0.1, -0.3), (-0.9, 0.9),
+                                         (1.5, 1.5)])
+def test_find_sun_and_moon(moon_offset):
+    im_rgb, truth = make_partial_eclipse_image(moon_offset=moon_offset)
+    im = np.flipud(im_rgb).mean(axis=2)
+    sun, moon, obscuration = find_sun_and_moon(im)
+    for value, key in zip(sun, ('sun_cx', 'sun_cy', 'sun_radius')):
+        assert abs(value[0].value - truth[key]) < 0.5
+
+    # the fraction of the pixels of the Sun behind the Moon
+    x, y = np.ogrid[:im.shape[0], :im.shape[1]]
+    on_sun = (np.hypot(x - truth['sun_cx'], y - truth['sun_cy']) <=
+              truth['sun_radius'])
+    on_moon = (np.hypot(x - truth['moon_cx'], y - truth['moon_cy']) <=
+               truth['moon_radius'])
+    assert abs(obscuration - np.mean(on_moon[on_sun])) < 0.005
+    if not on_moon[on_sun].any():
+        assert moon is None
+        return
+    for value, key in zip(moon, ('moon_cx', 'moon_cy', 'moon_radius')):
+        assert abs(value[0].value - truth[key]) < 2
+
+
+def test_find_sun_and_moon_in_photo(tmp_path):
+    im_rgb, truth = make_partial_eclipse_image((1200, 1600))
+    filename = str(tmp_path / 'partial.jpg')
+    write_eclipse_photo(filename, im_rgb)
+    im_cx, im_cy, im_radius, info = find_sun_in_photo(
+        filename, scale=4, method='partial', blur_sigma=1, full_output=True)
+    assert abs(im_cx[0].value - truth['sun_cx']) < 2
+    assert abs(im_cy[0].value - truth['sun_cy']) < 2
+    assert abs(im_radius[0].value - truth['sun_radius']) < 2
+    moon_cx, moon_cy, moon_radius = info['moon']
+    assert abs(moon_cx[0].value - truth['moon_cx']) < 4
+    assert abs(moon_radius[0].value - truth['moon_radius']) < 4
+    assert 0.5 < info['obscuration'] < 0.65
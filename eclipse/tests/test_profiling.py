@@ -0,0 +1,49 @@
+import numpy as np
+
+from eclipse.process import find_sun_center_and_radius
+from eclipse.profiling import profile, summarize_profiles
+from eclipse.synthetic import make_eclipse_image
+
+
+def _synthetic_image():
+    im_rgb, _ = make_eclipse_image((400, 500), radius=60)
+    return np.flipud(im_rgb).mean(axis=2)
+
+
+def test_profile_stages():
+    im = _synthetic_image()
+    with profile() as p:
+        find_sun_center_and_radius(im, pyramid_levels=1, method='fit',
+                                   blur_sigma=2)
+
+    assert list(p.stages) == ['blur_label', 'hough', 'fit']
+    for stage in p.stages.values():
+        assert stage['count'] == 1
+        assert stage['time'] > 0
+        assert stage['peak_bytes'] > 0
+    assert p.info['image_shape'] == im.shape
+    assert p.info['roi_shape'][0] < im.shape[0]
+    assert p.info['n_radii'] > 0
+    assert p.info['n_limb_points'] > 0
+
+    # nothing is recorded outside the profile
+    find_sun_center_and_radius(im)
+    assert p.stages['hough']['count'] == 1
+
+
+def test_summarize_profiles():
+    im = _synthetic_image()
+    profiles = []
+    for _ in range(2):
+        with profile(trace_memory=False) as p:
+            find_sun_center_and_radius(im)
+        profiles.append(p.to_dict())
+    profiles.append(None)
+
+    summary = summarize_profiles(profiles)
+    assert set(summary) == {'blur_label', 'hough'}
+    hough = summary['hough']
+    assert hough['count'] == 2
+    assert hough['max_time'] <= hough['total_time']
+    assert np.isclose(hough['mean_time'] * 2, hough['total_time'])
+    assert hough['max_peak_bytes'] is None
@@ -0,0 +1,36 @@
+import csv
+import shutil
+
+from eclipse import SAMPLE_PHOTO
+from eclipse.cli import main
+from eclipse.scan import SCAN_FIELDS, scan_photo, scan_photos
+
+
+def test_scan_photo():
+    row = scan_photo(SAMPLE_PHOTO)
+    assert set(row) == set(SCAN_FIELDS)
+    assert row['time'] == '2017-08-21T11:27:13'
+    assert row['camera'] == 'Canon EOS 70D'
+    assert abs(row['lat'] - 44.3029) < 1e-3
+    assert abs(row['exposure_time'] - 1 / 60) < 1e-9
+    assert row['error'] is None
+
+
+def test_scan_unreadable(tmp_path):
+    filename = tmp_path / 'broken.jpg'
+    filename.write_bytes(b'not a photo')
+    row, = scan_photos([str(filename)])
+    assert row['time'] is None
+    assert row['lat'] is None
+
+
+def test_scan_command(tmp_path):
+    shutil.copy(SAMPLE_PHOTO, tmp_path / 'a.jpg')
+    shutil.copy(SAMPLE_PHOTO, tmp_path / 'b.jpg')
+    index = tmp_path / 'index.csv'
+    assert main(['scan', str(tmp_path), '-o', str(index), '-j', '2']) == 0
+    with open(index) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['filename'] for row in rows] == [str(tmp_path / 'a.jpg'),
+                                                 str(tmp_path / 'b.jpg')]
+    assert rows[0]['time'] == '2017-08-21T11:27:13'
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from eclipse.sequence import sequence_to_maps, track_sun
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+
+def _moving_disk(n_frames, jump_at=None):
+    frames, truths = [], []
+    for i in range(n_frames):
+        center = (200 + 0.8 * i, 250 - 1.3 * i)
+        if i == jump_at:
+            center = (center[0] + 20, center[1] - 15)
+        im_rgb, truth = make_eclipse_image((400, 500), center=center,
+                                           radius=60, seed=i)
+        frames.append(im_rgb)
+        truths.append(truth)
+    return frames, truths
+
+
+def test_track_sun():
+    frames, truths = _moving_disk(12, jump_at=8)
+    tracked = list(track_sun(frames, keyframe_interval=20, blur_sigma=2,
+                             method='fit'))
+
+    keyframes = [frame.index for frame in tracked if frame.keyframe]
+    # the disk is searched for again after it jumps, and when it jumps back
+    assert keyframes == [0, 8, 9]
+    for frame, truth in zip(tracked, truths):
+        assert abs(frame.im_cx[0].value - truth['im_cx']) <= 1
+        assert abs(frame.im_cy[0].value - truth['im_cy']) <= 1
+        assert abs(frame.im_radius[0].value - truth['im_radius']) <= 1.5
+
+
+def test_sequence_of_photos(tmp_path):
+    frames, truths = _moving_disk(3)
+    start = datetime(2017, 8, 21, 17, 46)
+    filenames = []
+    for i, im_rgb in enumerate(frames):
+        filenames.append(str(tmp_path / f'frame{i}.jpg'))
+        write_eclipse_photo(filenames[-1], im_rgb,
+                            time=start + timedelta(seconds=i))
+
+    maps = sequence_to_maps(filenames, blur_sigma=2, method='fit')
+    for i, (sunpymap, truth) in enumerate(zip(maps, truths)):
+        assert abs(sunpymap.meta['crpix2'] - truth['im_cx']) <= 1
+        assert sunpymap.meta['date-obs'].startswith(f'2017-08-21T17:46:0{i}')
+
+
+def test_sequence_of_video(tmp_path):
+    pytest.importorskip('imageio')
+    tifffile = pytest.importorskip('tifffile')
+    frames, truths = _moving_disk(3)
+    filename = str(tmp_path / 'burst.tif')
+    for im_rgb in frames:
+        tifffile.imwrite(filename, im_rgb, append=True)
+
+    with pytest.raises(ValueError):
+        next(sequence_to_maps(filename))
+    maps = list(sequence_to_maps(filename, start_time=datetime(2017, 8, 21),
+                                 frame_rate=2, lat=44.37, lon=-119.4,
+                                 blur_sigma=2, method='fit'))
+    assert len(maps) == 3
+    assert maps[2].meta['date-obs'].startswith('2017-08-21T00:00:01')
+    assert maps[2].meta['lat'] == 44.37
+    assert abs(maps[2].meta['crpix1'] - truths[2]['im_cy']) <= 1
@@ -0,0 +1,93 @@
+import asyncio
+import os
+
+import eclipse.service
+from eclipse.batch import _process_photo
+from eclipse.service import InboxService
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+
+def _process_or_die(filename, *args):
+    # a photo which kills the process converting it, as running out of
+    # memory would
+    if os.path.basename(filename).startswith('killer'):
+        os._exit(1)
+    return _process_photo(filename, *args)
+
+
+def test_inbox_service(tmp_path):
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    # a photo left from before the service started
+    im_rgb, _ = make_eclipse_image((300, 400), radius=60, seed=0)
+    write_eclipse_photo(str(inbox / 'early.jpg'), im_rgb)
+    (inbox / 'notes.txt').write_text('not a photo')
+
+    service = InboxService(str(inbox), str(tmp_path / 'maps'), max_workers=1,
+                           max_queue=1, poll_interval=0.05,
+                           index=str(tmp_path / 'index.sqlite'),
+                           method='fit', blur_sigma=2)
+    results = []
+
+    async def upload_and_stop():
+        for i in range(2):
+            # written elsewhere and moved in, as an upload would be
+            filename = str(inbox / f'upload{i}.jpg')
+            im_rgb, _ = make_eclipse_image((300, 400), radius=60, seed=i + 1)
+            write_eclipse_photo(str(tmp_path / 'part.jpg'), im_rgb)
+            os.rename(tmp_path / 'part.jpg', filename)
+        while service.n_converted + service.n_failed < 3:
+            await asyncio.sleep(0.05)
+        service.stop()
+
+    async def main():
+        await asyncio.gather(
+            service.run(on_result=lambda *result: results.append(result)),
+            upload_and_stop())
+
+    asyncio.run(asyncio.wait_for(main(), 120))
+
+    assert sorted(os.path.basename(result.filename)
+                  for result, latency in results) == ['early.jpg',
+                                                      'upload0.jpg',
+                                                      'upload1.jpg']
+    assert all(result.error is None for result, latency in results)
+    assert sorted(os.listdir(tmp_path / 'maps')) == ['early.fits',
+                                                     'upload0.fits',
+                                                     'upload1.fits']
+    stats = service.stats()
+    assert stats['queued'] == 0 and stats['running'] == 0
+    assert stats['converted'] == 3 and stats['failed'] == 0
+    assert 0 < stats['latency_p50'] <= stats['latency_p99']
+    assert len(service.index) == 3
+
+
+def test_inbox_service_survives_dead_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(eclipse.service, '_process_photo', _process_or_die)
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    im_rgb, _ = make_eclipse_image((300, 400), radius=60)
+    for name in ('killer.jpg', 'photo0.jpg', 'photo1.jpg'):
+        write_eclipse_photo(str(inbox / name), im_rgb)
+
+    service = InboxService(str(inbox), str(tmp_path / 'maps'), max_workers=1,
+                           poll_interval=0.05, method='fit', blur_sigma=2)
+    results = []
+
+    async def stop():
+        while service.n_converted + service.n_failed < 3:
+            await asyncio.sleep(0.05)
+        service.stop()
+
+    async def main():
+        await asyncio.gather(
+            service.run(on_result=lambda *result: results.append(result)),
+            stop())
+
+    asyncio.run(asyncio.wait_for(main(), 120))
+
+    errors = {os.path.basename(result.filename): result.error
+              for result, latency in results}
+    assert 'BrokenProcessPool' in errors['killer.jpg']
+    assert errors['photo0.jpg'] is None and errors['photo1.jpg'] is None
+    assert service.stats()['failed'] == 1
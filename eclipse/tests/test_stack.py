@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from eclipse.stack import stack_bracket
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+# the brightness of the corona at the limb in data numbers per second
+BRIGHTNESS = 61200
+
+
+def _write_bracket(tmp_path, suffix='.jpg'):
+    exposure_times = [1 / 500, 1 / 125, 1 / 30]
+    start = datetime(2017, 8, 21, 17, 46)
+    filenames = []
+    for i, exposure_time in enumerate(exposure_times):
+        # the camera drifts a little between exposures
+        im_rgb, truth = make_eclipse_image(
+            (600, 800), center=(300 + 1.5 * i, 400 - 2 * i), radius=80,
+            corona_brightness=BRIGHTNESS * exposure_time, n_prominences=0,
+            seed=i)
+        filenames.append(str(tmp_path / f'bracket{i}.jpg'))
+        write_eclipse_photo(filenames[-1], im_rgb, exposure_time=exposure_time,
+                            time=start + timedelta(seconds=i))
+        if suffix != '.jpg':
+            # the same photo without compression, read as floating point
+            with Image.open(filenames[-1]) as image:
+                exif = image.getexif()
+            filenames[-1] = filenames[-1].replace('.jpg', suffix)
+            Image.fromarray(im_rgb).save(filenames[-1], exif=exif)
+    return filenames
+
+
+@pytest.mark.parametrize('suffix', ['.jpg', '.png'])
+def test_stack_bracket(tmp_path, suffix):
+    filenames = _write_bracket(tmp_path, suffix)
+    sunpymap = stack_bracket(filenames, detection_scale=2)
+
+    assert sunpymap.meta['nframes'] == 3
+    assert sunpymap.meta['exptmin'] == 1 / 500
+    assert sunpymap.meta['date-end'] == '2017-08-21T17:46:02'
+    assert abs(sunpymap.meta['crpix2'] - 300) < 0.5
+    # the corona is saturated close to the limb in the long exposures and
+    # below the noise far from it in the short ones; the noise floor and
+    # saturation hold for 8 bit and floating point photos alike
+    scale = 255 if suffix == '.png' else 1
+    for r in [1.1, 1.5, 3]:
+        value = sunpymap.data[300, int(round(400 + 80 * r))] * scale
+        assert np.isclose(value, BRIGHTNESS * r ** -3, rtol=0.05)
+
+
+def test_stack_bracket_bad_input(tmp_path):
+    filenames = _write_bracket(tmp_path)
+    with pytest.raises(ValueError, match='floating point'):
+        stack_bracket(filenames, dtype=np.uint16)
+
+    im_rgb, _ = make_eclipse_image((600, 800), radius=80)
+    write_eclipse_photo(filenames[1], im_rgb, exposure_time=None)
+    with pytest.raises(ValueError, match='bracket1.jpg has no exposure time'):
+        stack_bracket(filenames)
+    write_eclipse_photo(filenames[1], im_rgb, time=None)
+    with pytest.raises(ValueError, match='bracket1.jpg has no time'):
+        stack_bracket(filenames)
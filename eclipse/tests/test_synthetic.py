@@ -0,0 +1,22 @@
+import numpy as np
+
+from eclipse.process import eclipse_image_to_map
+from eclipse.synthetic import make_eclipse_image, write_eclipse_photo
+
+
+def test_synthetic_photo_to_map(tmp_path):
+    im_rgb, truth = make_eclipse_image((600, 800), center=(280.4, 430.6),
+                                       radius=90)
+    assert im_rgb.shape == (600, 800, 3)
+    assert im_rgb.dtype == np.uint8
+    filename = str(tmp_path / 'synthetic.jpg')
+    write_eclipse_photo(filename, im_rgb, lat=-33.5, lon=151.25)
+
+    sunpymap = eclipse_image_to_map(filename, method='fit', blur_sigma=2)
+    assert abs(sunpymap.meta['crpix2'] - truth['im_cx']) < 0.5
+    assert abs(sunpymap.meta['crpix1'] - truth['im_cy']) < 0.5
+    radius = sunpymap.meta['rsun_obs'] / sunpymap.meta['cdelt1']
+    assert abs(radius - truth['im_radius']) < 1
+    assert abs(sunpymap.meta['lat'] + 33.5) < 1e-3
+    assert abs(sunpymap.meta['lon'] - 151.25) < 1e-3
+    assert sunpymap.meta['date-obs'].startswith('2017-08-21T17:46:00')
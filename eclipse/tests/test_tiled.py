@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from astropy.time import Time
+
+from eclipse.ephemeris import EclipseGrid
+from eclipse.process import eclipse_image_to_fits
+from eclipse.synthetic import make_eclipse_image
+from eclipse.tiled import open_tiff, tiff_overview, tiff_to_fits
+
+tifffile = pytest.importorskip('tifffile')
+
+
+@pytest.fixture(scope='module')
+def mosaic():
+    return make_eclipse_image((1000, 1400), radius=150)
+
+
+@pytest.fixture
+def eclipse_grid():
+    # a grid of one point, which the photos without EXIF data default to
+    time = Time(datetime(2017, 8, 21, 17, 21)).unix
+    return EclipseGrid([time], [44.37], [-119.4], *np.zeros((3, 1, 1, 1)),
+                       np.full((1, 1, 1), 950.0))
+
+
+def test_tiff_overview(tmp_path, mosaic):
+    im_rgb, truth = mosaic
+    filename = str(tmp_path / 'mosaic.tif')
+    tifffile.imwrite(filename, im_rgb)
+    image = open_tiff(filename)
+    assert isinstance(image, np.memmap)
+    overview = tiff_overview(image, 8, tile_rows=100)
+    assert overview.shape == (125, 175)
+    expected = np.flipud(im_rgb).mean(axis=2).reshape(125, 8, 175, 8)
+    np.testing.assert_allclose(overview, expected.mean(axis=(1, 3)),
+                               rtol=1e-5, atol=1e-4)
+
+
+def test_tiff_to_fits(tmp_path, mosaic, eclipse_grid):
+    im_rgb, truth = mosaic
+    filename = str(tmp_path / 'mosaic.tif')
+    tifffile.imwrite(filename, im_rgb)
+    output = str(tmp_path / 'mosaic.fits')
+    sunpymap = tiff_to_fits(filename, output, tile_rows=128, method='fit',
+                            eclipse_grid=eclipse_grid)
+    assert abs(sunpymap.meta['crpix2'] - truth['im_cx']) < 1
+    assert abs(sunpymap.meta['crpix1'] - truth['im_cy']) < 1
+    assert sunpymap.meta['obs_src'] == 'default'
+    assert sunpymap.date.isot.startswith('2017-08-21T17:21')
+    np.testing.assert_allclose(sunpymap.data,
+                               np.flipud(im_rgb).mean(axis=2), atol=1e-3)
+
+    with pytest.raises(OSError):
+        tiff_to_fits(filename, output, header=sunpymap.meta)
+
+    # a compressed, tiled image is decoded a tile at a time
+    pytest.importorskip('zarr')
+    tiled = str(tmp_path / 'tiled.tif')
+    tifffile.imwrite(tiled, im_rgb, tile=(128, 128), compression='zlib')
+    tiled_map = eclipse_image_to_fits(tiled, str(tmp_path / 'tiled.fits'),
+                                      tile_rows=100, header=sunpymap.meta)
+    assert tiled_map.meta['crpix1'] == sunpymap.meta['crpix1']
+    np.testing.assert_array_equal(tiled_map.data, sunpymap.data)
@@ -0,0 +1,234 @@
+"""Procedures to convert very large images, such as stitched mosaics, to maps
+a strip of rows at a time."""
+import os
+import warnings
+
+import numpy as np
+from astropy.io import fits
+from astropy.io.fits.verify import VerifyWarning
+
+from eclipse.process import (_downsample, _phase_meta, _photo_meta,
+                             _to_photo_pixels, find_sun_center_and_radius,
+                             rgb_to_gray)
+from eclipse.profiling import _record, _stage
+
+__all__ = ['open_tiff', 'tiff_overview', 'tiff_to_fits']
+
+# The value of BITPIX for each floating point type
+_BITPIX = {np.dtype(np.float32): -32, np.dtype(np.float64): -64}
+
+
+def open_tiff(filename):
+    """
+    Open a TIFF image without reading its pixels.
+
+    Uncompressed images stored in one piece are mapped into memory. Tiled or
+    compressed images are opened as a `zarr` array of their first level, which
+    decodes only the tiles that are sliced. Reading TIFF images needs
+    ``tifffile``, and tiled or compressed ones also ``zarr``, which are
+    installed with ``pip install eclipse[tiled]``.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the image.
+
+    Returns
+    -------
+    image : array_like
+        The image, with shape ``(rows, columns)`` or ``(rows, columns,
+        channels)``, in the orientation it is stored in the file. Slicing it
+        gives a `numpy.ndarray`.
+    """
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError('Reading TIFF images needs tifffile, which is '
+                          'installed with pip install eclipse[tiled].')
+
+    try:
+        return tifffile.memmap(filename, mode='r')
+    except ValueError:
+        # the image is not stored in one uncompressed piece
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError('Reading tiled or compressed TIFF images needs '
+                              'zarr, which is installed with pip install '
+                              'eclipse[tiled].')
+        return zarr.open(tifffile.imread(filename, aszarr=True, level=0),
+                         mode='r')
+
+
+def _gray_rows(image, start, stop, weights, dtype):
+    """
+    Read and convert rows ``start`` to ``stop`` of an image to grayscale.
+    """
+    strip = np.asarray(image[start:stop])
+    if strip.ndim == 3:
+        # leave out an alpha channel
+        strip = strip[..., :3]
+    return rgb_to_gray(strip, weights=weights, dtype=dtype)
+
+
+def tiff_overview(image, factor, tile_rows=512, weights='average'):
+    """
+    Make a reduced grayscale image of a large image, a strip of rows at a
+    time.
+
+    Parameters
+    ----------
+    image : array_like
+        The image, see `open_tiff`.
+
+    factor : `int`
+        The factor to reduce the image by. Blocks of ``factor`` x ``factor``
+        pixels are averaged, and the rows and columns left over at the bottom
+        and right of the image are left out.
+
+    tile_rows : `int`, optional
+        The number of rows read at once, rounded down to a multiple of
+        ``factor``. Defaults to 512.
+
+    weights : `str` or sequence of `float`, optional
+        The weights of the color channels, see `eclipse.process.rgb_to_gray`.
+        Defaults to ``'average'``.
+
+    Returns
+    -------
+    overview : `numpy.ndarray`
+        The reduced image, flipped like the data of a map.
+    """
+    rows = max(tile_rows // factor, 1) * factor
+    height = (image.shape[0] // factor) * factor
+    strips = [_downsample(_gray_rows(image, start, min(start + rows, height),
+                                     weights, np.float32), factor)
+              for start in range(0, height, rows)]
+    return np.flipud(np.concatenate(strips))
+
+
+def _fits_header(meta, shape, dtype):
+    """
+    The header of a FITS file of an image of ``shape`` and ``dtype`` with the
+    keys of the meta data of a map.
+    """
+    header = fits.Header()
+    header['SIMPLE'] = True
+    header['BITPIX'] = _BITPIX[dtype]
+    header['NAXIS'] = 2
+    header['NAXIS1'] = shape[1]
+    header['NAXIS2'] = shape[0]
+    with warnings.catch_warnings():
+        # keys longer than eight characters are written as HIERARCH cards
+        warnings.simplefilter('ignore', VerifyWarning)
+        for key, value in meta.items():
+            # sunpy keeps the comments of the keys in a dictionary
+            if (value is None or isinstance(value, dict) or
+                    key.upper() in header):
+                continue
+            header[key.upper()] = value
+    return header
+
+
+def tiff_to_fits(filename, output, detection_scale=8, tile_rows=512,
+                 dtype=np.float32, weights='average', overwrite=False,
+                 header=None, eclipse_grid=None, contact_grid=None, **kwargs):
+    """
+    Convert a very large TIFF image, such as a stitched mosaic, to a FITS
+    file of a map, holding only a few strips of rows in memory at a time.
+
+    The Sun is found in an overview of the image made while reading it, see
+    `tiff_overview`, and the header is built from the disk and the EXIF data
+    like that of `eclipse.process.eclipse_image_to_map`. The image is then
+    read again a strip of rows at a time, from the bottom up, converted to
+    grayscale and streamed to the FITS file, so that the memory used does not
+    depend on the size of the image.
+
+    Parameters
+    ----------
+    filename : `str`
+        The filename of the TIFF image.
+
+    output : `str`
+        The filename of the FITS file to write.
+
+    detection_scale : `int`, optional
+        The factor the overview the Sun is found in is reduced by. Defaults
+        to 8.
+
+    tile_rows : `int`, optional
+        The number of rows read and written at once. Defaults to 512.
+
+    dtype : `numpy.dtype`, optional
+        The type of the data written, `numpy.float32` or `numpy.float64`.
+        Defaults to `numpy.float32`.
+
+    weights : `str` or sequence of `float`, optional
+        The weights of the color channels, see `eclipse.process.rgb_to_gray`.
+        Defaults to ``'average'``.
+
+    overwrite : `bool`, optional
+        Whether to overwrite an existing FITS file. Defaults to `False`.
+
+    header : `dict`, optional
+        The header of the map. If given the Sun is not searched for and the
+        EXIF data is not read.
+
+    eclipse_grid, contact_grid : optional
+        Used if the EXIF data has no time or location, and to write the phase
+        of the eclipse to the header, see
+        `eclipse.process.eclipse_image_to_map`. The time and location are not
+        estimated from the stars.
+
+    kwargs
+        Passed to `eclipse.process.find_sun_center_and_radius`. The width of
+        the blur is reduced with the overview unless ``blur_sigma`` is given.
+
+    Returns
+    -------
+    sunpymap : `sunpy.map.GenericMap`
+        The map of the FITS file, which is mapped into memory rather than
+        read.
+    """
+    from sunpy.map import Map
+
+    dtype = np.dtype(dtype)
+    if dtype not in _BITPIX:
+        raise ValueError(f'Cannot stream data of type {dtype}, expected '
+                         'float32 or float64.')
+    if os.path.exists(output):
+        if not overwrite:
+            raise OSError(f'File {output} already exists.')
+        # a streamed HDU would be appended to the file
+        os.remove(output)
+
+    image = open_tiff(filename)
+    height, width = image.shape[:2]
+    _record(image_shape=(height, width))
+    if header is None:
+        with _stage('overview'):
+            overview = tiff_overview(image, detection_scale, tile_rows,
+                                     weights)
+        with _stage('find_sun'):
+            kwargs.setdefault('blur_sigma', 8 / detection_scale)
+            im_cx, im_cy, im_radius = _to_photo_pixels(
+                *find_sun_center_and_radius(overview, **kwargs),
+                detection_scale, overview.shape[0], height)
+        header = _photo_meta(filename, im_cx, im_cy, im_radius, eclipse_grid)
+        if contact_grid is not None:
+            header.update(_phase_meta(header, contact_grid))
+
+    with _stage('save'):
+        stream = fits.StreamingHDU(output,
+                                   _fits_header(header, (height, width),
+                                                dtype))
+        try:
+            # the first row of the map is the bottom row of the image
+            for stop in range(height, 0, -tile_rows):
+                start = max(stop - tile_rows, 0)
+                stream.write(_gray_rows(image, start, stop, weights,
+                                        dtype)[::-1].astype(
+                                            dtype.newbyteorder('>')))
+        finally:
+            stream.close()
+    return Map(output, memmap=True)
@@ -1,3 +1,9 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+
 import astropy.units as u
 from astropy.coordinates import EarthLocation
 import matplotlib.image
@@ -8,10 +14,14 @@ import matplotlib.pyplot as plt
 import sunpy.coordinates
 import sunpy.time
 import sunpy.sun
-from sunpy.net import hek
 from astropy.coordinates import SkyCoord
 from datetime import timedelta
 
+from eclipse.batch import find_photos, process_batch
+from eclipse.cache import ResultCache
+from eclipse.profiling import summarize_profiles
+from eclipse.service import InboxService
+
 f = '../sample-photos/Sun_with_one_AR.jpg'
 
 
@@ -64,84 +74,323 @@ def get_plate_scale(filename, sun_center):
     return (0.5 * u.deg / (800 * u.pix))
 
 
-# image meta data
-time = get_timestamp(f)
-latlon = get_gps_coordinates(f)
-sun_center = get_sun_center(f)
-plate_scale = get_plate_scale(f, sun_center)
-
-w = astropy.wcs.WCS(naxis=2)
-w.wcs.crpix = [2944, 1955] * u.pixel
-w.wcs.cdelt = np.ones(2) * plate_scale.to('arcsec/pix').value
-w.wcs.crval = [0, 0]
-w.wcs.ctype = ['TAN', 'TAN']
-w.wcs.cunit = ['arcsec', 'arcsec']
-w.wcs.dateobs = time.isoformat()
-header = dict(w.to_header())
-
-gps = EarthLocation(lat=latlon[0], lon=latlon[1])
-solar_rotation_angle = sunpy.coordinates.get_sun_orientation(gps, time)
-dsun = sunpy.coordinates.get_sunearth_distance(time.isoformat())
-
-header.update({'CROTA2': solar_rotation_angle.to('deg').value})
-header.update({'DSUN_OBS': dsun.to('m').value})
-header.update({'HGLN_OBS': sunpy.coordinates.get_sun_L0(time).to('deg').value})
-header.update({'HGLT_OBS': sunpy.coordinates.get_sun_B0(time).to('deg').value})
-header.update({'CTYPE1': 'HPLN-TAN'})
-header.update({'CTYPE2': 'HPLT-TAN'})
-header.update({'RSUN': dsun.to('m').value})
-header.update({'TELESCOP': 'CANON 70D'})
-header.update({
-    'RSUN_OBS':
-    np.arctan(sunpy.sun.constants.radius / dsun).to('arcsec').value
-})
-print(header)
-
-# read in the image
-im_rgb = matplotlib.image.imread(f)
-# remove color info
-im = np.average(im_rgb, axis=2)
-
-m = sunpy.map.Map((im, header))
-
-# get the location of Active regions from the HEK.
-hek_client = hek.HEKClient()
-tr = sunpy.time.TimeRange(time, timedelta(days=1))
-responses = hek_client.query(hek.attrs.Time(tr.start, tr.end), hek.attrs.AR)
-
-fig = plt.figure()
-ax = plt.subplot(projection=m)
-m.plot(axes=ax)
-coord = SkyCoord(0 * u.arcsec, 0 * u.arcsec, frame=m.coordinate_frame)
-ax.plot_coord(coord, color='b')
-m.draw_grid(axes=ax)
-m.draw_limb(axes=ax)
-for resp in responses:
-    coord = SkyCoord(
-        resp['hpc_x'] * u.arcsec,
-        resp['hpc_y'] * u.arcsec,
-        frame=m.coordinate_frame)
-    print(coord)
+def plot_photo(f):
+    """
+    Make a map of the photo and plot it with the active regions from the HEK.
+    """
+    # only needed here, and needs the sunpy[net] extras
+    from sunpy.net import hek
+
+    # image meta data
+    time = get_timestamp(f)
+    latlon = get_gps_coordinates(f)
+    sun_center = get_sun_center(f)
+    plate_scale = get_plate_scale(f, sun_center)
+
+    w = astropy.wcs.WCS(naxis=2)
+    w.wcs.crpix = [2944, 1955] * u.pixel
+    w.wcs.cdelt = np.ones(2) * plate_scale.to('arcsec/pix').value
+    w.wcs.crval = [0, 0]
+    w.wcs.ctype = ['TAN', 'TAN']
+    w.wcs.cunit = ['arcsec', 'arcsec']
+    w.wcs.dateobs = time.isoformat()
+    header = dict(w.to_header())
+
+    gps = EarthLocation(lat=latlon[0], lon=latlon[1])
+    solar_rotation_angle = sunpy.coordinates.get_sun_orientation(gps, time)
+    dsun = sunpy.coordinates.get_sunearth_distance(time.isoformat())
+
+    header.update({'CROTA2': solar_rotation_angle.to('deg').value})
+    header.update({'DSUN_OBS': dsun.to('m').value})
+    header.update({'HGLN_OBS': sunpy.coordinates.get_sun_L0(time).to('deg').value})
+    header.update({'HGLT_OBS': sunpy.coordinates.get_sun_B0(time).to('deg').value})
+    header.update({'CTYPE1': 'HPLN-TAN'})
+    header.update({'CTYPE2': 'HPLT-TAN'})
+    header.update({'RSUN': dsun.to('m').value})
+    header.update({'TELESCOP': 'CANON 70D'})
+    header.update({
+        'RSUN_OBS':
+        np.arctan(sunpy.sun.constants.radius / dsun).to('arcsec').value
+    })
+    print(header)
+
+    # read in the image
+    im_rgb = matplotlib.image.imread(f)
+    # remove color info
+    im = np.average(im_rgb, axis=2)
+
+    m = sunpy.map.Map((im, header))
+
+    # get the location of Active regions from the HEK.
+    hek_client = hek.HEKClient()
+    tr = sunpy.time.TimeRange(time, timedelta(days=1))
+    responses = hek_client.query(hek.attrs.Time(tr.start, tr.end), hek.attrs.AR)
+
+    fig = plt.figure()
+    ax = plt.subplot(projection=m)
+    m.plot(axes=ax)
+    coord = SkyCoord(0 * u.arcsec, 0 * u.arcsec, frame=m.coordinate_frame)
     ax.plot_coord(coord, color='b')
-plt.savefig('solar_photo_map.pdf', dpi=300)
-
-# now make a submap with a zoom in of the Sun
-top_right = SkyCoord(950 * u.arcsec, 950 * u.arcsec, frame=m.coordinate_frame)
-bottom_left = SkyCoord(
-    -900 * u.arcsec, -900 * u.arcsec, frame=m.coordinate_frame)
-m_submap = m.submap(bottom_left, top_right)
-
-fig = plt.figure()
-ax = plt.subplot(projection=m_submap)
-m_submap.plot(axes=ax)
-m_submap.draw_grid()
-m_submap.draw_limb()
-for resp in responses:
-    plt.scatter(resp['hpc_x'] * u.arcsec, resp['hpc_y'] * u.arcsec)
-    coord = SkyCoord(
-        resp['hpc_x'] * u.arcsec,
-        resp['hpc_y'] * u.arcsec,
-        frame=m_submap.coordinate_frame)
-    ax.plot_coord(coord, color='c')
-    print(resp['hpc_x'])
-plt.savefig('solar_photo_smap.pdf', dpi=300)
+    m.draw_grid(axes=ax)
+    m.draw_limb(axes=ax)
+    for resp in responses:
+        coord = SkyCoord(
+            resp['hpc_x'] * u.arcsec,
+            resp['hpc_y'] * u.arcsec,
+            frame=m.coordinate_frame)
+        print(coord)
+        ax.plot_coord(coord, color='b')
+    plt.savefig('solar_photo_map.pdf', dpi=300)
+
+    # now make a submap with a zoom in of the Sun
+    top_right = SkyCoord(950 * u.arcsec, 950 * u.arcsec, frame=m.coordinate_frame)
+    bottom_left = SkyCoord(
+        -900 * u.arcsec, -900 * u.arcsec, frame=m.coordinate_frame)
+    m_submap = m.submap(bottom_left, top_right)
+
+    fig = plt.figure()
+    ax = plt.subplot(projection=m_submap)
+    m_submap.plot(axes=ax)
+    m_submap.draw_grid()
+    m_submap.draw_limb()
+    for resp in responses:
+        plt.scatter(resp['hpc_x'] * u.arcsec, resp['hpc_y'] * u.arcsec)
+        coord = SkyCoord(
+            resp['hpc_x'] * u.arcsec,
+            resp['hpc_y'] * u.arcsec,
+            frame=m_submap.coordinate_frame)
+        ax.plot_coord(coord, color='c')
+        print(resp['hpc_x'])
+    plt.savefig('solar_photo_smap.pdf', dpi=300)
+
+
+def _add_conversion_arguments(parser):
+    """
+    Add the options of the conversion, which are also the parameters of the
+    cache key, so that ``invalidate`` takes the same options as ``batch`` and
+    ``serve``.
+    """
+    parser.add_argument('--pyramid-levels', type=int, default=2,
+                        help='pyramid levels for finding the Sun')
+    parser.add_argument('--detection-scale', type=int, default=None,
+                        help='find the Sun in the photo reduced by this '
+                             'factor (2, 4 or 8) while decoding')
+    parser.add_argument('--dtype', default='float64',
+                        choices=['float64', 'float32', 'uint16'],
+                        help='the type of the data of the maps')
+    parser.add_argument('--eclipse-grid', default=None,
+                        help='a saved eclipse grid, to estimate the time and '
+                             'location of photos without them in their EXIF '
+                             'data')
+    parser.add_argument('--contact-grid', default=None,
+                        help='a saved contact grid, to write the phase of the '
+                             'eclipse to the header of each map')
+
+
+def _batch_kwargs(args):
+    """
+    The keyword arguments of the conversion, which are also the parameters of
+    the cache key.
+    """
+    kwargs = {'pyramid_levels': args.pyramid_levels, 'dtype': args.dtype}
+    if args.detection_scale is not None:
+        kwargs['detection_scale'] = args.detection_scale
+    if args.eclipse_grid is not None:
+        kwargs['eclipse_grid'] = args.eclipse_grid
+    if args.contact_grid is not None:
+        kwargs['contact_grid'] = args.contact_grid
+    return kwargs
+
+
+def print_profile_report(summary, file=sys.stderr):
+    """
+    Print the time and peak memory of each stage of a batch.
+    """
+    print(f"{'stage':<16}{'photos':>8}{'total s':>10}{'mean s':>10}"
+          f"{'max s':>10}{'peak MB':>10}", file=file)
+    for name, stage in summary.items():
+        peak = stage['max_peak_bytes']
+        peak = f'{peak / 1024 ** 2:10.1f}' if peak is not None else f"{'-':>10}"
+        print(f"{name:<16}{stage['count']:>8}{stage['total_time']:>10.3f}"
+              f"{stage['mean_time']:>10.3f}{stage['max_time']:>10.3f}{peak}",
+              file=file)
+
+
+def batch(args):
+    """
+    Convert all the photos in a directory or matching a glob to FITS files.
+    """
+    filenames = find_photos(args.path)
+    cache = None
+    if args.cache is not None:
+        max_bytes = args.cache_size * 1024 ** 2 if args.cache_size else None
+        cache = ResultCache(args.cache, max_bytes=max_bytes)
+    results = process_batch(filenames, args.output, max_workers=args.workers,
+                            overwrite=args.overwrite, cache=cache,
+                            profile=args.profile is not None,
+                            index=args.index, **_batch_kwargs(args))
+    n_failed = 0
+    profiles = {}
+    for i, result in enumerate(results, start=1):
+        progress = f'[{i}/{len(filenames)}] {result.filename}'
+        if result.error is None:
+            print(f'{progress} -> {result.output}')
+        else:
+            n_failed += 1
+            print(f'{progress} failed: {result.error}', file=sys.stderr)
+        if result.profile is not None:
+            profiles[result.filename] = result.profile
+    print(f'{len(filenames) - n_failed} converted, {n_failed} failed')
+
+    if args.profile is not None:
+        summary = summarize_profiles(profiles.values())
+        print_profile_report(summary)
+        if args.profile != '-':
+            with open(args.profile, 'w') as report:
+                json.dump({'summary': summary, 'photos': profiles}, report,
+                          indent=1)
+    return 1 if n_failed else 0
+
+
+def format_stats(stats):
+    """
+    Format the queue depth and latency of the service on one line.
+    """
+    latency = ' '.join(
+        f"p{p}={stats[f'latency_p{p}']:.1f}s" for p in (50, 90, 99)
+        if stats[f'latency_p{p}'] is not None)
+    return (f"queued={stats['queued']} running={stats['running']} "
+            f"converted={stats['converted']} failed={stats['failed']} "
+            f"{latency}").rstrip()
+
+
+async def _serve(service, report_interval):
+    def print_result(result, latency):
+        if result.error is None:
+            print(f'{result.filename} -> {result.output} ({latency:.1f}s)')
+        else:
+            print(f'{result.filename} failed: {result.error}',
+                  file=sys.stderr)
+
+    async def report():
+        while True:
+            await asyncio.sleep(report_interval)
+            print(format_stats(service.stats()), file=sys.stderr)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, service.stop)
+        except NotImplementedError:
+            pass
+    reporter = asyncio.create_task(report())
+    try:
+        await service.run(on_result=print_result)
+    finally:
+        reporter.cancel()
+    print(format_stats(service.stats()), file=sys.stderr)
+
+
+def serve(args):
+    """
+    Convert photos to FITS files as they are uploaded to a directory.
+    """
+    service = InboxService(args.inbox, args.output, max_workers=args.workers,
+                           max_queue=args.max_queue,
+                           poll_interval=args.poll_interval,
+                           overwrite=args.overwrite, cache=args.cache,
+                           index=args.index, **_batch_kwargs(args))
+    asyncio.run(_serve(service, args.report_interval))
+    return 0
+
+
+def invalidate(args):
+    """
+    Remove the results of the photos, or of every photo, from the cache.
+    """
+    cache = ResultCache(args.cache)
+    if not args.photos:
+        cache.invalidate()
+        return 0
+    params = _batch_kwargs(args)
+    for filename in args.photos:
+        cache.invalidate(cache.key(filename, params))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process solar eclipse photos.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    plot_parser = subparsers.add_parser('plot', help='plot a single photo')
+    plot_parser.add_argument('filename', nargs='?', default=f)
+
+    batch_parser = subparsers.add_parser(
+        'batch', help='convert a directory or glob of photos to FITS files')
+    batch_parser.add_argument('path', help='a directory or a glob pattern')
+    batch_parser.add_argument('-o', '--output', default='.',
+                              help='the directory to write FITS files to')
+    batch_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help='the number of processes, defaults to the '
+                                   'number of CPUs')
+    _add_conversion_arguments(batch_parser)
+    batch_parser.add_argument('--overwrite', action='store_true',
+                              help='overwrite existing FITS files')
+    batch_parser.add_argument('--cache', default=None,
+                              help='a directory to cache results in, so that '
+                                   'an interrupted batch can be resumed')
+    batch_parser.add_argument('--cache-size', type=float, default=None,
+                              help='the largest size of the cache in MB')
+    batch_parser.add_argument('--index', default=None,
+                              help='an SQLite file to add the time, location '
+                                   'and disk of each photo to')
+    batch_parser.add_argument('--profile', nargs='?', const='-', default=None,
+                              help='print the time and memory of each stage, '
+                                   'and write them for every photo to this '
+                                   'JSON file if given')
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='convert photos as they are uploaded to a directory')
+    serve_parser.add_argument('inbox', help='the directory photos arrive in')
+    serve_parser.add_argument('-o', '--output', default='.',
+                              help='the directory to write FITS files to')
+    serve_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help='the number of processes, defaults to the '
+                                   'number of CPUs')
+    serve_parser.add_argument('--max-queue', type=int, default=None,
+                              help='the largest number of photos waiting, '
+                                   'defaults to twice the processes')
+    serve_parser.add_argument('--poll-interval', type=float, default=1.0,
+                              help='the seconds between polls of the inbox')
+    serve_parser.add_argument('--report-interval', type=float, default=10.0,
+                              help='the seconds between reports of the queue '
+                                   'and latency')
+    _add_conversion_arguments(serve_parser)
+    serve_parser.add_argument('--overwrite', action='store_true',
+                              help='overwrite existing FITS files')
+    serve_parser.add_argument('--cache', default=None,
+                              help='a directory to cache results in')
+    serve_parser.add_argument('--index', default=None,
+                              help='an SQLite file to add the time, location '
+                                   'and disk of each photo to')
+
+    invalidate_parser = subparsers.add_parser(
+        'invalidate', help='remove results from the batch cache')
+    invalidate_parser.add_argument('cache', help='the cache directory')
+    invalidate_parser.add_argument('photos', nargs='*',
+                                   help='the photos to remove, defaults to all')
+    _add_conversion_arguments(invalidate_parser)
+
+    args = parser.parse_args(argv)
+    if args.command == 'batch':
+        return batch(args)
+    if args.command == 'serve':
+        return serve(args)
+    if args.command == 'invalidate':
+        return invalidate(args)
+    plot_photo(getattr(args, 'filename', f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())